@@ -15,10 +15,13 @@
 ############################################################################
 
 
-import logging
-from logging import config
-from galenpy.utils.logger import get_logger_config_path
+import os
+
+from galenpy.utils.logger import configure_logging
 
 __version__ = "0.1.3"
 
-logging.config.fileConfig(get_logger_config_path())
+""" Importing galenpy leaves logging as configured by the application, unless the GALEN_API_CONFIGURE_LOGGING
+    environment variable is set to 1, in which case the bundled configuration is applied as configure_logging() does."""
+if os.getenv('GALEN_API_CONFIGURE_LOGGING', '0') == '1':
+    configure_logging()
@@ -0,0 +1,385 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+
+"""
+asyncio flavour of the Galen API, for harnesses driving many browser sessions from a single event loop.
+It requires Python 3.5 or later.
+
+Example usage.
+async def check_home_page(galen, remote_url):
+    session_id = await galen.new_session(remote_url, DesiredCapabilities.CHROME)
+    await galen.execute(session_id, Command.GET, {'url': 'http://example.com'})
+    report = await galen.check_layout(session_id, 'homePage.spec', ['phone'], None)
+    await galen.quit(session_id)
+    return report
+
+galen = await AsyncGalen.create()
+reports = await asyncio.gather(*[check_home_page(galen, remote_url) for _ in range(50)])
+await galen.generate_report("target/galen")
+"""
+
+import asyncio
+import json
+import logging
+import struct
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.errorhandler import ErrorHandler
+from thrift import Thrift
+from thrift.Thrift import TApplicationException
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import TTransport
+from thrift.transport.TTransport import TTransportException
+
+from galenpy.exception import FileNotFoundError, ServiceStartupError
+from galenpy.galen_webdriver import to_response_dict
+from galenpy.remote_service_lifecycle import is_unix_socket
+from galenpy.thrift_client import GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, INITIAL_PROBE_DELAY, LEASE_TTL, \
+    MAX_PROBE_DELAY, POOL_SIZE, STARTUP_TIMEOUT, start_galen_remote_api_service, stop_galen_remote_api_service
+from galenpy.utils.specs import spec_bundle
+from galenpy.pythrift import GalenApiRemoteService
+from galenpy.pythrift.ttypes import RemoteWebDriverException, ResponseFormat, SpecFile, SpecNotFoundException
+
+
+MAX_SEQUENCE_ID = 2 ** 31 - 1
+
+logger = logging.getLogger()
+
+
+class AsyncConnection(object):
+    """
+    Framed connection to the service driven by the asyncio event loop. Calls are written as soon as they are issued
+    and responses are matched to them by sequence id, so that many calls can be in flight over the same connection.
+    Calls are encoded and decoded through the generated Thrift client, over in-memory transports.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._pending = {}
+        self._sequence_id = 0
+        self._reading = asyncio.ensure_future(self._read_responses())
+
+    @classmethod
+    async def open(cls, host, port):
+        if is_unix_socket(port):
+            reader, writer = await asyncio.open_unix_connection(port)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    async def call(self, method, *args):
+        if self._reading.done():
+            raise TTransportException(TTransportException.NOT_OPEN, "Connection to the service is closed")
+        self._sequence_id = self._sequence_id % MAX_SEQUENCE_ID + 1
+        output = TTransport.TMemoryBuffer()
+        client = GalenApiRemoteService.Client(TBinaryProtocol.TBinaryProtocol(output))
+        client._seqid = self._sequence_id
+        getattr(client, 'send_' + method)(*args)
+        payload = output.getvalue()
+
+        sequence_id = self._sequence_id
+        response = asyncio.get_event_loop().create_future()
+        self._pending[sequence_id] = (response, method)
+        try:
+            self._writer.write(struct.pack('!i', len(payload)) + payload)
+            await self._writer.drain()
+        except Exception:
+            self._pending.pop(sequence_id, None)
+            raise
+        return await response
+
+    def close(self):
+        self._writer.close()
+        self._reading.cancel()
+
+    async def _read_responses(self):
+        error = TTransportException(TTransportException.END_OF_FILE, "Connection closed by the service")
+        try:
+            while True:
+                size, = struct.unpack('!i', await self._reader.readexactly(4))
+                self._dispatch(await self._reader.readexactly(size))
+        except (asyncio.IncompleteReadError, OSError) as e:
+            error = TTransportException(TTransportException.END_OF_FILE, str(e))
+        finally:
+            pending, self._pending = self._pending, {}
+            for response, _ in pending.values():
+                if not response.done():
+                    response.set_exception(error)
+
+    def _dispatch(self, frame):
+        _, _, sequence_id = TBinaryProtocol.TBinaryProtocol(TTransport.TMemoryBuffer(frame)).readMessageBegin()
+        response, method = self._pending.pop(sequence_id, (None, None))
+        if response is None or response.done():
+            return
+        client = GalenApiRemoteService.Client(TBinaryProtocol.TBinaryProtocol(TTransport.TMemoryBuffer(frame)))
+        try:
+            response.set_result(getattr(client, 'recv_' + method)())
+        except Exception as e:
+            response.set_exception(e)
+
+
+class AsyncThriftClient(object):
+    """
+    asyncio flavour of ThriftClient. Calls are spread over a few connections, picking the one with fewest calls in
+    flight, as the service answers the calls sent over a connection one at a time.
+    """
+    def __init__(self, connections):
+        self._connections = connections
+        self._uploaded_specs = {}
+        self._lease_id = None
+        self._heartbeat = None
+
+    @classmethod
+    async def create(cls, service_port=GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, startup_timeout=STARTUP_TIMEOUT,
+                     connections=POOL_SIZE, host='localhost'):
+        """
+        Starts the service if needed, opens the given number of connections to it once it is ready and takes a lease
+        on it.
+        """
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, start_galen_remote_api_service, service_port, startup_timeout)
+            opened = [await wait_for_service(service_port, startup_timeout, host)]
+            for _ in range(connections - 1):
+                opened.append(await AsyncConnection.open(host, service_port))
+        except Thrift.TException as tx:
+            logger.error("Could not connect to Galen API service on port {port}: {error}"
+                         .format(port=service_port, error=tx.message))
+            await loop.run_in_executor(None, stop_galen_remote_api_service, service_port)
+            raise Exception('%s' % (tx.message))
+        except ServiceStartupError as e:
+            logger.error("Could not start Galen API service on port {port}: {error}".format(port=service_port, error=e))
+            raise
+        client = cls(opened)
+        await client.hold_lease()
+        return client
+
+    async def initialize(self, remote_url):
+        await self._call('initialize', remote_url)
+        return self
+
+    async def execute(self, session_id, command, request_params, response_format=ResponseFormat.JSON):
+        return await self._call('execute', session_id, command, request_params, response_format)
+
+    async def execute_batch(self, session_id, commands, response_format=ResponseFormat.JSON):
+        return await self._call('execute_batch', session_id, commands, response_format)
+
+    async def get_active_drivers(self):
+        return await self._call('active_drivers')
+
+    async def hold_lease(self, ttl=LEASE_TTL):
+        """
+        Acquires a lease on the service and keeps renewing it from a task until the client is closed, so that the
+        service does not stop itself while it is used.
+        """
+        try:
+            self._lease_id = await self._call('acquire_lease', int(ttl * 1000))
+        except TApplicationException:
+            logger.warning("Galen API service does not support leases")
+            return
+        self._heartbeat = asyncio.ensure_future(self._renew_lease(ttl))
+
+    async def release_lease(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+            await self._call('release_lease', self._lease_id)
+
+    async def _renew_lease(self, ttl):
+        while True:
+            await asyncio.sleep(ttl / 3.0)
+            try:
+                if not await self._call('renew_lease', self._lease_id):
+                    logger.warning("Lease on Galen API service expired, acquiring a new one")
+                    self._lease_id = await self._call('acquire_lease', int(ttl * 1000))
+            except (OSError, Thrift.TException) as e:
+                logger.warning("Could not renew lease on Galen API service: {0}".format(e))
+
+    async def shut_service(self):
+        await self.release_lease()
+        try:
+            await self._call('shut_service')
+        except TTransportException:
+            pass
+        finally:
+            self.close()
+
+    async def register_test(self, test_name):
+        await self._call('register_test', test_name)
+
+    async def check_layout(self, driver_session_id, spec_name, included_tags, excluded_tags, use_cache=False):
+        try:
+            return await self._call('check_layout', driver_session_id, spec_name, included_tags, excluded_tags,
+                                    use_cache)
+        except SpecNotFoundException as e:
+            logger.error(e.message)
+            raise
+
+    async def upload_spec(self, bundle):
+        key = (bundle.digest, bundle.spec)
+        if key not in self._uploaded_specs:
+            files = [SpecFile(path=file_path, content=content) for file_path, content in bundle.files]
+            try:
+                self._uploaded_specs[key] = await self._call('upload_spec', bundle.spec, files)
+            except SpecNotFoundException as e:
+                logger.error(e.message)
+                raise
+        return self._uploaded_specs[key]
+
+    async def finalize(self, test_name, report):
+        try:
+            await self._call('append', test_name, report)
+        except Exception as e:
+            logger.error(e)
+            raise
+
+    async def generate_report(self, report_folder_path):
+        await self._call('generate_report', report_folder_path)
+
+    def close(self):
+        """
+        Closes the connections to the service. A lease not released beforehand through release_lease() is left to
+        expire.
+        """
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        for connection in self._connections:
+            connection.close()
+
+    async def _call(self, method, *args):
+        connection = min(self._connections, key=lambda c: c.in_flight)
+        return await connection.call(method, *args)
+
+
+class AsyncGalen(object):
+    """
+    asyncio flavour of the Galen API class. As WebDriver instances are blocking, browser sessions are driven through
+    their session id by sending JsonWire commands.
+    """
+    def __init__(self, thrift_client):
+        self.thrift_client = thrift_client
+        self.error_handler = ErrorHandler()
+
+    @classmethod
+    async def create(cls, **kwargs):
+        """
+        Creates an instance backed by an AsyncThriftClient created with the given keyword arguments.
+        """
+        return cls(await AsyncThriftClient.create(**kwargs))
+
+    async def new_session(self, remote_url, desired_capabilities):
+        """
+        Opens a browser session on the given Selenium Grid.
+        :return: the id of the session.
+        """
+        await self.thrift_client.initialize(remote_url)
+        response = await self.execute(None, Command.NEW_SESSION, {'desiredCapabilities': desired_capabilities})
+        return response['sessionId']
+
+    async def execute(self, session_id, command, params=None):
+        """
+        Executes a JsonWire command in the given session.
+        :param command: a selenium.webdriver.remote.Command name.
+        :return: a dict containing the response from the RemoteWebDriver service.
+        """
+        params = dict(params or {})
+        if session_id is not None:
+            params['sessionId'] = session_id
+        try:
+            response = to_response_dict(await self.thrift_client.execute(session_id, command, json.dumps(params)))
+        except RemoteWebDriverException as e:
+            raise WebDriverException(e.message)
+        self.error_handler.check_response(response)
+        return response
+
+    async def quit(self, session_id):
+        await self.execute(session_id, Command.QUIT)
+
+    async def check_layout(self, session_id, spec, included_tags, excluded_tags, use_cache=False):
+        """
+        Validates the layout of the page open in the given session.
+        :param use_cache: serve the report of an identical check already run on the same page state, if any.
+        :return: CheckLayoutReport mapping info from the generated LayoutReport object in the Galen Server.
+        """
+        try:
+            return await self.thrift_client.check_layout(session_id, spec, included_tags, excluded_tags, use_cache)
+        except SpecNotFoundException as e:
+            raise IOError("Spec was not found: " + str(e.message))
+
+    async def upload_spec(self, spec):
+        """
+        Uploads a local spec along with the files it imports, once per content, so that it can be checked by a service
+        which does not have it.
+        :return: the path of the spec to be passed to check_layout.
+        """
+        try:
+            return await self.thrift_client.upload_spec(spec_bundle(spec))
+        except (FileNotFoundError, SpecNotFoundException) as e:
+            raise IOError("Spec was not found: " + str(e))
+
+    async def register_test(self, test_name):
+        await self.thrift_client.register_test(test_name)
+
+    async def append(self, test_name, report_tree):
+        """
+        Appends the report of a registered test, e.g. the report attribute of a TestReport.
+        """
+        await self.thrift_client.finalize(test_name, report_tree)
+
+    async def generate_report(self, report_folder):
+        logger.info("Generating reports in " + report_folder)
+        await self.thrift_client.generate_report(report_folder)
+
+    def close(self):
+        self.thrift_client.close()
+
+
+async def wait_for_service(server_port, timeout=STARTUP_TIMEOUT, host='localhost'):
+    """
+    asyncio flavour of thrift_client.wait_for_service().
+    """
+    loop = asyncio.get_event_loop()
+    started_at = loop.time()
+    deadline = started_at + timeout
+    delay = INITIAL_PROBE_DELAY
+    attempts = 0
+    while True:
+        attempts += 1
+        connection = None
+        try:
+            connection = await AsyncConnection.open(host, server_port)
+            try:
+                await connection.call('server_info')
+            except TApplicationException:
+                pass
+            logger.info("Galen API service on port {port} ready after {elapsed:.3f}s ({attempts} attempts)"
+                        .format(port=server_port, elapsed=loop.time() - started_at, attempts=attempts))
+            return connection
+        except (OSError, TTransportException) as e:
+            if connection:
+                connection.close()
+            if loop.time() + delay > deadline:
+                raise TTransportException(TTransportException.TIMED_OUT,
+                                          "Galen API service on port {port} not ready after {timeout}s: {error}"
+                                          .format(port=server_port, timeout=timeout, error=e))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_PROBE_DELAY)
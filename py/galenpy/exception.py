@@ -28,3 +28,11 @@ class FileNotFoundError(Exception):
     """
     def __init__(self, *args, **kwargs):
         super(FileNotFoundError, self).__init__(*args, **kwargs)
+
+
+class ServiceStartupError(Exception):
+    """
+    The Galen API service could not be started.
+    """
+    def __init__(self, *args, **kwargs):
+        super(ServiceStartupError, self).__init__(*args, **kwargs)
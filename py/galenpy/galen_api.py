@@ -15,16 +15,27 @@
 ############################################################################
 
 import logging
+from collections import namedtuple
+from os import path
+from time import time
 
+from galenpy import placement
 from galenpy.exception import IllegalMethodCallException, FileNotFoundError
-from galenpy.galen_webdriver import GalenRemoteWebDriver
-from galenpy.thrift_client import ThriftClient
-from pythrift.ttypes import SpecNotFoundException
+from galenpy.thrift_client import POOL_SIZE, ThriftClient, quit_services_if_inactive
+from galenpy.utils.specs import spec_bundle
+from pythrift.ttypes import LayoutCheck, RemoteWebDriverException, SpecNotFoundException, Viewport
 
 
 logger = logging.getLogger()
 
 
+LayoutCheckResult = namedtuple('LayoutCheckResult', ['driver', 'spec', 'report', 'elapsed'])
+
+""" Result of the check of a device by check_layout_matrix(): the CheckLayoutReport, whether the window was resized for
+    it and the time in seconds it took, resize included."""
+DeviceCheckResult = namedtuple('DeviceCheckResult', ['name', 'size', 'tags', 'driver', 'report', 'resized', 'elapsed'])
+
+
 class Galen(object):
     """
     Galen API class.
@@ -40,11 +51,19 @@ class Galen(object):
         galen_api.generate_report("target/galen")
     """
 
-    def __init__(self, thrift_client=None):
+    def __init__(self, thrift_client=None, use_cache=False, upload_specs=False):
+        """
+        :param thrift_client: client to the Galen service, by default the one of the first driver checked.
+        :param use_cache: when True, checks already run with the same spec and tags on a page in the same state are
+            not run again and the report stored by the service is served instead.
+        :param upload_specs: when True, specs are read locally and uploaded to the service along with the files they
+            import, once per content, so that the service can run on a host which does not have them.
+        """
         self.thrift_client = thrift_client
+        self.use_cache = use_cache
+        self.upload_specs = upload_specs
 
     def check_layout(self, driver, spec, included_tags, excluded_tags):
-        #TODO add multiple specs.
         """
         Main validation method.
         :param driver: An instance of GalenWebDriver.
@@ -53,26 +72,212 @@ class Galen(object):
         :param excluded_tags: list of tags excluded from check.
         :return: CheckLayoutReport mapping info from the generated LayoutReport object in the Galen Server.
         """
-        if not isinstance(driver, GalenRemoteWebDriver):
-            raise ValueError("Provided driver object is not an instance of GalenWebDriver")
-        self.thrift_client = driver.thrift_client
+        thrift_client = self._thrift_client_of(driver)
+        try:
+            return thrift_client.check_layout(driver.session_id, self._spec_on_service(thrift_client, spec),
+                                              included_tags, excluded_tags, self.use_cache)
+        except SpecNotFoundException as e:
+            raise IOError("Spec was not found: " + str(e.message))
+
+    def check_layouts(self, driver, checks):
+        """
+        Validates the page under test against several specs and tag sets in a single call. The page is scanned once
+        and its elements are shared by all the checks.
+        :param driver: An instance of GalenWebDriver.
+        :param checks: list of (spec, included_tags, excluded_tags) tuples.
+        :return: list of CheckLayoutReport, one per check in the same order.
+        """
+        thrift_client = self._thrift_client_of(driver)
         try:
-            return self.thrift_client.check_layout(driver.session_id, spec, included_tags, excluded_tags)
+            layout_checks = [LayoutCheck(specs=self._spec_on_service(thrift_client, spec), included_tags=included_tags,
+                                         excluded_tags=excluded_tags)
+                             for spec, included_tags, excluded_tags in checks]
+            return thrift_client.check_layouts(driver.session_id, layout_checks, self.use_cache)
         except SpecNotFoundException as e:
             raise IOError("Spec was not found: " + str(e.message))
 
+    def check_layout_many(self, jobs, max_workers=None):
+        """
+        Runs layout checks on several drivers concurrently, e.g. the same page open in several browsers or viewports,
+        so that they complete in about the time of the slowest one.
+        :param jobs: list of (driver, spec, included_tags, excluded_tags) tuples.
+        :param max_workers: number of checks run at the same time, by default as many as the jobs up to the size of
+            the connection pool.
+        :return: list of futures, one per job in the same order, resolving to a LayoutCheckResult which holds the
+            CheckLayoutReport along with the time in seconds the check took.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        for job in jobs:
+            self._thrift_client_of(job[0])
+        executor = ThreadPoolExecutor(max_workers=max_workers or max(1, min(len(jobs), POOL_SIZE)))
+        try:
+            return [executor.submit(self._timed_check_layout, *job) for job in jobs]
+        finally:
+            executor.shutdown(wait=False)
+
+    def check_layout_matrix(self, driver, url, spec, devices, test_report=None, drivers=None):
+        """
+        Validates a page in the viewports of several devices. The page is loaded once per session and the service
+        resizes the window for each device, skipping resizes between devices of the same size, which are checked one
+        after the other.
+        :param driver: An instance of GalenWebDriver.
+        :param url: url of the page, which is checked as currently loaded when None.
+        :param spec: Specs to be run on the page under test.
+        :param devices: list of (name, (width, height), included_tags) tuples.
+        :param test_report: TestReport the reports of the devices are added to as layout nodes, in the order of the
+            devices. It must be bound to the same service as the drivers.
+        :param drivers: other instances of GalenWebDriver, open in the same browser, the devices are spread across so
+            that they are checked concurrently. Devices of the same size are checked in the same session.
+        :return: list of DeviceCheckResult, one per device in the same order.
+        """
+        sessions = [driver] + list(drivers or [])
+        for session in sessions:
+            thrift_client = self._thrift_client_of(session)
+            if test_report is not None and thrift_client.pool is not test_report.thrift_client.pool:
+                raise ValueError("Drivers checked and test report must be bound to the same Galen service")
+        if not devices:
+            return []
+        # Devices of the same size are grouped, in the order their size first appears, and each session gets a share
+        # of the groups.
+        groups = []
+        group_of_size = {}
+        for index, (_, size, _) in enumerate(devices):
+            size = tuple(size)
+            if size not in group_of_size:
+                group_of_size[size] = len(groups)
+                groups.append([])
+            groups[group_of_size[size]].append(index)
+        shares = [[index for group in groups[offset::len(sessions)] for index in group]
+                  for offset in range(len(sessions))]
+        jobs = [(session, share) for session, share in zip(sessions, shares) if share]
+        if len(jobs) == 1:
+            results = self._check_viewports(jobs[0][0], url, spec, devices, jobs[0][1])
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=len(jobs))
+            try:
+                futures = [executor.submit(self._check_viewports, session, url, spec, devices, share)
+                           for session, share in jobs]
+                results = [result for future in futures for result in future.result()]
+            finally:
+                executor.shutdown(wait=True)
+        results.sort(key=lambda indexed_result: indexed_result[0])
+        device_results = [result for _, result in results]
+        if test_report is not None:
+            for result in device_results:
+                test_report.add_layout_report_node("{name} ({width}x{height})".format(
+                    name=result.name, width=result.size[0], height=result.size[1]), result.report)
+        return device_results
+
+    def _check_viewports(self, driver, url, spec, devices, indexes):
+        """
+        Checks the devices at the given indexes in a single session.
+        :return: list of (index, DeviceCheckResult) tuples.
+        """
+        thrift_client = self._thrift_client_of(driver)
+        if url is not None:
+            driver.get(url)
+        viewports = [Viewport(name=devices[index][0], width=devices[index][1][0], height=devices[index][1][1],
+                              included_tags=devices[index][2], excluded_tags=None) for index in indexes]
+        try:
+            reports = thrift_client.check_layout_viewports(driver.session_id,
+                                                           self._spec_on_service(thrift_client, spec), viewports,
+                                                           self.use_cache)
+        except SpecNotFoundException as e:
+            raise IOError("Spec was not found: " + str(e.message))
+        except RemoteWebDriverException as e:
+            from selenium.common.exceptions import WebDriverException
+            raise WebDriverException(e.message)
+        finally:
+            # The window was resized by the service, behind the back of the driver.
+            driver.invalidate_read_cache()
+        return [(index, DeviceCheckResult(devices[index][0], tuple(devices[index][1]), devices[index][2], driver,
+                                          viewport_report.report, viewport_report.resized,
+                                          viewport_report.elapsed_millis / 1000.0))
+                for index, viewport_report in zip(indexes, reports)]
+
+    def _timed_check_layout(self, driver, spec, included_tags, excluded_tags):
+        started_at = time()
+        report = self.check_layout(driver, spec, included_tags, excluded_tags)
+        return LayoutCheckResult(driver, spec, report, time() - started_at)
+
+    def _spec_on_service(self, thrift_client, spec):
+        """
+        Returns the path the service reads the spec from, which is the local one unless specs are uploaded.
+        """
+        if not self.upload_specs:
+            return spec
+        try:
+            return thrift_client.upload_spec(spec_bundle(spec))
+        except FileNotFoundError as e:
+            raise SpecNotFoundException(str(e))
+
+    def _thrift_client_of(self, driver):
+        """
+        Returns the client the driver is bound to. Checks do not replace the client of this object once set, so that
+        it can be shared by threads checking different drivers.
+        """
+        from galenpy.galen_webdriver import GalenRemoteWebDriver
+        if not isinstance(driver, GalenRemoteWebDriver):
+            raise ValueError("Provided driver object is not an instance of GalenWebDriver")
+        if self.thrift_client is None:
+            self.thrift_client = driver.thrift_client
+        return driver.thrift_client
+
     def generate_report(self, report_folder):
         """
-        Generate Galen reports in the provided folder.
+        Generate Galen reports in the provided folder, with the tests of all the services sessions were placed on.
         :param report_folder: target folder.
         """
         if not self.thrift_client:
             raise IllegalMethodCallException("generate_report() must be called after check_layout()")
         logger.info("Generating reports in " + report_folder)
-        self.thrift_client.generate_report(report_folder)
-        self.thrift_client.quit_service_if_inactive()
+        if len(placement.SERVICE_ADDRESSES) > 1:
+            placement.generate_report(report_folder)
+            _quit_services_if_inactive()
+        else:
+            self.thrift_client.generate_report(report_folder)
+            self.thrift_client.quit_service_if_inactive()
+
+    def write_report_shard(self, shard_folder):
+        """
+        Writes the tests reported so far to a report shard, which is later merged with the shards of other test workers
+        into a single report by merge_galen_report_shards().
+        :param shard_folder: folder of the shard, which keeps the tests already in it unless they have the same name.
+        """
+        if not self.thrift_client:
+            raise IllegalMethodCallException("write_report_shard() must be called after check_layout()")
+        logger.info("Writing report shard in " + shard_folder)
+        if len(placement.SERVICE_ADDRESSES) > 1:
+            placement.write_report_shard(shard_folder)
+            _quit_services_if_inactive()
+        else:
+            self.thrift_client.write_report_shard(path.abspath(shard_folder))
+            self.thrift_client.quit_service_if_inactive()
+
+
+def _quit_services_if_inactive():
+    quit_services_if_inactive([ThriftClient(address) for address in placement.running_services()])
 
 
 def generate_galen_report(report_folder):
     thrift_client = ThriftClient()
     Galen(thrift_client).generate_report(report_folder)
+
+
+def write_galen_report_shard(shard_folder):
+    thrift_client = ThriftClient()
+    Galen(thrift_client).write_report_shard(shard_folder)
+
+
+def merge_galen_report_shards(shard_folders, report_folder):
+    """
+    Generates the report of the tests of several report shards.
+    :param shard_folders: folders of the shards.
+    :param report_folder: target folder.
+    """
+    logger.info("Merging {0} report shards in {1}".format(len(shard_folders), report_folder))
+    thrift_client = ThriftClient()
+    thrift_client.merge_report_shards([path.abspath(shard_folder) for shard_folder in shard_folders],
+                                      path.abspath(report_folder))
+    thrift_client.quit_service_if_inactive()
@@ -14,24 +14,39 @@
 # limitations under the License.                                           #
 ############################################################################
 
+import itertools
 import uuid
 from galenpy.pythrift.ttypes import ReportTree, ReportNode, NodeType
-from galenpy.thrift_client import ThriftClient
 
 
 INFO = "info"
 WARN = "warn"
 ERROR = "error"
 
+""" Node ids are unique across processes through a random prefix and within a process through a counter, which is
+    much cheaper than generating a UUID for each node."""
+_NODE_ID_PREFIX = uuid.uuid4().hex[:16]
+_node_ids = itertools.count()
+
 
 class TestReport(object):
-    def __init__(self, test_name, thrift_client=None):
+    """
+    Report of a test, sent to the service by finalize(). A report created with a chunk size is streamed: its nodes are
+    sent in chunks as they are added, so that memory does not grow with the size of the report and the nodes already
+    sent are kept by the service even if the test does not finalize its report.
+    When sessions are spread across several services, a report holding layout checks is to be created with the
+    thrift_client of the driver checked, since the layout reports are kept by its service.
+    """
+    def __init__(self, test_name, thrift_client=None, chunk_size=None):
         super(TestReport, self).__init__()
         self.test_name = test_name
         self.report = ReportTree(root_id=generate_random_string())
         self.report.nodes = []
+        self.chunk_size = chunk_size
         self.thrift_client = thrift_client
         if not self.thrift_client:
+            # Imported here, so that reports can be built without loading the client and the service lifecycle.
+            from galenpy.thrift_client import ThriftClient
             self.thrift_client = ThriftClient()
 
         self.thrift_client.register_test(test_name)
@@ -42,33 +57,38 @@ class TestReport(object):
         return self
 
     def add_layout_report_node(self, name, layout_report):
-        self.report.nodes.append(
+        self._add_node(
             ReportNode(unique_id=layout_report.unique_id, name=name, parent_id=self.report.root_id, nodes_ids=[],
                        node_type=NodeType.LAYOUT))
         return self
 
     def _add_node_tree(self, node_tree, parent_id):
-        if node_tree.has_children():
-            for node in node_tree.children:
-                self._add_node_tree(node, node_tree.unique_id)
-            self.report.nodes.append(ReportNode(node_tree.unique_id, node_tree.name, node_tree.status, parent_id,
-                                                 [c.unique_id for c in node_tree.children], node_tree.attachment,
-                                                 node_tree.time, node_tree.node_type))
-
-        else:
-            self.report.nodes.append(
-                ReportNode(node_tree.unique_id, node_tree.name, node_tree.status, parent_id, [], node_tree.attachment,
-                           node_tree.time, node_tree.node_type))
+        """
+        Adds the nodes of a tree in depth-first order, each of them before its children, which is the order nodes are
+        streamed in.
+        """
+        pending = [(node_tree, parent_id)]
+        while pending:
+            node, parent_id = pending.pop()
+            self._add_node(ReportNode(node.unique_id, node.name, node.status, parent_id,
+                                      [c.unique_id for c in node.children], node.attachment, node.time, node.node_type))
+            pending.extend((child, node.unique_id) for child in reversed(node.children))
+
+    def _add_node(self, report_node):
+        self.report.nodes.append(report_node)
+        if self.chunk_size and len(self.report.nodes) >= self.chunk_size:
+            self.thrift_client.append_nodes(self.test_name, self.report)
+            self.report.nodes = []
 
     def finalize(self):
         self.thrift_client.finalize(self.test_name, self.report)
 
     def __str__(self):
-        final_string = "Report root_id: " + self.report.root_id + "\n"
+        lines = ["Report root_id: " + self.report.root_id]
         for node in self.report.nodes:
-            final_string += "has node with id: " + node.unique_id + "\n"
-            final_string += repr(node) + "\n"
-        return final_string
+            lines.append("has node with id: " + node.unique_id)
+            lines.append(repr(node))
+        return "\n".join(lines) + "\n"
 
 
 def info_node(name):
@@ -84,6 +104,8 @@ def error_node(name):
 
 
 class NodeBuilder(object):
+    __slots__ = ('name', 'status', 'attachment', 'time', 'node_type', 'children_nodes')
+
     def __init__(self):
         super(NodeBuilder, self).__init__()
         self.name = None
@@ -102,7 +124,12 @@ class NodeBuilder(object):
         return self
 
     def with_attachment(self, attachment):
-        self.attachment = attachment
+        """
+        Attaches files to the node. They are sent to the service by path rather than by content.
+        :param attachment: path, or list of paths, of the files, e.g. as returned by
+            GalenRemoteWebDriver.get_screenshot_as_attachment().
+        """
+        self.attachment = list(attachment) if isinstance(attachment, (list, tuple)) else [attachment]
         return self
 
     def with_node(self, node_builder):
@@ -123,24 +150,31 @@ class NodeBuilder(object):
 
 
 class Node(object):
+    __slots__ = ('unique_id', 'name', 'status', 'attachment', 'time', 'node_type', 'children')
+
     def __init__(self, name, status, attachment, time, child_nodes, node_type=NodeType.NODE):
-        self.unique_id = generate_random_string()
+        self.unique_id = next_node_id()
         self.name = name
         self.status = status
         self.attachment = attachment
         self.time = time
         self.node_type = node_type
-        self.children = []
-        self.children.extend(child_nodes)
+        self.children = list(child_nodes)
 
     def has_children(self):
         return len(self.children) > 0
 
 
 class TextNodeBuilder(NodeBuilder):
+    __slots__ = ()
+
     def __init__(self):
         super(TextNodeBuilder, self).__init__()
 
 
 def generate_random_string():
-    return str(uuid.uuid4()).replace('-', '')
+    return uuid.uuid4().hex
+
+
+def next_node_id():
+    return '%s%x' % (_NODE_ID_PREFIX, next(_node_ids))
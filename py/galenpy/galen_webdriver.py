@@ -14,35 +14,62 @@
 # limitations under the License.                                           #
 ############################################################################
 
+import copy
 import json
 import logging
+import os
+from contextlib import contextmanager
 
 from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.remote.remote_connection import RemoteConnection
 from selenium.webdriver.remote.webdriver import WebDriver
 
-from galenpy.thrift_client import ThriftClient
-from pythrift.ttypes import RemoteWebDriverException
+from galenpy.metrics import clock, metrics
+from galenpy.placement import placed_client
+from pythrift.ttypes import BatchCommand, RemoteWebDriverException, ResponseFormat
 
 
 logger = logging.getLogger()
 
+""" READ_CACHE makes drivers answer repeated read-only commands from the responses already received for the current
+    page state, rather than asking them to the service again. It is enabled by setting the GALEN_API_READ_CACHE
+    environment variable to 1, or per driver through the read_cache argument."""
+READ_CACHE = os.getenv('GALEN_API_READ_CACHE', '0') == '1'
+
+""" Read-only commands whose responses are cached until the page state changes. They give the geometry and the
+    static properties of the page, which layout checks ask over and over again."""
+CACHED_READ_COMMANDS = frozenset([
+    'getWindowSize', 'getWindowPosition', 'getWindowRect', 'getElementSize', 'getElementLocation', 'getElementRect',
+    'getElementTagName', 'getElementValueOfCssProperty'])
+
+""" Read-only commands which are never cached, since explicit waits poll them for changes the page makes by itself,
+    but which leave the page state, and so the cached responses, untouched."""
+UNCACHED_READ_COMMANDS = frozenset([
+    'findElement', 'findElements', 'findChildElement', 'findChildElements', 'getActiveElement', 'getElementText',
+    'getElementAttribute', 'getElementProperty', 'getElementValue', 'isElementDisplayed', 'isElementEnabled',
+    'isElementSelected', 'getPageSource', 'getCurrentUrl', 'getTitle', 'getCurrentWindowHandle', 'getWindowHandles',
+    'screenshot', 'elementScreenshot', 'getAllCookies', 'getCookie', 'getAlertText', 'getLog', 'getAvailableLogTypes',
+    'status', 'getAllSessions'])
+
 
 class GalenRemoteWebDriver(WebDriver):
     """
     Implementation of Galen RemoteWebDriver which uses JsonWire protocol over Thrift. The commands to be sent
     to a remote Grid are intercepted and sent across the Thrift interface.
-    Internally, GalenRemoteWebDriver makes use of ThriftRemoteConnection, an ad-hoc command_executor which sends commands
-    over the Thrift interface.
+    Internally, GalenRemoteWebDriver makes use of ThriftRemoteConnection, an ad-hoc command_executor which sends
+    commands over the Thrift interface.
+    When the host runs several services, the session is placed on one of them, which serves all its commands and
+    checks.
     """
     def __init__(self, remote_url='http://127.0.0.1:4444/wd/hub', desired_capabilities=None, browser_profile=None,
-                 proxy=None, keep_alive=False):
+                 proxy=None, keep_alive=False, read_cache=READ_CACHE, placement_key=None):
         try:
-            self.thrift_client = ThriftClient().initialize(remote_url)
-            remote_connection = ThriftRemoteConnection(remote_url, self.thrift_client)
-            WebDriver.__init__(self, remote_connection, desired_capabilities,
-                               browser_profile, proxy, keep_alive)
-            remote_connection.set_session_id(self.session_id)
+            with placed_client(placement_key) as self.thrift_client:
+                self.thrift_client.initialize(remote_url)
+                remote_connection = ThriftRemoteConnection(remote_url, self.thrift_client, read_cache=read_cache)
+                WebDriver.__init__(self, remote_connection, desired_capabilities,
+                                   browser_profile, proxy, keep_alive)
+                remote_connection.set_session_id(self.session_id)
         except WebDriverException as e:
             logger.error(e.msg)
             self.thrift_client.quit_service_if_inactive()
@@ -51,15 +78,98 @@ class GalenRemoteWebDriver(WebDriver):
     def quit(self):
         super(GalenRemoteWebDriver, self).quit()
 
+    def invalidate_read_cache(self):
+        """
+        Drops the responses kept by the read cache, when the page was changed by the service rather than by a command.
+        """
+        if self.command_executor.read_cache is not None:
+            self.command_executor.read_cache.invalidate()
+
+    def get_screenshot_as_png(self):
+        """
+        Gets the screenshot of the current window as PNG bytes, which the service sends as binary rather than as the
+        base64 text WebDriver encodes them to.
+        """
+        self._check_not_batching()
+        try:
+            return self.thrift_client.take_screenshot(self.session_id)
+        except RemoteWebDriverException as e:
+            raise WebDriverException(e.message)
+
+    def get_screenshot_as_file(self, filename):
+        """
+        Saves the screenshot of the current window to a PNG file.
+        :return: False if the file could not be written, True otherwise.
+        """
+        png = self.get_screenshot_as_png()
+        try:
+            with open(filename, 'wb') as screenshot_file:
+                screenshot_file.write(png)
+        except IOError:
+            return False
+        return True
+
+    def get_screenshot_as_attachment(self):
+        """
+        Takes the screenshot of the current window and keeps it on the service, so that it can be attached to a report
+        node without travelling to the client and back.
+
+        Example usage.
+        info_node("Home page").with_attachment(driver.get_screenshot_as_attachment())
+        :return: the path of the screenshot on the service.
+        """
+        self._check_not_batching()
+        try:
+            return self.thrift_client.save_screenshot(self.session_id)
+        except RemoteWebDriverException as e:
+            raise WebDriverException(e.message)
+
+    def _check_not_batching(self):
+        """
+        Screenshots are taken straight away, hence they would not show the effect of the commands queued by a batch.
+        """
+        if self.command_executor.batch is not None:
+            raise WebDriverException("Screenshots cannot be taken within a batch")
+
+    @contextmanager
+    def batch(self):
+        """
+        Queues the commands issued within a with block and sends them to the server in a single round trip when the
+        block exits. Commands are run in the order they were issued and the batch stops at the first one failing, whose
+        error is then raised. As commands are not run until the block exits, they return None within it: their
+        responses are available through the yielded CommandBatch afterwards.
+
+        Example usage.
+        with driver.batch() as batch:
+            driver.set_window_size(720, 1024)
+            driver.get("http://example.com")
+        """
+        command_batch = self.command_executor.start_batch()
+        try:
+            yield command_batch
+        except Exception:
+            self.command_executor.discard_batch(command_batch)
+            raise
+        for response in self.command_executor.send_batch(command_batch):
+            self.error_handler.check_response(response)
+
 
 class ThriftRemoteConnection(RemoteConnection):
     """
     Subclass of RemoteConnection which implements JsonWire protocol over Thrift Interface.
+    Response values are asked to the server as a single JSON document. Setting response_format to ResponseFormat.GRAPH
+    falls back to the graph of ResponseValue, which servers not knowing about JSON responses always send.
+    With read_cache set, responses of CACHED_READ_COMMANDS are kept in a ReadCache, which any command other than a
+    read-only one invalidates.
     """
-    def __init__(self, remote_server_addr, thrift_client, keep_alive=False):
+    def __init__(self, remote_server_addr, thrift_client, keep_alive=False, response_format=ResponseFormat.JSON,
+                 read_cache=READ_CACHE):
         RemoteConnection.__init__(self, remote_server_addr, keep_alive)
         self.thrift_client = thrift_client
         self.session_id = None
+        self.batch = None
+        self.response_format = response_format
+        self.read_cache = ReadCache() if read_cache else None
 
     def execute(self, command, params):
         """
@@ -73,47 +183,178 @@ class ThriftRemoteConnection(RemoteConnection):
             assert command_info is not None, 'Unrecognised command %s' % command
             data = json.dumps(params)
 
-            response = self.thrift_client.execute(self.session_id, command, data)
-            response_value = ''
-            if response.response_value:
-                response_value = unwrap_response_value(response.response_value.value, response.contained_values)
-            return dict(status=response.status, sessionId=response.session_id, state=response.state, value=response_value)
+            if self.read_cache is not None and command not in CACHED_READ_COMMANDS \
+                    and command not in UNCACHED_READ_COMMANDS:
+                self.read_cache.invalidate()
+            if self.batch is not None:
+                self.batch.commands.append(BatchCommand(command=command, params=data))
+                return dict(status=0, sessionId=self.session_id, value=None)
+            if self.read_cache is not None and command in CACHED_READ_COMMANDS:
+                return self._cached_execute(command, data)
+            return self._send(command, data)
         except RemoteWebDriverException as e:
             raise WebDriverException(e.message)
 
+    def _send(self, command, data):
+        if not metrics.active:
+            return to_response_dict(self.thrift_client.execute(self.session_id, command, data, self.response_format))
+        return self._observed_execute(command, data)
+
+    def _cached_execute(self, command, data):
+        response = self.read_cache.get(command, data)
+        if metrics.active:
+            metrics.count_read_cache(command, response is not None)
+        if response is None:
+            response = self._send(command, data)
+            if response['status'] == 0:
+                self.read_cache.put(command, data, response)
+        # RemoteWebDriver unwraps the value of the responses it is given, which must not reach the cached ones.
+        return copy.deepcopy(response)
+
+    def _observed_execute(self, command, data):
+        error = None
+        started_at = clock()
+        try:
+            return to_response_dict(self.thrift_client.execute(self.session_id, command, data, self.response_format))
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            metrics.observe_command(command, clock() - started_at, error)
+
+    def start_batch(self):
+        """
+        Starts queueing commands rather than executing them. Batches started while another one is open join it.
+        """
+        if self.batch is None:
+            self.batch = CommandBatch()
+        else:
+            self.batch.nesting += 1
+        return self.batch
+
+    def send_batch(self, batch):
+        """
+        Executes the queued commands in a single call, unless the batch was joined by a nested one.
+        :return: a list of dicts holding the responses of the commands executed.
+        """
+        if batch.nesting > 0:
+            batch.nesting -= 1
+            return []
+        self.batch = None
+        if batch.commands:
+            try:
+                responses = self.thrift_client.execute_batch(self.session_id, batch.commands, self.response_format)
+            except RemoteWebDriverException as e:
+                raise WebDriverException(e.message)
+            batch.responses = [to_response_dict(response) for response in responses]
+        return batch.responses
+
+    def discard_batch(self, batch):
+        if batch.nesting > 0:
+            batch.nesting -= 1
+        else:
+            self.batch = None
+
     def set_session_id(self, session_id):
         self.session_id = session_id
 
 
-def unwrap_response_value(value, contained_values):
-    if value is None:
-        return None
-    elif value.int_value:
-        return value.int_value
-    elif value.string_value or value.string_value == '':
-        return value.string_value
-    elif value.boolean_value is not None:
-        return value.boolean_value
-    elif value.wrapped_long_value:
-        return long(value.wrapped_long_value)
-    elif value.map_values:
-        unwrapped_dict = {}
-        for k, v in value.map_values.iteritems():
-            contained_value = get_contained_value(contained_values, v)
-            unwrapped_dict[k] = unwrap_response_value(contained_value, contained_values)
-        return unwrapped_dict
-    elif value.list_values:
-        unwrapped_list = []
-        for list_item in value.list_values:
-            contained_value = get_contained_value(contained_values, list_item)
-            unwrapped_list.append(unwrap_response_value(contained_value, contained_values))
-        return unwrapped_list
-    else:
-        raise ValueError("Unknown type: " + str(type(value)))
-
-
-def get_contained_value(contained_values, id):
-    for value in contained_values:
-        if value.value_id == id:
-            return value.value
+class ReadCache(object):
+    """
+    Responses of read-only commands, which hold as long as the page state they were read from. The page state is
+    numbered by an epoch, bumped each time the cache is invalidated.
+    """
+    def __init__(self):
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self._responses = {}
+
+    def get(self, command, data):
+        """
+        :return: the response cached for the command and its parameters, None if there is none.
+        """
+        response = self._responses.get((command, data))
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def put(self, command, data, response):
+        self._responses[(command, data)] = response
 
+    def invalidate(self):
+        """
+        Drops the cached responses, as the page state may have changed.
+        """
+        self._responses.clear()
+        self.epoch += 1
+
+    def stats(self):
+        """
+        :return: a dict holding the hits and misses counted so far, the page state epoch and the number of responses
+        cached.
+        """
+        return dict(hits=self.hits, misses=self.misses, epoch=self.epoch, size=len(self._responses))
+
+
+class CommandBatch(object):
+    """
+    Commands queued by GalenRemoteWebDriver.batch() and, once sent, their responses.
+    """
+    def __init__(self):
+        self.commands = []
+        self.responses = []
+        self.nesting = 0
+
+
+def to_response_dict(response):
+    """
+    Transforms a Response received over Thrift into the dict expected by RemoteWebDriver.
+    """
+    response_value = ''
+    if response.json_value is not None:
+        response_value = json.loads(response.json_value)
+    elif response.response_value:
+        response_value = unwrap_response_value(response.response_value.value, response.contained_values)
+    return dict(status=response.status, sessionId=response.session_id, state=response.state, value=response_value)
+
+
+def unwrap_response_value(value, contained_values):
+    """
+    Rebuilds a response value out of the graph of ResponseValue objects it was flattened into by the server.
+    Contained values are indexed by id once per response and the graph is walked iteratively, so that decoding is
+    linear in the number of values and deeply nested values do not exhaust the stack.
+    :param value: the root Value of the response.
+    :param contained_values: list of ResponseValue referenced, directly or not, by the root value.
+    :return: the value as a combination of Python dicts, lists and scalars.
+    """
+    values_by_id = dict((contained.value_id, contained.value) for contained in contained_values or [])
+    root = [None]
+    pending = [(value, root, 0)]
+    while pending:
+        value, container, key = pending.pop()
+        if value is None:
+            container[key] = None
+        elif value.int_value is not None:
+            container[key] = value.int_value
+        elif value.string_value is not None:
+            container[key] = value.string_value
+        elif value.boolean_value is not None:
+            container[key] = value.boolean_value
+        elif value.wrapped_long_value is not None:
+            container[key] = int(value.wrapped_long_value)
+        elif value.map_values is not None:
+            unwrapped_dict = {}
+            for k, value_id in value.map_values.items():
+                pending.append((values_by_id.get(value_id), unwrapped_dict, k))
+            container[key] = unwrapped_dict
+        elif value.list_values is not None:
+            unwrapped_list = [None] * len(value.list_values)
+            for index, value_id in enumerate(value.list_values):
+                pending.append((values_by_id.get(value_id), unwrapped_list, index))
+            container[key] = unwrapped_list
+        else:
+            raise ValueError("Unknown type: " + str(type(value)))
+    return root[0]
@@ -0,0 +1,41 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Command merging the report shards written by several test workers into a single Galen report.
+
+Usage: galenpy-merge-reports -o target/galen shards/worker-1 shards/worker-2
+"""
+
+import argparse
+import logging
+import sys
+
+from galenpy.galen_api import merge_galen_report_shards
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='galenpy-merge-reports',
+                                     description='Merges Galen report shards into a single report.')
+    parser.add_argument('shard_folders', metavar='SHARD', nargs='+', help='folder of a report shard')
+    parser.add_argument('-o', '--output', required=True, help='folder where the report is generated')
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+    merge_galen_report_shards(options.shard_folders, options.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
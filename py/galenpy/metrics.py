@@ -0,0 +1,304 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Instrumentation of the calls made to the Galen API service: latency of each RPC and of each WebDriver command, bytes
+sent and received, errors, reconnections and read cache hits. Nothing is recorded unless metrics are enabled or a hook
+is registered, in which case a snapshot can be taken at any time and dumped as JSON or in the Prometheus text format.
+"""
+
+import atexit
+import json
+import logging
+import os
+from bisect import bisect_left
+from collections import namedtuple
+from threading import Lock
+from timeit import default_timer as clock
+
+
+""" Upper bounds (in seconds) of the buckets of latency histograms."""
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+""" Upper bounds (in bytes) of the buckets of payload histograms."""
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+""" Metrics are recorded when the GALEN_API_METRICS environment variable is set to 1, or when METRICS_FILE is set."""
+ENABLED = os.getenv('GALEN_API_METRICS', '0') == '1'
+
+""" METRICS_FILE is where metrics are dumped when the process exits, in the Prometheus text format if its extension is
+    .prom and as JSON otherwise. It can be set through the GALEN_API_METRICS_FILE environment variable."""
+METRICS_FILE = os.getenv('GALEN_API_METRICS_FILE')
+
+RPC = 'rpc'
+WEBDRIVER_COMMAND = 'webdriver_command'
+READ_CACHE = 'read_cache'
+
+logger = logging.getLogger()
+
+""" Observation passed to hooks: kind is RPC or WEBDRIVER_COMMAND, name the method or command, duration in seconds,
+    bytes sent and received (None for WebDriver commands) and the exception raised, if any."""
+Event = namedtuple('Event', ['kind', 'name', 'duration', 'bytes_sent', 'bytes_received', 'error'])
+
+
+class Histogram(object):
+    """
+    Distribution of observed values over fixed buckets.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def cumulative_counts(self):
+        """
+        :return: a list of (upper bound, number of values lower than or equal to it) pairs, the last bound being
+            '+Inf'.
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.sum, max=self.max,
+                    buckets=[[bound, count] for bound, count in self.cumulative_counts()])
+
+
+class Series(object):
+    """
+    Metrics recorded for one RPC method or WebDriver command.
+    """
+    __slots__ = ('duration', 'bytes_sent', 'bytes_received', 'errors', 'reconnects')
+
+    def __init__(self):
+        self.duration = Histogram(LATENCY_BUCKETS)
+        self.bytes_sent = Histogram(SIZE_BUCKETS)
+        self.bytes_received = Histogram(SIZE_BUCKETS)
+        self.errors = {}
+        self.reconnects = 0
+
+    def snapshot(self):
+        return dict(duration_seconds=self.duration.snapshot(), bytes_sent=self.bytes_sent.snapshot(),
+                    bytes_received=self.bytes_received.snapshot(), errors=dict(self.errors),
+                    reconnects=self.reconnects)
+
+
+class Metrics(object):
+    """
+    Process-wide registry of metrics. Instrumented code checks the active attribute before measuring anything, so that
+    the cost of instrumentation is a single attribute lookup while metrics are disabled and no hook is registered.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.hooks = []
+        self.active = enabled
+        self._series = {RPC: {}, WEBDRIVER_COMMAND: {}}
+        self._read_cache = {}
+        self._lock = Lock()
+
+    def enable(self):
+        self.enabled = True
+        self._update_active()
+
+    def disable(self):
+        self.enabled = False
+        self._update_active()
+
+    def add_hook(self, hook):
+        """
+        Registers a callable invoked with an Event after each RPC and WebDriver command, from the thread which made it.
+        Hooks are invoked even when metrics are not enabled, and exceptions they raise are logged and ignored.
+        """
+        self.hooks = self.hooks + [hook]
+        self._update_active()
+
+    def remove_hook(self, hook):
+        self.hooks = [registered for registered in self.hooks if registered is not hook]
+        self._update_active()
+
+    def observe_rpc(self, method, duration, bytes_sent, bytes_received, error=None):
+        if self.enabled:
+            with self._lock:
+                series = self._series_of(RPC, method)
+                series.duration.observe(duration)
+                series.bytes_sent.observe(bytes_sent)
+                series.bytes_received.observe(bytes_received)
+                if error is not None:
+                    self._count_error(series, error)
+        self._notify(Event(RPC, method, duration, bytes_sent, bytes_received, error))
+
+    def observe_command(self, command, duration, error=None):
+        if self.enabled:
+            with self._lock:
+                series = self._series_of(WEBDRIVER_COMMAND, command)
+                series.duration.observe(duration)
+                if error is not None:
+                    self._count_error(series, error)
+        self._notify(Event(WEBDRIVER_COMMAND, command, duration, None, None, error))
+
+    def count_reconnect(self, method):
+        if self.enabled:
+            with self._lock:
+                self._series_of(RPC, method).reconnects += 1
+
+    def count_read_cache(self, command, hit):
+        """
+        Counts a WebDriver command answered from the read cache of its driver, when hit is True, or sent to the service.
+        """
+        if self.enabled:
+            with self._lock:
+                counts = self._read_cache.get(command)
+                if counts is None:
+                    counts = self._read_cache[command] = dict(hits=0, misses=0)
+                counts['hits' if hit else 'misses'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series = {RPC: {}, WEBDRIVER_COMMAND: {}}
+            self._read_cache = {}
+
+    def snapshot(self):
+        """
+        :return: a dict holding, for each RPC method and WebDriver command observed, its latency histogram, errors by
+            type and reconnections, along with the histograms of bytes sent and received for RPC methods and the read
+            cache hits and misses of WebDriver commands.
+        """
+        with self._lock:
+            rpc = dict((method, series.snapshot()) for method, series in self._series[RPC].items())
+            commands = dict((command, series.snapshot()) for command, series in self._series[WEBDRIVER_COMMAND].items())
+            read_cache = dict((command, dict(counts)) for command, counts in self._read_cache.items())
+        for series in commands.values():
+            for key in ('bytes_sent', 'bytes_received', 'reconnects'):
+                del series[key]
+        return {RPC: rpc, WEBDRIVER_COMMAND: commands, READ_CACHE: read_cache}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        :return: the snapshot in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        _histogram_lines(lines, 'galenpy_rpc_duration_seconds', 'Latency of the calls to the Galen API service.',
+                         'method', snapshot[RPC], 'duration_seconds')
+        _histogram_lines(lines, 'galenpy_rpc_sent_bytes', 'Bytes sent to the Galen API service per call.',
+                         'method', snapshot[RPC], 'bytes_sent')
+        _histogram_lines(lines, 'galenpy_rpc_received_bytes', 'Bytes received from the Galen API service per call.',
+                         'method', snapshot[RPC], 'bytes_received')
+        _error_lines(lines, 'galenpy_rpc_errors_total', 'Calls to the Galen API service which failed.',
+                     'method', snapshot[RPC])
+        lines.append('# HELP galenpy_rpc_reconnects_total Calls sent again over a new connection.')
+        lines.append('# TYPE galenpy_rpc_reconnects_total counter')
+        for method, series in sorted(snapshot[RPC].items()):
+            lines.append('galenpy_rpc_reconnects_total{%s} %s' % (_labels(('method', method)), series['reconnects']))
+        _histogram_lines(lines, 'galenpy_webdriver_command_duration_seconds', 'Latency of the WebDriver commands.',
+                         'command', snapshot[WEBDRIVER_COMMAND], 'duration_seconds')
+        _error_lines(lines, 'galenpy_webdriver_command_errors_total', 'WebDriver commands which failed.',
+                     'command', snapshot[WEBDRIVER_COMMAND])
+        for outcome, description in (('hits', 'answered from the read cache'),
+                                     ('misses', 'missing from the read cache')):
+            lines.append('# HELP galenpy_read_cache_%s_total WebDriver commands %s.' % (outcome, description))
+            lines.append('# TYPE galenpy_read_cache_%s_total counter' % outcome)
+            for command, counts in sorted(snapshot[READ_CACHE].items()):
+                lines.append('galenpy_read_cache_%s_total{%s} %s' % (outcome, _labels(('command', command)),
+                                                                     counts[outcome]))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, file_path):
+        """
+        Writes the snapshot to the given file, in the Prometheus text format if its extension is .prom and as JSON
+        otherwise.
+        """
+        content = self.to_prometheus() if file_path.endswith('.prom') else self.to_json()
+        with open(file_path, 'w') as metrics_file:
+            metrics_file.write(content)
+
+    def _series_of(self, kind, name):
+        series = self._series[kind].get(name)
+        if series is None:
+            series = self._series[kind][name] = Series()
+        return series
+
+    def _count_error(self, series, error):
+        error_type = type(error).__name__
+        series.errors[error_type] = series.errors.get(error_type, 0) + 1
+
+    def _notify(self, event):
+        for hook in self.hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception("Metrics hook {hook} failed".format(hook=hook))
+
+    def _update_active(self):
+        self.active = self.enabled or bool(self.hooks)
+
+
+def _labels(*labels):
+    """
+    Formats the given (name, value) pairs as Prometheus labels, in the order given.
+    """
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels)
+
+
+def _histogram_lines(lines, metric, description, label, series_by_name, key):
+    lines.append('# HELP %s %s' % (metric, description))
+    lines.append('# TYPE %s histogram' % metric)
+    for name, series in sorted(series_by_name.items()):
+        histogram = series[key]
+        for bound, count in histogram['buckets']:
+            lines.append('%s_bucket{%s} %s' % (metric, _labels((label, name), ('le', bound)), count))
+        lines.append('%s_sum{%s} %s' % (metric, _labels((label, name)), histogram['sum']))
+        lines.append('%s_count{%s} %s' % (metric, _labels((label, name)), histogram['count']))
+
+
+def _error_lines(lines, metric, description, label, series_by_name):
+    lines.append('# HELP %s %s' % (metric, description))
+    lines.append('# TYPE %s counter' % metric)
+    for name, series in sorted(series_by_name.items()):
+        for error_type, count in sorted(series['errors'].items()):
+            lines.append('%s{%s} %s' % (metric, _labels((label, name), ('error', error_type)), count))
+
+
+metrics = Metrics(ENABLED or bool(METRICS_FILE))
+
+
+def _dump_at_exit():
+    try:
+        metrics.dump(METRICS_FILE)
+    except (IOError, OSError) as e:
+        logger.error("Could not write metrics to {path}: {error}".format(path=METRICS_FILE, error=e))
+
+
+if METRICS_FILE:
+    atexit.register(_dump_at_exit)
@@ -0,0 +1,161 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Placement of new WebDriver sessions across the services of a host, so that its layout checks and reports are not all
+served by a single JVM. A session stays on the service it was placed on, which holds its driver and the layout reports
+of its checks, while reports are gathered from all the services when they are generated.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from bisect import bisect
+from contextlib import contextmanager
+from os import path
+from threading import Lock
+
+from galenpy.remote_service_lifecycle import SERVERS, server_addresses, server_running
+from galenpy.thrift_client import GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, ThriftClient, get_connection_pools
+
+
+LEAST_LOADED = 'least_loaded'
+CONSISTENT_HASHING = 'hash'
+
+""" Addresses of the services sessions are placed on."""
+SERVICE_ADDRESSES = server_addresses(GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, SERVERS)
+
+""" PLACEMENT tells how new sessions are placed on services: LEAST_LOADED places them on the service with the fewest
+    active drivers, CONSISTENT_HASHING on the service their placement key hashes to, so that the same key always lands
+    on the same service, as long as the number of services does not change. It can be set through the
+    GALEN_API_PLACEMENT environment variable."""
+PLACEMENT = os.getenv('GALEN_API_PLACEMENT', LEAST_LOADED)
+
+""" Number of points each service has on the hash ring, which evens out the share of keys it gets."""
+RING_REPLICAS = 64
+
+logger = logging.getLogger()
+
+_lock = Lock()
+# Sessions being created on each service, which are not counted among its active drivers yet.
+_creating = {}
+_rings = {}
+
+
+@contextmanager
+def placed_client(placement_key=None, addresses=SERVICE_ADDRESSES, placement=PLACEMENT):
+    """
+    Places a new session and yields a client to its service, for the duration of a with block creating the session.
+    :param placement_key: key hashed by CONSISTENT_HASHING placement, by default the id of the process so that all its
+        sessions land on the same service.
+    :param addresses: addresses of the services sessions are placed on.
+    :param placement: LEAST_LOADED or CONSISTENT_HASHING.
+    """
+    if len(addresses) == 1:
+        yield ThriftClient(addresses[0])
+        return
+    if placement == CONSISTENT_HASHING:
+        address = ring_of(addresses).address_of(placement_key if placement_key is not None else str(os.getpid()))
+    elif placement == LEAST_LOADED:
+        address = _least_loaded(addresses)
+    else:
+        raise ValueError("Unknown placement {placement}".format(placement=placement))
+    try:
+        logger.debug("Placing session on Galen API service at {address}".format(address=address))
+        yield ThriftClient(address)
+    finally:
+        if placement == LEAST_LOADED:
+            with _lock:
+                _creating[address] -= 1
+
+
+def _least_loaded(addresses):
+    """
+    Picks the service with the fewest active drivers and sessions being created, counting the session placed.
+    """
+    get_connection_pools(addresses)
+    loads = [(ThriftClient(address).get_active_drivers(), address) for address in addresses]
+    with _lock:
+        _, address = min((active_drivers + _creating.get(address, 0), address) for active_drivers, address in loads)
+        _creating[address] = _creating.get(address, 0) + 1
+    return address
+
+
+def ring_of(addresses):
+    with _lock:
+        ring = _rings.get(tuple(addresses))
+        if ring is None:
+            ring = _rings[tuple(addresses)] = HashRing(addresses)
+        return ring
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys to service addresses: adding or removing a service only moves the keys which hash next
+    to its points on the ring.
+    """
+    def __init__(self, addresses, replicas=RING_REPLICAS):
+        points = sorted((_hash('{address}#{replica}'.format(address=address, replica=replica)), address)
+                        for address in addresses for replica in range(replicas))
+        self._hashes = [point_hash for point_hash, _ in points]
+        self._addresses = [address for _, address in points]
+
+    def address_of(self, key):
+        return self._addresses[bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+def _hash(key):
+    return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:16], 16)
+
+
+def running_services(addresses=SERVICE_ADDRESSES):
+    return [address for address in addresses if server_running(address)]
+
+
+def generate_report(report_folder, addresses=SERVICE_ADDRESSES):
+    """
+    Generates the report of the tests of all the running services. Each of them writes its tests to a report shard,
+    all at once, and the first merges the shards into the report.
+    """
+    services = running_services(addresses) or addresses[:1]
+    if len(services) == 1:
+        ThriftClient(services[0]).generate_report(report_folder)
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    shards_folder = tempfile.mkdtemp(prefix='galen-shards-')
+    try:
+        shard_folders = [path.join(shards_folder, str(index)) for index in range(len(services))]
+        executor = ThreadPoolExecutor(max_workers=len(services))
+        try:
+            futures = [executor.submit(ThriftClient(address).write_report_shard, shard_folder)
+                       for address, shard_folder in zip(services, shard_folders)]
+            for future in futures:
+                future.result()
+        finally:
+            executor.shutdown(wait=True)
+        ThriftClient(services[0]).merge_report_shards(shard_folders, path.abspath(report_folder))
+    finally:
+        shutil.rmtree(shards_folder, ignore_errors=True)
+
+
+def write_report_shard(shard_folder, addresses=SERVICE_ADDRESSES):
+    """
+    Writes the tests of all the running services to the same report shard, one service after the other.
+    """
+    for address in running_services(addresses) or addresses[:1]:
+        ThriftClient(address).write_report_shard(path.abspath(shard_folder))
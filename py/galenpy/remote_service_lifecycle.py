@@ -14,72 +14,378 @@
 # limitations under the License.                                           #
 ############################################################################
 
-import commands
+import errno
 import logging
-from os import path, popen
-from random import random
+import os
+import signal
+import socket
 import subprocess
-from time import sleep
-from galenpy.remote_service_logging import RemoteServiceStreamListener, RemoteServiceLogger
+import tempfile
+from os import path
+from threading import Thread
+from time import sleep, time
 
+from thrift.Thrift import TException
+
+from galenpy.exception import ServiceStartupError
+from galenpy.remote_service_logging import RemoteServiceLogPump
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
-MAX_SLOW_START_DELAY = 1
 
 GALEN_REMOTE_API_SERVER_JAR = 'galen-api-server.jar'
 
 DEFAULT_THRIFT_SERVER_PORT = 9092
 
+""" UNIX_SOCKET is the path of a Unix domain socket the service listens on instead of DEFAULT_THRIFT_SERVER_PORT, which
+    spares calls the TCP stack. Giving each job its own path, through the GALEN_API_UNIX_SOCKET environment variable,
+    lets isolated services run side by side on the same host. Services are addressed by port when it is an int and by
+    socket path otherwise."""
+UNIX_SOCKET = os.getenv('GALEN_API_UNIX_SOCKET')
+
+""" SERVERS is the number of services new WebDriver sessions are spread across, which lets the checks and reports of a
+    host scale beyond the heap and cores a single service makes use of. They listen on consecutive ports from the
+    default one, or on sockets numbered after UNIX_SOCKET. It can be set through the GALEN_API_SERVERS environment
+    variable."""
+SERVERS = int(os.getenv('GALEN_API_SERVERS', 1))
+
+""" RUN_DIR is where pid and lock files of the services started by galenpy are kept. It can be overridden through the
+    GALEN_API_RUN_DIR environment variable."""
+RUN_DIR = os.getenv('GALEN_API_RUN_DIR', path.join(tempfile.gettempdir(), 'galenpy'))
+
+""" SERVER_START_TIMEOUT specifies the maximum amount of time (in seconds) to wait for a started service to listen."""
+SERVER_START_TIMEOUT = 30
+
+""" SHUTDOWN_GRACE_PERIOD specifies the amount of time (in seconds) a service is given to terminate before it is
+    killed."""
+SHUTDOWN_GRACE_PERIOD = 5
+
+""" WORKER_THREADS is the number of calls the service serves concurrently, which bounds the number of layout checks
+    run in parallel across all clients. When not set through the GALEN_API_WORKER_THREADS environment variable, the
+    service default applies."""
+WORKER_THREADS = os.getenv('GALEN_API_WORKER_THREADS')
+
+""" LAYOUT_CACHE_DIR is the directory where the service stores the layout reports served to checks run with the cache
+    enabled. When not set through the GALEN_API_LAYOUT_CACHE_DIR environment variable, the service default applies."""
+LAYOUT_CACHE_DIR = os.getenv('GALEN_API_LAYOUT_CACHE_DIR')
+
+""" IDLE_TIMEOUT specifies after which amount of time (in seconds) without leases, active drivers nor tests left out of
+    the report the service stops by itself. It can be overridden through the GALEN_API_IDLE_TIMEOUT environment
+    variable, 0 keeping the service running until it is stopped."""
+IDLE_TIMEOUT = int(os.getenv('GALEN_API_IDLE_TIMEOUT', 10))
+
+""" SESSION_TIMEOUT specifies after which amount of time (in seconds) a WebDriver session left unused, e.g. by a test
+    process which crashed, is quit by the service. When not set through the GALEN_API_SESSION_TIMEOUT environment
+    variable, the service default applies."""
+SESSION_TIMEOUT = os.getenv('GALEN_API_SESSION_TIMEOUT')
+
+POLL_INTERVAL = 0.05
+
 logger = logging.getLogger()
 
+_server_processes = {}
+_log_pumps = {}
+
+
+def is_unix_socket(server_address):
+    return not isinstance(server_address, int)
+
+
+def server_addresses(first_address, count=SERVERS):
+    """
+    :return: the addresses of count services, on consecutive ports from the given one or on sockets numbered after the
+        given path.
+    """
+    if is_unix_socket(first_address):
+        return [first_address] + ['{socket}.{index}'.format(socket=first_address, index=index)
+                                  for index in range(1, count)]
+    return [first_address + index for index in range(count)]
+
 
 def server_running(server_port):
     """
-    Checks if GalenRemoteApi service is running.
+    Checks if GalenRemoteApi service is running by probing its port or socket.
     """
-    # TODO Portability on non-Mac OSs
-    output = commands.getoutput('lsof -i :' + str(server_port))
-    return 'java' in output
+    try:
+        if is_unix_socket(server_port):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            probe.settimeout(1)
+            try:
+                probe.connect(server_port)
+            except (socket.error, socket.timeout):
+                probe.close()
+                raise
+        else:
+            probe = socket.create_connection(('localhost', server_port), timeout=1)
+    except (socket.error, socket.timeout):
+        return False
+    probe.close()
+    return True
 
 
-def start_server(server_port=DEFAULT_THRIFT_SERVER_PORT):
+def start_server(server_port=DEFAULT_THRIFT_SERVER_PORT, timeout=SERVER_START_TIMEOUT):
     """
-    Starts GalenRemoteApi service.
+    Starts GalenRemoteApi service unless it is already running. Concurrent callers, in this or in other processes,
+    are serialized by a lock file, so that exactly one of them launches the service while the others wait for it to
+    listen.
     """
-    # TODO Portability on non-Mac OSs
-    slow_start(MAX_SLOW_START_DELAY)
-    if not server_running(server_port):
-        command = "java -jar {path}/{jar_file} -r {port}".format(path=locate_server_path(),
-                                                                 jar_file=GALEN_REMOTE_API_SERVER_JAR,
-                                                                 port=str(server_port))
-        server_process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-        RemoteServiceStreamListener('STDOUT', server_process, 'stdout listener').start()
-        RemoteServiceStreamListener('STDERR', server_process, 'stderr listener').start()
-        RemoteServiceLogger(server_process, 'Remote service').start()
+    with ServerLock(server_port):
+        if server_running(server_port):
+            return
+        command = ['java', '-jar', path.join(locate_server_path(), GALEN_REMOTE_API_SERVER_JAR)]
+        if is_unix_socket(server_port):
+            command.extend(['-u', server_port])
+        else:
+            command.extend(['-r', str(server_port)])
+        if WORKER_THREADS:
+            command.extend(['-w', str(WORKER_THREADS)])
+        if LAYOUT_CACHE_DIR:
+            command.extend(['-c', LAYOUT_CACHE_DIR])
+        if IDLE_TIMEOUT > 0:
+            command.extend(['-i', str(IDLE_TIMEOUT)])
+        if SESSION_TIMEOUT:
+            command.extend(['-s', SESSION_TIMEOUT])
+        server_process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+        _server_processes[server_port] = server_process
+        write_pid(server_port, server_process.pid)
+        _log_pumps[server_port] = RemoteServiceLogPump(server_process)
+        _log_pumps[server_port].start()
+        wait_until_listening(server_process, server_port, timeout)
         logger.info("Started server at port " + str(server_port))
 
 
+def start_servers(server_ports, timeout=SERVER_START_TIMEOUT):
+    """
+    Starts the services on the given ports which are not running yet, all at once, so that starting several of them
+    takes about as long as starting one.
+    """
+    errors = []
+
+    def start(server_port):
+        try:
+            start_server(server_port, timeout)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=start, args=(server_port,), name='Galen API service start')
+               for server_port in server_ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
 def stop_server(server_port):
     """
-    Stop GalenRemoteApi service.
+    Stop GalenRemoteApi service, first asking it to terminate and then killing it if it is still alive after
+    SHUTDOWN_GRACE_PERIOD. A service without pid file, which was not started by galenpy, or whose pid file is stale
+    and names a process which is not the service, is asked to stop over Thrift instead.
     """
-    # TODO Portability on non-Mac OSs
-    if server_running(server_port):
-        output = commands.getoutput('lsof -i :' + str(server_port))
-        lines = output.split('\n')
-        for line in lines:
-            fields = line.split()
-            if 'java' in fields[0] and fields[1] != 'PID':
-                popen('kill -9 ' + fields[1])
-    logger.info("Stopping server at port " + str(server_port))
+    with ServerLock(server_port):
+        pid = read_pid(server_port)
+        if not server_running(server_port):
+            remove_pid(server_port)
+            return
+        if pid is None or not _is_server_process(server_port, pid):
+            remove_pid(server_port)
+            _shut_service(server_port)
+            return
+        logger.info("Stopping server at port " + str(server_port))
+        if not _signal(pid, signal.SIGTERM) or not _wait_for_exit(server_port, pid, SHUTDOWN_GRACE_PERIOD):
+            logger.warning("Server at port {port} did not terminate gracefully, killing it".format(port=server_port))
+            _signal(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            _wait_for_exit(server_port, pid, SHUTDOWN_GRACE_PERIOD)
+        _forget_server(server_port)
+
+
+def wait_until_listening(server_process, server_port, timeout):
+    """
+    Waits for the started service to accept connections on its port. A service which exits, or does not listen in
+    time, is forgotten along with its pid file, so that the next start does not mistake it for a running one.
+    """
+    deadline = time() + timeout
+    while not server_running(server_port):
+        if server_process.poll() is not None:
+            _forget_server(server_port)
+            raise ServiceStartupError("Galen API service exited with code {code} while starting on port {port}"
+                                      .format(code=server_process.returncode, port=server_port))
+        if time() > deadline:
+            _terminate(server_process)
+            _forget_server(server_port)
+            raise ServiceStartupError("Galen API service is not listening on port {port} after {timeout}s"
+                                      .format(port=server_port, timeout=timeout))
+        sleep(POLL_INTERVAL)
 
 
 def locate_server_path():
     return path.join(path.dirname(__file__), 'service')
 
 
-def slow_start(max_delay):
+def runtime_file(server_port, extension):
+    """
+    Builds the path to the runtime file with the given extension for the service on the given port. Files of a service
+    listening on a Unix domain socket are kept next to it.
+    """
+    if is_unix_socket(server_port):
+        return '{socket}.{extension}'.format(socket=server_port, extension=extension)
+    try:
+        os.makedirs(RUN_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path.join(RUN_DIR, 'galen-api-{port}.{extension}'.format(port=server_port, extension=extension))
+
+
+def write_pid(server_port, pid):
+    with open(runtime_file(server_port, 'pid'), 'w') as pid_file:
+        pid_file.write(str(pid))
+
+
+def read_pid(server_port):
+    try:
+        with open(runtime_file(server_port, 'pid')) as pid_file:
+            return int(pid_file.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def remove_pid(server_port):
+    try:
+        os.remove(runtime_file(server_port, 'pid'))
+    except OSError:
+        pass
+
+
+class ServerLock(object):
+    """
+    Inter-process lock guarding start and stop of the service on a given port.
+    """
+    def __init__(self, server_port):
+        self.lock_file_path = runtime_file(server_port, 'lock')
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_file_path, 'a+')
+        if fcntl:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    pass
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.lock_file.close()
+
+
+def _shut_service(server_port):
+    """
+    Asks the service to stop through shut_service() and waits up to SHUTDOWN_GRACE_PERIOD for it to stop answering.
+    """
+    # Imported here as thrift_client depends on this module.
+    from galenpy.thrift_client import open_connection
+    logger.info("Stopping server at port {port}, which has no pid file, through shut_service()"
+                .format(port=server_port))
+    try:
+        connection = open_connection(server_port)
+        try:
+            connection.client.shut_service()
+        finally:
+            connection.close()
+    except TException as e:
+        logger.warning("Could not ask server at port {port} to stop: {error}".format(port=server_port, error=e))
+        return
+    deadline = time() + SHUTDOWN_GRACE_PERIOD
+    while server_running(server_port) and time() < deadline:
+        sleep(POLL_INTERVAL)
+
+
+def _terminate(server_process):
+    """
+    Terminates a service started by this module, killing it if it is still alive after SHUTDOWN_GRACE_PERIOD.
+    """
+    server_process.terminate()
+    deadline = time() + SHUTDOWN_GRACE_PERIOD
+    while server_process.poll() is None and time() < deadline:
+        sleep(POLL_INTERVAL)
+    if server_process.poll() is None:
+        server_process.kill()
+        server_process.wait()
+
+
+def _forget_server(server_port):
+    _server_processes.pop(server_port, None)
+    remove_pid(server_port)
+    log_pump = _log_pumps.pop(server_port, None)
+    if log_pump:
+        log_pump.join(SHUTDOWN_GRACE_PERIOD)
+
+
+def _is_server_process(server_port, pid):
+    """
+    Tells whether the process with the given pid is alive and is the service on the given port, judging from its
+    command line, so that a pid reused by another process since the pid file was written is never signalled.
+    """
+    server_process = _server_processes.get(server_port)
+    if server_process is not None and server_process.pid == pid:
+        return server_process.poll() is None
+    arguments = _command_line(pid)
+    return any(argument.endswith(GALEN_REMOTE_API_SERVER_JAR) for argument in arguments) \
+        and str(server_port) in arguments
+
+
+def _command_line(pid):
+    """
+    :return: the arguments of the process with the given pid, or an empty list when it is not alive or its command line
+        cannot be read.
+    """
+    try:
+        with open('/proc/{pid}/cmdline'.format(pid=pid), 'rb') as cmdline:
+            return cmdline.read().decode('utf-8', 'replace').split('\0')
+    except IOError:
+        pass
+    try:
+        return subprocess.check_output(['ps', '-p', str(pid), '-o', 'command='],
+                                       stderr=subprocess.STDOUT).decode('utf-8', 'replace').split()
+    except (OSError, subprocess.CalledProcessError):
+        return []
+
+
+def _signal(pid, signal_number):
+    try:
+        os.kill(pid, signal_number)
+        return True
+    except OSError:
+        return False
+
+
+def _wait_for_exit(server_port, pid, timeout):
     """
-    It adds a random delay of max_delay ms to prevent concurrent threads to attempt to initialize the server
-      simultaneously.
+    Waits for the process with the given pid to exit. Processes started by this module are reaped, the others are
+    polled through signal 0.
     """
-    sleep(max_delay * random())
+    deadline = time() + timeout
+    server_process = _server_processes.get(server_port)
+    while time() < deadline:
+        if server_process is not None and server_process.pid == pid:
+            if server_process.poll() is not None:
+                return True
+        elif not _signal(pid, 0):
+            return True
+        sleep(POLL_INTERVAL)
+    return False
@@ -14,65 +14,123 @@
 # limitations under the License.                                           #
 ############################################################################
 
-from Queue import Queue, Empty
 import logging
+import os
+from collections import deque
+from logging.handlers import RotatingFileHandler
 from threading import Thread
 
+try:
+    import selectors
+except ImportError:
+    selectors = None
+    import select
+
 logger = logging.getLogger()
 
+""" SERVER_LOG_FILE is the file the logs of the service are written to instead of going through Python logging. It is
+    set through the GALEN_API_LOG_FILE environment variable and rotated once it reaches SERVER_LOG_FILE_MAX_BYTES,
+    keeping SERVER_LOG_FILE_BACKUPS older files."""
+SERVER_LOG_FILE = os.getenv('GALEN_API_LOG_FILE')
+SERVER_LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+SERVER_LOG_FILE_BACKUPS = 5
 
-io_q = Queue()
+""" MAX_BUFFERED_LINES bounds the number of lines read from the service and not logged yet. When logging cannot keep
+    up with the service, the oldest lines are dropped and the number of lines dropped is logged in their place."""
+MAX_BUFFERED_LINES = 10000
 
+""" Consecutive lines of the same stream are logged as a single record of up to BATCH_SIZE lines."""
+BATCH_SIZE = 100
 
-class RemoteServiceStreamListener(Thread):
-    """
-    Class implementing a Thread that listen to the remote service process stream (stdin, stderr) and queues logs messages
-    into the Queue object, for the RemoteServiceLoggerThread to consume.
-    """
-    def __init__(self, identifier, process, name):
-        super(RemoteServiceStreamListener, self).__init__(name=name)
-        self.setDaemon(True)
-        self.process = process
-        self.identifier = identifier
-        if 'STDOUT' in self.identifier:
-            self.stream = self.process.stdout
-        elif 'STDERR' in self.identifier:
-            self.stream = self.process.stderr
+READ_SIZE = 64 * 1024
 
-    def run(self):
-        logger.info("starting listener for {id}\n".format(id=self.identifier))
-        while True:
-            data = self.stream.readline()
-            if len(data) == 0:
-                break
-            io_q.put((self.identifier, data))
+STDOUT = 'STDOUT'
+STDERR = 'STDERR'
 
 
-class RemoteServiceLogger(Thread):
+class RemoteServiceLogPump(Thread):
     """
-    Class implementing a Thread that fetches logs from the queue and dumps it to an error or an info log depending
-    on whether the relevant server logs was issued on stdout or stderr, respectively.
+    Thread reading the stdout and stderr of the service process in blocks, as soon as data is available, and logging
+    their lines: those of stderr as errors and those of stdout as info. Reading goes on while lines are logged, so that
+    a chatty service is never blocked on a full pipe. The thread exits once both streams are closed, i.e. when the
+    process exits, after logging the lines left and reaping the process, which may have stopped by itself.
     """
-    def __init__(self, process, name):
-        super(RemoteServiceLogger, self).__init__(name=name)
+    def __init__(self, process, name='Remote service logs'):
+        super(RemoteServiceLogPump, self).__init__(name=name)
         self.setDaemon(True)
         self.process = process
+        self.server_logger = server_log()
+        self.lines = deque(maxlen=MAX_BUFFERED_LINES)
+        self.dropped_lines = 0
+        self.partial_lines = {}
 
     def run(self):
-        logger.info("starting Galen API Remote Service logger")
-        while True:
-            try:
-                item = io_q.get(True)
-            except Empty:
-                if self.process.poll() is not None:
-                    break
-            else:
-                identifier, line = item
-                if identifier == 'STDERR':
-                    logging.error(remove_new_line(line))
-                elif identifier == 'STDOUT':
-                    logging.info(remove_new_line(line))
+        streams = {self.process.stdout.fileno(): STDOUT, self.process.stderr.fileno(): STDERR}
+        selector = selectors.DefaultSelector() if selectors else None
+        if selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+        try:
+            while streams:
+                timeout = 0 if self.lines else None
+                if selector:
+                    ready = [key.fd for key, _ in selector.select(timeout)]
+                else:
+                    ready = select.select(list(streams), [], [], timeout)[0]
+                for fd in ready:
+                    data = os.read(fd, READ_SIZE)
+                    if data:
+                        self._buffer(streams[fd], data)
+                    else:
+                        self._buffer(streams.pop(fd), b'\n')
+                        if selector:
+                            selector.unregister(fd)
+                self._log_batch()
+            self.process.wait()
+            while self.lines or self.dropped_lines:
+                self._log_batch()
+        finally:
+            if selector:
+                selector.close()
+
+    def _buffer(self, identifier, data):
+        """
+        Splits data in lines, keeping back the end of a line which was not completely read yet unless it grows too long.
+        """
+        lines = (self.partial_lines.pop(identifier, b'') + data).split(b'\n')
+        if len(lines[-1]) < READ_SIZE:
+            self.partial_lines[identifier] = lines.pop()
+        for line in lines:
+            if line:
+                if len(self.lines) == MAX_BUFFERED_LINES:
+                    self.dropped_lines += 1
+                self.lines.append((identifier, line))
+
+    def _log_batch(self):
+        if self.dropped_lines:
+            self.server_logger.warning("{count} lines of the Galen API service logs were dropped as they came faster "
+                                       "than they could be logged".format(count=self.dropped_lines))
+            self.dropped_lines = 0
+        if not self.lines:
+            return
+        identifier = self.lines[0][0]
+        batch = []
+        while self.lines and self.lines[0][0] == identifier and len(batch) < BATCH_SIZE:
+            batch.append(self.lines.popleft()[1].decode('utf-8', 'replace').rstrip('\r'))
+        level = logging.ERROR if identifier == STDERR else logging.INFO
+        self.server_logger.log(level, '\n'.join(batch))
 
 
-def remove_new_line(line):
-    return line.split('\n')[0]
+def server_log():
+    """
+    Returns the logger of the service, which writes to a rotating file when SERVER_LOG_FILE is set.
+    """
+    server_logger = logging.getLogger('galenpy.server')
+    if SERVER_LOG_FILE and not server_logger.handlers:
+        handler = RotatingFileHandler(SERVER_LOG_FILE, maxBytes=SERVER_LOG_FILE_MAX_BYTES,
+                                      backupCount=SERVER_LOG_FILE_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        server_logger.addHandler(handler)
+        server_logger.setLevel(logging.DEBUG)
+        server_logger.propagate = False
+    return server_logger
@@ -14,100 +14,581 @@
 # limitations under the License.                                           #
 ############################################################################
 
+import atexit
 import logging
 import os
-from time import sleep
+import select
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Event, Lock, Thread, current_thread, local
+from time import sleep, time
 
 from thrift import Thrift
+from thrift.Thrift import TApplicationException
 from thrift.protocol import TBinaryProtocol
 from thrift.transport import TSocket, TTransport
 from thrift.transport.TTransport import TTransportException
-from galenpy.remote_service_lifecycle import start_server, stop_server
+from galenpy.exception import ServiceStartupError
+from galenpy.metrics import clock, metrics
+from galenpy.remote_service_lifecycle import IDLE_TIMEOUT, UNIX_SOCKET, is_unix_socket, start_server, start_servers, \
+    stop_server
 
-from pythrift import GalenApiRemoteService
-from pythrift.ttypes import SpecNotFoundException
+from pythrift.ttypes import ResponseFormat, SpecFile, SpecNotFoundException
 
 
-GALEN_REMOTE_API_SERVICE_DEFAULT_PORT = 9092
+""" Port of the service, or path of its Unix domain socket when the GALEN_API_UNIX_SOCKET environment variable is
+    set."""
+GALEN_REMOTE_API_SERVICE_DEFAULT_PORT = UNIX_SOCKET or 9092
 
-""" RESILIENCE_INTERVAL specifies after which amount of time (in seconds) we can assume there is no activity in the
-    remote server so that we are allowed to quit it."""
+""" RESILIENCE_INTERVAL specifies after which amount of time (in seconds) we can assume there is no activity in a
+    remote server not supporting leases so that we are allowed to quit it."""
 RESILIENCE_INTERVAL = 5
 
+""" LEASE_TTL specifies the amount of time (in seconds) the lease held by a process on the service lasts when it is not
+    renewed, e.g. because the process died. Leases are renewed three times within this time. It can be overridden
+    through the GALEN_API_LEASE_TTL environment variable."""
+LEASE_TTL = float(os.getenv('GALEN_API_LEASE_TTL', 30))
+
+""" STARTUP_TIMEOUT specifies the maximum amount of time (in seconds) a client waits for the remote server to answer
+    before giving up. It can be overridden through the GALEN_API_STARTUP_TIMEOUT environment variable."""
+STARTUP_TIMEOUT = float(os.getenv('GALEN_API_STARTUP_TIMEOUT', 30))
+
+""" Delays (in seconds) of the exponential backoff used while probing the remote server for readiness."""
+INITIAL_PROBE_DELAY = 0.05
+MAX_PROBE_DELAY = 1
+
+""" POOL_SIZE is the maximum number of connections open towards a single service. Threads asking for a connection
+    when all of them are leased wait for one to be released. It can be overridden through the GALEN_API_POOL_SIZE
+    environment variable."""
+POOL_SIZE = int(os.getenv('GALEN_API_POOL_SIZE', 8))
+
+""" IDLE_CONNECTION_TIMEOUT specifies after which amount of time (in seconds) an unused connection gets closed."""
+IDLE_CONNECTION_TIMEOUT = 60
+
+""" Calls which can be safely sent again over a new connection when the one they were sent over breaks."""
+IDEMPOTENT_CALLS = frozenset(['initialize', 'register_test', 'server_info', 'active_drivers', 'upload_spec'])
+
 logger = logging.getLogger()
 
+_pools = {}
+_pools_lock = Lock()
+_pool_creation_locks = {}
+
 
 class ThriftClient(object):
     """
     Facade class providing access to services exposed by Thrift interface hiding all complex details.
+    Calls are served by connections leased from a pool shared by all the clients of the same service, so that
+    instances are cheap to create and safe to use from multiple threads.
     """
-    def __init__(self, service_port=GALEN_REMOTE_API_SERVICE_DEFAULT_PORT):
+    def __init__(self, service_port=GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, startup_timeout=STARTUP_TIMEOUT):
         try:
-            start_galen_remote_api_service(service_port)
-            sleep(3) #TODO Implement wait until server is running
-            socket = TSocket.TSocket('localhost', service_port)
-            self.transport = TTransport.TFramedTransport(socket)
-            protocol_factory = TBinaryProtocol.TBinaryProtocolFactory()
-            protocol = protocol_factory.getProtocol(self.transport)
-            self.client = GalenApiRemoteService.Client(protocol)
-            self.transport.open()
+            self.pool = get_connection_pool(service_port, startup_timeout)
         except Thrift.TException as tx:
-            stop_galen_remote_api_service(GALEN_REMOTE_API_SERVICE_DEFAULT_PORT)
+            logger.error("Could not connect to Galen API service on port {port}: {error}"
+                         .format(port=service_port, error=tx.message))
+            stop_galen_remote_api_service(service_port)
             raise Exception('%s' % (tx.message))
+        except ServiceStartupError as e:
+            logger.error("Could not start Galen API service on port {port}: {error}".format(port=service_port, error=e))
+            raise
+
+    def session(self):
+        """
+        Pins a connection to the calling thread for the duration of a with block, so that a sequence of calls does not
+        go back to the pool after each of them.
+        """
+        return self.pool.lease()
 
     def initialize(self, remote_url):
-        self.client.initialize(remote_url)
+        self._call('initialize', remote_url)
         return self
 
-    def execute(self, session_id, command, request_params):
-        return self.client.execute(session_id, command, request_params)
+    def execute(self, session_id, command, request_params, response_format=ResponseFormat.JSON):
+        return self._call('execute', session_id, command, request_params, response_format)
+
+    def execute_batch(self, session_id, commands, response_format=ResponseFormat.JSON):
+        return self._call('execute_batch', session_id, commands, response_format)
+
+    def take_screenshot(self, session_id):
+        return self._call('take_screenshot', session_id)
+
+    def save_screenshot(self, session_id):
+        return self._call('save_screenshot', session_id)
 
     def quit_service_if_inactive(self):
-        sleep(RESILIENCE_INTERVAL)
-        if self.get_active_drivers() == 0:
-            self.shut_service()
+        """
+        Returns straight away when the service stops by itself, once idle for IDLE_TIMEOUT, as the lease of this
+        process is kept for the other threads and drivers using it until its pool is closed or the process exits.
+        Services without an idle timeout, or not supporting leases, are shut down if they have no active drivers after
+        RESILIENCE_INTERVAL.
+        """
+        quit_services_if_inactive([self])
 
     def get_active_drivers(self):
-        return self.client.active_drivers()
+        return self._call('active_drivers')
+
+    def get_server_info(self):
+        return self._call('server_info')
 
     def shut_service(self):
+        self.pool.release_lease()
         try:
-            self.client.shut_service()
+            self._call('shut_service')
         except TTransportException:
             pass
+        finally:
+            close_connection_pool(self.pool.server_port, self.pool.host)
 
     def register_test(self, test_name):
-        self.client.register_test(test_name)
+        self._call('register_test', test_name)
+
+    def check_layout(self, driver_session_id, spec_name, included_tags, excluded_tags, use_cache=False):
+        try:
+            return self._call('check_layout', driver_session_id, spec_name, included_tags, excluded_tags, use_cache)
+        except SpecNotFoundException as e:
+            logger.error(e.message)
+            raise SpecNotFoundException(e)
 
-    def check_layout(self, driver_session_id, spec_name, included_tags, excluded_tags):
+    def check_layouts(self, driver_session_id, checks, use_cache=False):
         try:
-            return self.client.check_layout(driver_session_id, spec_name, included_tags, excluded_tags)
+            return self._call('check_layouts', driver_session_id, checks, use_cache)
         except SpecNotFoundException as e:
             logger.error(e.message)
             raise SpecNotFoundException(e)
 
+    def check_layout_viewports(self, driver_session_id, spec_name, viewports, use_cache=False):
+        try:
+            return self._call('check_layout_viewports', driver_session_id, spec_name, viewports, use_cache)
+        except SpecNotFoundException as e:
+            logger.error(e.message)
+            raise SpecNotFoundException(e)
+
+    def upload_spec(self, bundle):
+        """
+        Uploads a SpecBundle to the service, unless the same bundle was already uploaded to it.
+        :return: the path of the spec on the service.
+        """
+        key = (bundle.digest, bundle.spec)
+        if key not in self.pool.uploaded_specs:
+            files = [SpecFile(path=file_path, content=content) for file_path, content in bundle.files]
+            try:
+                self.pool.uploaded_specs[key] = self._call('upload_spec', bundle.spec, files)
+            except SpecNotFoundException as e:
+                logger.error(e.message)
+                raise SpecNotFoundException(e)
+        return self.pool.uploaded_specs[key]
+
+    def append_nodes(self, test_name, chunk):
+        self._call('append_nodes', test_name, chunk)
+
     def finalize(self, test_name, report):
         try:
-            self.client.append(test_name, report)
+            self._call('append', test_name, report)
         except Exception as e:
             logger.error(e)
             raise e
 
     def generate_report(self, report_folder_path):
-        self.client.generate_report(report_folder_path)
+        self._call('generate_report', report_folder_path)
+
+    def write_report_shard(self, shard_folder_path):
+        self._call('write_report_shard', shard_folder_path)
+
+    def merge_report_shards(self, shard_folder_paths, report_folder_path):
+        self._call('merge_report_shards', shard_folder_paths, report_folder_path)
+
+    def _call(self, method, *args):
+        """
+        Invokes the given remote method on a leased connection. Idempotent calls are retried once over a new
+        connection if the leased one breaks.
+        """
+        try:
+            return self._invoke(method, args)
+        except TTransportException:
+            if method not in IDEMPOTENT_CALLS:
+                raise
+            logger.warning("Connection broken while calling {method}, retrying".format(method=method))
+            if metrics.active:
+                metrics.count_reconnect(method)
+            return self._invoke(method, args)
+
+    def _invoke(self, method, args):
+        with self.pool.lease() as client:
+            if not metrics.active:
+                return getattr(client, method)(*args)
+            socket = self.pool.leased_connection().socket
+            bytes_sent, bytes_received = socket.bytes_sent, socket.bytes_received
+            error = None
+            started_at = clock()
+            try:
+                return getattr(client, method)(*args)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                metrics.observe_rpc(method, clock() - started_at, socket.bytes_sent - bytes_sent,
+                                    socket.bytes_received - bytes_received, error)
+
+
+class CountingSocket(TSocket.TSocket):
+    """
+    Socket transport counting the bytes sent and received through it.
+    """
+    def __init__(self, *args, **kwargs):
+        TSocket.TSocket.__init__(self, *args, **kwargs)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def read(self, sz):
+        buff = TSocket.TSocket.read(self, sz)
+        self.bytes_received += len(buff)
+        return buff
+
+    def write(self, buff):
+        TSocket.TSocket.write(self, buff)
+        self.bytes_sent += len(buff)
+
+
+class Connection(object):
+    """
+    A framed transport open towards the service along with the Thrift client bound to it.
+    """
+    def __init__(self, socket, transport, client):
+        self.socket = socket
+        self.transport = transport
+        self.client = client
+        self.last_used = time()
+
+    def is_dropped(self):
+        """
+        Tells whether the connection can no longer be used, without any round trip to the service. An idle connection
+        is not expected to have anything to read, so being readable means the service closed it.
+        """
+        handle = self.socket.handle
+        if handle is None:
+            return True
+        try:
+            readable, _, _ = select.select([handle], [], [], 0)
+        except (select.error, ValueError):
+            return True
+        return len(readable) > 0
+
+    def close(self):
+        self.transport.close()
+
+
+class ConnectionPool(object):
+    """
+    Bounded, thread-safe pool of connections towards the service on a given host and port. Thrift clients are not
+    re-entrant, hence a connection is leased to one thread at a time.
+    """
+    def __init__(self, server_port, host='localhost', max_size=POOL_SIZE, idle_timeout=IDLE_CONNECTION_TIMEOUT):
+        self.server_port = server_port
+        self.host = host
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(max_size)
+        self._leased = local()
+        # Paths on the service of the specs uploaded to it, by digest of their bundle.
+        self.uploaded_specs = {}
+        self.supports_leases = True
+        self._heartbeat = None
+        self._lease_lock = Lock()
+
+    @contextmanager
+    def lease(self):
+        """
+        Leases a connection for the duration of a with block and yields its client. Nested leases on the same thread
+        share the outer connection. Connections broken by a transport error are discarded rather than given back.
+        """
+        pinned = getattr(self._leased, 'connection', None)
+        if pinned is not None:
+            yield pinned.client
+            return
+        with self._slots:
+            connection = self._acquire()
+            self._leased.connection = connection
+            healthy = False
+            try:
+                yield connection.client
+                healthy = True
+            except Thrift.TException as e:
+                healthy = not isinstance(e, TTransportException)
+                raise
+            finally:
+                self._leased.connection = None
+                if healthy:
+                    self.release(connection)
+                else:
+                    connection.close()
+
+    def leased_connection(self):
+        """
+        Returns the connection leased to the calling thread, if any.
+        """
+        return getattr(self._leased, 'connection', None)
+
+    def release(self, connection):
+        connection.last_used = time()
+        with self._lock:
+            self._idle.append(connection)
+            expired = self._evict_expired()
+        for stale in expired:
+            stale.close()
+
+    def hold_lease(self, ttl=LEASE_TTL):
+        """
+        Acquires a lease on the service, unless one is already held, and keeps renewing it from a daemon thread until
+        release_lease() is called, so that the service does not stop itself while this process uses it.
+        """
+        with self._lease_lock:
+            if self._heartbeat is not None or not self.supports_leases:
+                return
+            try:
+                with self.lease() as client:
+                    lease_id = client.acquire_lease(int(ttl * 1000))
+            except TApplicationException:
+                logger.warning("Galen API service on port {port} does not support leases".format(port=self.server_port))
+                self.supports_leases = False
+                return
+            self._heartbeat = LeaseHeartbeat(self, lease_id, ttl)
+            self._heartbeat.start()
+
+    def release_lease(self):
+        with self._lease_lock:
+            heartbeat, self._heartbeat = self._heartbeat, None
+        if heartbeat is None:
+            return
+        heartbeat.stop()
+        try:
+            with self.lease() as client:
+                client.release_lease(heartbeat.lease_id)
+        except TTransportException as e:
+            logger.warning("Could not release lease on Galen API service: {0}".format(e))
+
+    def close(self):
+        self.release_lease()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def _acquire(self):
+        with self._lock:
+            expired = self._evict_expired()
+            connection = None
+            while self._idle and connection is None:
+                candidate = self._idle.pop()
+                if candidate.is_dropped():
+                    expired.append(candidate)
+                else:
+                    connection = candidate
+        for stale in expired:
+            stale.close()
+        return connection or open_connection(self.server_port, self.host)
+
+    def _evict_expired(self):
+        """
+        Removes connections unused for longer than idle_timeout. Idle connections are kept in the order they were
+        released, so the expired ones are at the head of the list.
+        """
+        threshold = time() - self.idle_timeout
+        count = 0
+        while count < len(self._idle) and self._idle[count].last_used < threshold:
+            count += 1
+        expired = self._idle[:count]
+        del self._idle[:count]
+        return expired
+
+
+class LeaseHeartbeat(Thread):
+    """
+    Daemon thread renewing the lease held by a connection pool on the service, acquiring a new one if it expired.
+    """
+    def __init__(self, pool, lease_id, ttl):
+        super(LeaseHeartbeat, self).__init__(name='Galen API lease heartbeat')
+        self.setDaemon(True)
+        self.pool = pool
+        self.lease_id = lease_id
+        self.ttl = ttl
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self.ttl / 3.0):
+            try:
+                with self.pool.lease() as client:
+                    if not client.renew_lease(self.lease_id):
+                        logger.warning("Lease on Galen API service expired, acquiring a new one")
+                        self.lease_id = client.acquire_lease(int(self.ttl * 1000))
+            except Thrift.TException as e:
+                logger.warning("Could not renew lease on Galen API service: {0}".format(e))
+
+    def stop(self):
+        """
+        Stops renewing the lease, waiting for a renewal in progress to complete.
+        """
+        self._stopped.set()
+        if self is not current_thread():
+            self.join()
+
+
+def get_connection_pool(server_port=GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, startup_timeout=STARTUP_TIMEOUT,
+                        host='localhost'):
+    """
+    Returns the process-wide connection pool for the service on the given host and port. The first call starts the
+    service if needed, waits until it is ready and takes a lease on it. Meanwhile, other threads asking for the same
+    service wait for its pool, while the ones asking for other services do not.
+    """
+    address = (host, server_port)
+    with _pools_lock:
+        pool = _pools.get(address)
+        if pool is not None:
+            return pool
+        creation_lock = _pool_creation_locks.setdefault(address, Lock())
+    with creation_lock:
+        with _pools_lock:
+            pool = _pools.get(address)
+        if pool is None:
+            start_galen_remote_api_service(server_port, startup_timeout)
+            pool = ConnectionPool(server_port, host)
+            pool.release(wait_for_service(server_port, startup_timeout, host))
+            pool.hold_lease()
+            with _pools_lock:
+                _pools[address] = pool
+        return pool
 
 
-def start_galen_remote_api_service(server_port):
+def get_connection_pools(server_ports, startup_timeout=STARTUP_TIMEOUT, host='localhost'):
+    """
+    Returns the connection pools for the services on the given ports, starting the ones without a pool all at once
+    rather than one after the other.
+    """
+    with _pools_lock:
+        missing = [server_port for server_port in server_ports if (host, server_port) not in _pools]
+    if len(missing) > 1:
+        start_galen_remote_api_services(missing, startup_timeout)
+    return [get_connection_pool(server_port, startup_timeout, host) for server_port in server_ports]
+
+
+def close_connection_pool(server_port=GALEN_REMOTE_API_SERVICE_DEFAULT_PORT, host='localhost'):
+    """
+    Closes all the idle connections towards the service on the given host and port and forgets its pool.
+    """
+    with _pools_lock:
+        pool = _pools.pop((host, server_port), None)
+    if pool:
+        pool.close()
+
+
+def close_connection_pools():
+    """
+    Closes the pools of all the services, which releases the leases held on them.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        try:
+            pool.close()
+        except Thrift.TException as e:
+            logger.warning("Could not close connection pool to Galen API service: {0}".format(e))
+
+
+atexit.register(close_connection_pools)
+
+
+def quit_services_if_inactive(clients):
+    """
+    Quits the services of the given clients as ThriftClient.quit_service_if_inactive does, waiting RESILIENCE_INTERVAL
+    once for all of them rather than once per service.
+    """
+    clients = [client for client in clients if IDLE_TIMEOUT <= 0 or not client.pool.supports_leases]
+    if not clients:
+        return
+    sleep(RESILIENCE_INTERVAL)
+    for client in clients:
+        if client.get_active_drivers() == 0:
+            client.shut_service()
+
+
+def open_connection(server_port, host='localhost'):
+    """
+    Opens a framed transport to the service on the given host and port, or on the given Unix domain socket.
+    """
+    if is_unix_socket(server_port):
+        socket = CountingSocket(unix_socket=server_port)
+    else:
+        socket = CountingSocket(host, server_port)
+    transport = TTransport.TFramedTransport(socket)
+    protocol_factory = TBinaryProtocol.TBinaryProtocolFactory()
+    protocol = protocol_factory.getProtocol(transport)
+    client = _service_module().Client(protocol)
+    transport.open()
+    return Connection(socket, transport, client)
+
+
+def _service_module():
+    """
+    Imports the generated service on first use, as it is by far the largest of the Thrift modules.
+    """
+    from pythrift import GalenApiRemoteService
+    return GalenApiRemoteService
+
+
+def wait_for_service(server_port, timeout=STARTUP_TIMEOUT, host='localhost'):
+    """
+    Connects to the service and probes it with server_info() until it answers, backing off exponentially between
+    attempts. Returns the connection as soon as the service is ready, or raises TTransportException once timeout has
+    elapsed.
+    """
+    started_at = time()
+    deadline = started_at + timeout
+    delay = INITIAL_PROBE_DELAY
+    attempts = 0
+    while True:
+        attempts += 1
+        connection = None
+        try:
+            connection = open_connection(server_port, host)
+            try:
+                connection.client.server_info()
+            except TApplicationException:
+                # Servers predating server_info() still prove to be up by answering.
+                pass
+            logger.info("Galen API service on port {port} ready after {elapsed:.3f}s ({attempts} attempts)"
+                        .format(port=server_port, elapsed=time() - started_at, attempts=attempts))
+            return connection
+        except TTransportException as e:
+            if connection:
+                connection.close()
+            if time() + delay > deadline:
+                raise TTransportException(TTransportException.TIMED_OUT,
+                                          "Galen API service on port {port} not ready after {timeout}s: {error}"
+                                          .format(port=server_port, timeout=timeout, error=e))
+            sleep(delay)
+            delay = min(delay * 2, MAX_PROBE_DELAY)
+
+
+def start_galen_remote_api_service(server_port, startup_timeout=STARTUP_TIMEOUT):
     """
     Start Galen API service on the given port.
     """
-    if os.getenv('SERVER_ALWAYS_ON', 'False') is 'False':
-        start_server(server_port)
+    if os.getenv('SERVER_ALWAYS_ON', 'False') == 'False':
+        start_server(server_port, startup_timeout)
+
+
+def start_galen_remote_api_services(server_ports, startup_timeout=STARTUP_TIMEOUT):
+    """
+    Start Galen API services on the given ports concurrently.
+    """
+    if os.getenv('SERVER_ALWAYS_ON', 'False') == 'False':
+        start_servers(server_ports, startup_timeout)
 
 
 def stop_galen_remote_api_service(server_port):
     """
     Stops Galen API service on the given port.
     """
-    if os.getenv('SERVER_ALWAYS_ON', 'False') is 'False':
+    if os.getenv('SERVER_ALWAYS_ON', 'False') == 'False':
         stop_server(server_port)
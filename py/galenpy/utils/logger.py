@@ -22,3 +22,12 @@ def get_logger_config_path():
     Locates the logging configuration file.
     """
     return path.join(path.dirname(__file__), 'logging.config')
+
+
+def configure_logging(config_path=None):
+    """
+    Configures logging from the given file, by default the bundled one logging everything to stdout through the root
+    logger. This replaces the configuration of the application, hence it is only done on request.
+    """
+    from logging import config
+    config.fileConfig(config_path or get_logger_config_path())
@@ -14,7 +14,29 @@
 # limitations under the License.                                           #
 ############################################################################
 
+import io
+import os
+import re
+from collections import namedtuple
+from fnmatch import fnmatch
+from hashlib import sha256
 from os import path
+from threading import Lock
+
+from galenpy.exception import FileNotFoundError
+
+
+""" Matches the lines of a spec importing other specs or running scripts, in both the "@@ import a.spec" and the
+    "@import a.spec" syntaxes."""
+SPEC_REFERENCE = re.compile(r'^@(?:@\s*)?(?:import|script)\s+(.+)$')
+
+SpecBundle = namedtuple('SpecBundle', ['spec', 'files', 'digest'])
+
+_indexes = {}
+_indexes_lock = Lock()
+
+_contents = {}
+_contents_lock = Lock()
 
 
 class GalenSpecFinder(object):
@@ -23,6 +45,7 @@ class GalenSpecFinder(object):
     """
     def __init__(self):
         self.spec_folder = None
+        self.index = None
 
     def from_specs_in_current_folder(self, spec_folder_name):
         """
@@ -36,17 +59,156 @@ class GalenSpecFinder(object):
         """
         if path.isdir(spec_folder):
             self.spec_folder = spec_folder
+            self.index = spec_index(spec_folder)
         else:
             raise IOError(str(spec_folder) + " not found.")
         return self
 
     def with_name(self, spec_name):
         """
-        Builds and return whole path to provided specs file.
+        Builds and return whole path to provided specs file. The spec is looked up by its path relative to the specs
+        folder or, when it lies in a sub folder, by its file name alone.
+        :raises FileNotFoundError: if no spec, or more than one, matches the name.
+        """
+        return self.index.find(spec_name)
+
+    def matching(self, pattern):
+        """
+        Returns the whole paths of the specs whose path relative to the specs folder matches a glob pattern, e.g.
+        'mobile/*.spec'.
         """
-        full_path = path.join(self.spec_folder, spec_name)
-        if path.exists(full_path):
-            return full_path
+        return self.index.glob(pattern)
+
+
+class SpecIndex(object):
+    """
+    Index of the files found in a specs folder and its sub folders. The tree is walked once and lookups are then
+    served from memory without touching the file system. It is walked again only when a lookup misses and a folder
+    was modified since, i.e. a file was added, removed or renamed.
+    """
+    def __init__(self, root):
+        self.root = path.abspath(root)
+        self._lock = Lock()
+        self._paths = {}
+        self._names = {}
+        self._folder_mtimes = None
+
+    def find(self, spec_name):
+        with self._lock:
+            if self._folder_mtimes is None:
+                self._build()
+            spec_path = self._lookup(spec_name)
+            if spec_path is None and self._is_stale():
+                self._build()
+                spec_path = self._lookup(spec_name)
+        if spec_path is None:
+            raise FileNotFoundError("Spec {} not found in {}".format(spec_name, self.root))
+        return spec_path
+
+    def glob(self, pattern):
+        with self._lock:
+            if self._folder_mtimes is None or self._is_stale():
+                self._build()
+            return sorted(spec_path for relative_path, spec_path in self._paths.items()
+                          if fnmatch(relative_path, pattern))
+
+    def _lookup(self, spec_name):
+        if path.isabs(spec_name):
+            spec_name = path.relpath(spec_name, self.root)
+        relative_path = path.normpath(spec_name).replace(os.sep, '/')
+        if relative_path in self._paths:
+            return self._paths[relative_path]
+        candidates = self._names.get(relative_path, [])
+        if len(candidates) > 1:
+            raise FileNotFoundError("Spec {} is ambiguous, it matches {}".format(spec_name, ', '.join(candidates)))
+        return candidates[0] if candidates else None
+
+    def _build(self):
+        paths = {}
+        names = {}
+        folder_mtimes = {}
+        for folder, _, file_names in os.walk(self.root):
+            folder_mtimes[folder] = path.getmtime(folder)
+            for file_name in file_names:
+                spec_path = path.join(folder, file_name)
+                paths[path.relpath(spec_path, self.root).replace(os.sep, '/')] = spec_path
+                names.setdefault(file_name, []).append(spec_path)
+        self._paths, self._names, self._folder_mtimes = paths, names, folder_mtimes
+
+    def _is_stale(self):
+        try:
+            return any(path.getmtime(folder) != mtime for folder, mtime in self._folder_mtimes.items())
+        except OSError:
+            return True
+
+
+def spec_index(spec_folder):
+    """
+    Returns the index of a specs folder, which is built once per process.
+    """
+    root = path.abspath(spec_folder)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = SpecIndex(root)
+        return _indexes[root]
+
+
+def read_spec(spec_path):
+    """
+    Returns the content of a spec file along with its SHA-256 digest. Contents are kept in memory and read again only
+    once the modification time or the size of the file changes.
+    """
+    spec_path = path.abspath(spec_path)
+    stat = os.stat(spec_path)
+    version = (stat.st_mtime, stat.st_size)
+    with _contents_lock:
+        cached = _contents.get(spec_path)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    with io.open(spec_path, encoding='utf-8') as spec_file:
+        content = spec_file.read()
+    digest = sha256(content.encode('utf-8')).hexdigest()
+    with _contents_lock:
+        _contents[spec_path] = (version, content, digest)
+    return content, digest
+
+
+def referenced_files(line):
+    """
+    Returns the paths, relative to the folder of the spec, of the files imported or run by a line of a spec.
+    """
+    match = SPEC_REFERENCE.match(line.strip())
+    return re.split(r'[\s,]+', match.group(1).strip()) if match else []
+
+
+def spec_bundle(spec_path):
+    """
+    Collects a spec along with the files it imports or whose scripts it runs, recursively, so that it can be uploaded
+    to a service which does not share its file system.
+    :return: a SpecBundle holding the path of the spec and the (path, content) pairs of all the files, with paths
+        relative to the folder containing all of them, along with a digest of the whole bundle.
+    :raises FileNotFoundError: if the spec or one of the files it references does not exist.
+    """
+    contents = {}
+    pending = [path.abspath(spec_path)]
+    while pending:
+        file_path = pending.pop()
+        if file_path in contents:
+            continue
+        try:
+            contents[file_path] = read_spec(file_path)[0]
+        except (IOError, OSError):
+            raise FileNotFoundError("Spec file {} not found".format(file_path))
+        folder = path.dirname(file_path)
+        for line in contents[file_path].splitlines():
+            pending.extend(path.normpath(path.join(folder, referenced)) for referenced in referenced_files(line))
+    root = path.dirname(path.commonprefix([path.dirname(file_path) + os.sep for file_path in contents]))
+    files = sorted((path.relpath(file_path, root).replace(os.sep, '/'), content)
+                   for file_path, content in contents.items())
+    digest = sha256()
+    for file_path, content in files:
+        digest.update(file_path.encode('utf-8') + b'\0' + content.encode('utf-8') + b'\0')
+    return SpecBundle(path.relpath(path.abspath(spec_path), root).replace(os.sep, '/'), files, digest.hexdigest())
 
 
 def from_specs_in_current_folder(spec_folder_name):
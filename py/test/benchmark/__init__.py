@@ -0,0 +1,13 @@
+import timeit
+
+
+def best_time(func, repeat=3):
+    """
+    Returns the best time, in seconds, a call to func took over a few repetitions of as many calls as fit in about
+    0.2 seconds.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < 0.2 and number < 1000000:
+        number *= 10
+    return min(timer.repeat(repeat=repeat, number=number)) / number
@@ -0,0 +1,113 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Measures the time taken to import galenpy modules in a fresh interpreter, along with the number of modules each import
+loads. On Python 3.7 or later, the modules taking the longest to import by themselves are listed as reported by
+-X importtime.
+
+Run from the py folder with: python -m test.benchmark.bench_import_time [-o results.json] [-b baseline.json]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+MODULES = ['galenpy', 'galenpy.utils.specs', 'galenpy.galen_report', 'galenpy.thrift_client', 'galenpy.galen_api',
+           'galenpy.galen_webdriver']
+
+RUNS = 5
+
+TOP = 5
+
+SCRIPT = '''
+import sys
+from timeit import default_timer as clock
+loaded = len(sys.modules)
+sys.stderr.write('--\\n')
+started_at = clock()
+import {module}
+print(clock() - started_at)
+print(len(sys.modules) - loaded)
+'''
+
+
+def import_time(module):
+    """
+    :return: the best time, in seconds, taken to import the module over RUNS fresh interpreters, the number of modules
+        loaded by the import and, when available, the (microseconds, module) pairs of the modules taking the longest to
+        import by themselves.
+    """
+    command = [sys.executable]
+    if sys.version_info >= (3, 7):
+        command.extend(['-X', 'importtime'])
+    command.extend(['-c', SCRIPT.format(module=module)])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    best = None
+    for _ in range(RUNS):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        out, err = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError("Importing {module} failed:\n{error}".format(module=module, error=err.decode()))
+        elapsed, loaded = out.decode().split()
+        if best is None or float(elapsed) < best[0]:
+            best = float(elapsed), int(loaded), _heaviest(err.decode())
+    return best
+
+
+def bench_import_time(results, top=0):
+    for module in MODULES:
+        elapsed, loaded, heaviest = import_time(module)
+        results.add('import_time', dict(module=module), elapsed * 1000, 'ms')
+        results.add('import_modules', dict(module=module), loaded, 'modules')
+        for self_time, name in heaviest[:top]:
+            print("    {time:>10.3f} ms  {name}".format(time=self_time / 1000.0, name=name))
+
+
+def main(args=None):
+    from test.benchmark.bench_suite import Results, compare
+
+    parser = argparse.ArgumentParser(description='Measures the time taken to import galenpy modules.')
+    parser.add_argument('-o', '--output', help='file the results are saved to as JSON')
+    parser.add_argument('-b', '--baseline', help='results of a previous run to compare with')
+    options = parser.parse_args(args)
+
+    results = Results()
+    bench_import_time(results, TOP)
+    if options.output:
+        results.save(options.output)
+    if options.baseline and compare(results, options.baseline):
+        sys.exit(1)
+
+
+def _heaviest(importtime_output):
+    """
+    Parses the -X importtime lines written after the marker into (self microseconds, module) pairs, heaviest first.
+    """
+    lines = importtime_output.split('--\n', 1)[-1].splitlines()
+    timings = []
+    for line in lines:
+        if line.startswith('import time:') and '|' in line:
+            self_time, _, name = line[len('import time:'):].split('|')
+            if self_time.strip().isdigit():
+                timings.append((int(self_time), name.strip()))
+    return sorted(timings, reverse=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Builds and finalizes test reports of 1k, 100k and 1M nodes, sent at once or streamed in chunks, and records the time
+taken along with the peak memory allocated while doing so. Reports are serialized as they would be sent to the
+service, but are not sent.
+
+Run from the py folder with: python -m test.benchmark.bench_report_nodes
+"""
+
+import gc
+from time import time
+
+from thrift.TSerialization import serialize
+
+from galenpy.galen_report import TestReport, error_node, info_node, warn_node
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+SIZES = [1000, 100000, 1000000]
+
+""" Nodes are added in sections of SECTION_SIZE nodes, as a test would add the outcome of each of its steps."""
+SECTION_SIZE = 100
+
+CHUNK_SIZE = 1000
+
+
+class SerializingClient(object):
+    """
+    Stands for a ThriftClient, serializing the reports it is given instead of sending them.
+    """
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def register_test(self, test_name):
+        pass
+
+    def append_nodes(self, test_name, chunk):
+        self.bytes_sent += len(serialize(chunk))
+
+    def finalize(self, test_name, report):
+        self.bytes_sent += len(serialize(report))
+
+
+def build_and_finalize(size, chunk_size):
+    client = SerializingClient()
+    build_report(TestReport('benchmark', client, chunk_size=chunk_size), size)
+    return client.bytes_sent
+
+
+def build_report(report, size):
+    """
+    Adds size nodes to the report, in sections as a test would, and finalizes it.
+    """
+    for section in range(size // SECTION_SIZE):
+        step = info_node('step {0}'.format(section))
+        for i in range(SECTION_SIZE - 2):
+            step.with_node(info_node('check {0}'.format(i)))
+        step.with_node(warn_node('slow step').with_node(error_node('step failed')))
+        report.add_report_node(step)
+    report.finalize()
+
+
+def measure(size, chunk_size):
+    """
+    Returns the time taken and, when tracemalloc is available, the peak memory allocated in a separate run, as
+    tracing allocations slows them down.
+    """
+    gc.collect()
+    started_at = time()
+    bytes_sent = build_and_finalize(size, chunk_size)
+    elapsed = time() - started_at
+    peak = None
+    if tracemalloc:
+        gc.collect()
+        tracemalloc.start()
+        build_and_finalize(size, chunk_size)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak, bytes_sent
+
+
+def main():
+    print("{nodes:>10}{mode:>10}{time:>12}{peak:>14}{sent:>14}".format(nodes='nodes', mode='mode', time='seconds',
+                                                                      peak='peak MB', sent='MB sent'))
+    for size in SIZES:
+        for mode, chunk_size in [('at once', None), ('streamed', CHUNK_SIZE)]:
+            elapsed, peak, bytes_sent = measure(size, chunk_size)
+            print("{nodes:>10}{mode:>10}{time:>12.2f}{peak:>14}{sent:>14.1f}".format(
+                nodes=size, mode=mode, time=elapsed, peak='n/a' if peak is None else '{0:.1f}'.format(peak / 2.0 ** 20),
+                sent=bytes_sent / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
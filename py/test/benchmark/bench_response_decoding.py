@@ -0,0 +1,74 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Micro-benchmark of unwrap_response_value() on responses made of 10, 1k and 100k contained values, shaped as the
+results of find_elements and as deeply nested values.
+
+Run from the py folder with: python -m test.benchmark.bench_response_decoding
+"""
+
+import uuid
+
+from galenpy.galen_webdriver import unwrap_response_value
+from galenpy.pythrift.ttypes import ResponseValue, Value
+from test.benchmark import best_time
+
+
+SIZES = [10, 1000, 100000]
+
+
+def element_list_response(size):
+    """
+    Builds the graph the server sends for a find_elements returning size / 2 elements, i.e. a list of
+    {'ELEMENT': <id>} maps.
+    """
+    contained_values = []
+    element_ids = []
+    for _ in range(size // 2):
+        element_id = _contained(contained_values, Value(string_value=uuid.uuid4().hex))
+        element_ids.append(_contained(contained_values, Value(map_values={'ELEMENT': element_id})))
+    return Value(list_values=element_ids), contained_values
+
+
+def nested_response(size):
+    """
+    Builds the graph of size lists nested into each other, the innermost one holding an int.
+    """
+    contained_values = []
+    value_id = _contained(contained_values, Value(int_value=0))
+    for _ in range(size - 1):
+        value_id = _contained(contained_values, Value(list_values=[value_id]))
+    return Value(list_values=[value_id]), contained_values
+
+
+def _contained(contained_values, value):
+    value_id = uuid.uuid4().hex
+    contained_values.append(ResponseValue(value_id=value_id, value=value))
+    return value_id
+
+
+def main():
+    print("{shape:<14}{size:>10}{time:>16}".format(shape='shape', size='values', time='ms per decode'))
+    for shape, build in [('element list', element_list_response), ('nested', nested_response)]:
+        for size in SIZES:
+            value, contained_values = build(size)
+            elapsed = best_time(lambda: unwrap_response_value(value, contained_values))
+            print("{shape:<14}{size:>10}{time:>16.3f}".format(shape=shape, size=size, time=elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Compares the graph of ResponseValue and the JSON document encodings of WebDriver responses, in terms of bytes sent
+over the wire and of time spent by the client to deserialize and decode them.
+
+Run from the py folder with: python -m test.benchmark.bench_response_formats
+"""
+
+import json
+import uuid
+
+from thrift.TSerialization import deserialize, serialize
+
+from galenpy.galen_webdriver import to_response_dict
+from galenpy.pythrift.ttypes import Response, ResponseValue, Value
+from test.benchmark import best_time
+
+
+MAX_INT = 2 ** 31 - 1
+
+
+def payloads():
+    """
+    Values shaped as the ones returned by commands which produce large responses.
+    """
+    capabilities = dict(('capability{0}'.format(i), i % 2 == 0) for i in range(30))
+    capabilities.update(browserName='chrome', version='45.0', platform='LINUX',
+                        chrome={'userDataDir': '/tmp/.com.google.Chrome.XXXX'})
+    return [
+        ('find_elements 1k', [{'ELEMENT': uuid.uuid4().hex} for _ in range(1000)]),
+        ('capabilities', capabilities),
+        ('page source 200KB', '<div class="item">galen</div>' * 7000),
+        ('script result 1k', [dict(x=i, y=i * 2, width=100, height=20, visible=True, text='row {0}'.format(i))
+                              for i in range(1000)]),
+    ]
+
+
+def graph_response(value):
+    """
+    Encodes the value as the server's ThriftValueWrapper does.
+    """
+    contained_values = []
+    return Response(response_value=_wrap(value, contained_values), contained_values=contained_values, status=0)
+
+
+def json_response(value):
+    return Response(json_value=json.dumps(value), status=0)
+
+
+def _wrap(value, contained_values):
+    wrapped = ResponseValue(value_id=uuid.uuid4().hex)
+    if value is None:
+        return wrapped
+    elif isinstance(value, bool):
+        wrapped.value = Value(boolean_value=value)
+    elif isinstance(value, int) and abs(value) <= MAX_INT:
+        wrapped.value = Value(int_value=value)
+    elif isinstance(value, int):
+        wrapped.value = Value(wrapped_long_value=str(value))
+    elif isinstance(value, dict):
+        map_values = {}
+        for k, v in value.items():
+            item = _wrap(v, contained_values)
+            map_values[k] = item.value_id
+            contained_values.append(item)
+        wrapped.value = Value(map_values=map_values)
+    elif isinstance(value, list):
+        list_values = []
+        for v in value:
+            item = _wrap(v, contained_values)
+            list_values.append(item.value_id)
+            contained_values.append(item)
+        wrapped.value = Value(list_values=list_values)
+    else:
+        wrapped.value = Value(string_value=str(value))
+    return wrapped
+
+
+def main():
+    print("{payload:<20}{format:<8}{size:>12}{time:>16}".format(payload='payload', format='format', size='bytes',
+                                                                 time='ms per decode'))
+    for name, value in payloads():
+        for response_format, encode in [('graph', graph_response), ('json', json_response)]:
+            data = serialize(encode(value))
+            elapsed = best_time(lambda: to_response_dict(deserialize(Response(), data)))
+            print("{payload:<20}{format:<8}{size:>12}{time:>16.3f}".format(payload=name, format=response_format,
+                                                                           size=len(data), time=elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Benchmark suite of the client against an in-process stand-in of the service, so that it runs without Java, a browser or
+a network. It measures import time, client startup, execute round trips and throughput, screenshots, response
+decoding, the read cache, session placement, test report building, layout check overhead and device matrices, and
+saves the results as JSON so that runs on different commits can be compared.
+
+Run from the py folder with: python -m test.benchmark.bench_suite -o results.json [-b baseline.json]
+"""
+
+import argparse
+import base64
+import gc
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from os import path
+from threading import Thread
+from time import time
+
+from galenpy.galen_api import Galen
+from galenpy.galen_report import TestReport
+from galenpy.galen_webdriver import GalenRemoteWebDriver, ThriftRemoteConnection, to_response_dict, \
+    unwrap_response_value
+from galenpy.metrics import clock
+from galenpy.placement import CONSISTENT_HASHING, LEAST_LOADED, placed_client
+from galenpy.pythrift.ttypes import ResponseFormat
+from galenpy.thrift_client import ThriftClient, close_connection_pool
+from test.benchmark import best_time
+from test.benchmark.bench_import_time import bench_import_time
+from test.benchmark.bench_report_nodes import build_report
+from test.benchmark.bench_response_decoding import element_list_response, nested_response
+from test.benchmark.stand_in_service import SESSION_ID, serve_stand_in
+
+
+STARTUPS = 20
+
+""" Number of elements returned by the execute calls measured, and number of calls made for each."""
+RESPONSE_SIZES = [(0, 2000), (100, 500), (10000, 20)]
+
+THREADS = [1, 4, 16]
+CALLS_PER_THREAD = 500
+
+DECODED_SIZES = [10, 1000, 100000]
+
+REPORT_SIZES = [1000, 10000, 100000]
+REPORT_CHUNK_SIZE = 1000
+
+""" Sizes (in bytes) of the screenshots taken, and number taken for each."""
+SCREENSHOT_SIZES = [(100 * 1024, 50), (8 * 1024 * 1024, 5)]
+
+""" Number of elements asserted on each page, how many times each, and number of pages loaded."""
+READ_CACHE_PAGES = (10, 5, 50)
+
+""" Number of services sessions are placed on, and number of sessions placed."""
+PLACEMENT_SERVICES = 4
+PLACEMENTS = 500
+
+""" Number of files imported by the specs checked, and number of checks made for each."""
+SPEC_IMPORTS = [(0, 500), (10, 500), (100, 200)]
+
+""" Devices of the matrices checked, and number of matrices checked."""
+DEVICES = [('phone', (375, 667), ['mobile']), ('phone-landscape', (667, 375), ['mobile']),
+           ('tablet', (768, 1024), ['tablet']), ('tablet-landscape', (1024, 768), ['tablet']),
+           ('laptop', (1366, 768), ['desktop']), ('desktop', (1920, 1080), ['desktop'])]
+MATRICES = 100
+
+""" Results of a run are flagged as regressions when they are this much worse than the baseline."""
+REGRESSION_THRESHOLD = 1.2
+
+
+class Results(object):
+    """
+    Measurements of a run, each one identified by the name of the benchmark and its parameters.
+    """
+    def __init__(self):
+        self.measurements = []
+
+    def add(self, benchmark, params, value, unit, higher_is_better=False):
+        self.measurements.append(dict(benchmark=benchmark, params=params, value=value, unit=unit,
+                                      higher_is_better=higher_is_better))
+        print("{benchmark:<28}{params:<40}{value:>14.3f} {unit}".format(
+            benchmark=benchmark, params=', '.join('{0}={1}'.format(k, v) for k, v in sorted(params.items())),
+            value=value, unit=unit))
+
+    def save(self, file_path):
+        document = dict(commit=_commit(), created_at=time(), python=platform.python_version(),
+                        platform=platform.platform(), measurements=self.measurements)
+        with open(file_path, 'w') as results_file:
+            json.dump(document, results_file, indent=2, sort_keys=True)
+
+
+def bench_client_startup(port, results):
+    """
+    Time taken by a client to connect to a running service and take a lease on it.
+    """
+    timings = []
+    for _ in range(STARTUPS):
+        close_connection_pool(port)
+        started_at = clock()
+        ThriftClient(port)
+        timings.append(clock() - started_at)
+    results.add('client_startup', {}, _percentile(timings, 50) * 1000, 'ms')
+
+
+def bench_execute_latency(client, results, transport='tcp'):
+    for size, calls in RESPONSE_SIZES:
+        params = json.dumps({'size': size})
+        for format_name, response_format in [('json', ResponseFormat.JSON), ('graph', ResponseFormat.GRAPH)]:
+            timings = []
+            for _ in range(calls):
+                started_at = clock()
+                client.execute(SESSION_ID, 'findElements', params, response_format)
+                timings.append(clock() - started_at)
+            for percentile in [50, 95]:
+                results.add('execute_latency', dict(elements=size, format=format_name, percentile=percentile,
+                                                    transport=transport),
+                            _percentile(timings, percentile) * 1000, 'ms')
+
+
+def bench_execute_throughput(client, results):
+    params = json.dumps({'size': 1})
+
+    def run():
+        for _ in range(CALLS_PER_THREAD):
+            client.execute(SESSION_ID, 'findElements', params)
+
+    for thread_count in THREADS:
+        threads = [Thread(target=run) for _ in range(thread_count)]
+        started_at = clock()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = clock() - started_at
+        results.add('execute_throughput', dict(threads=thread_count), thread_count * CALLS_PER_THREAD / elapsed,
+                    'calls/s', higher_is_better=True)
+
+
+def bench_screenshot(client, handler, results):
+    """
+    Time taken to get a screenshot as PNG bytes, as base64 text through execute or as binary through take_screenshot.
+    """
+    for size, screenshots in SCREENSHOT_SIZES:
+        handler.screenshot_size = size
+        params = json.dumps({'size': size})
+        channels = [
+            ('base64', lambda: base64.b64decode(to_response_dict(client.execute(SESSION_ID, 'screenshot', params))
+                                                ['value'].encode('ascii'))),
+            ('binary', lambda: client.take_screenshot(SESSION_ID)),
+        ]
+        for channel, take_screenshot in channels:
+            timings = []
+            for _ in range(screenshots):
+                started_at = clock()
+                take_screenshot()
+                timings.append(clock() - started_at)
+            results.add('screenshot', dict(bytes=size, channel=channel), _percentile(timings, 50) * 1000, 'ms')
+
+
+def bench_read_cache(client, results):
+    """
+    Time taken by a page load followed by assertions on the rect and CSS values of its elements, with the read cache
+    disabled and enabled.
+    """
+    elements, assertions, pages = READ_CACHE_PAGES
+    for read_cache in [False, True]:
+        connection = ThriftRemoteConnection('http://127.0.0.1:4444/wd/hub', client, read_cache=read_cache)
+        connection.set_session_id(SESSION_ID)
+        started_at = clock()
+        for page in range(pages):
+            connection.execute('get', {'sessionId': SESSION_ID, 'url': 'http://example.com/{0}'.format(page)})
+            for _ in range(assertions):
+                for i in range(elements):
+                    element = {'sessionId': SESSION_ID, 'id': 'element-{0}'.format(i)}
+                    connection.execute('getElementRect', element)
+                    connection.execute('getElementValueOfCssProperty', dict(element, propertyName='display'))
+        elapsed = clock() - started_at
+        results.add('read_cache', dict(enabled=read_cache), elapsed * 1000 / pages, 'ms')
+
+
+def bench_placement(results):
+    """
+    Time taken to place a session on one of several services, by load or by hashing.
+    """
+    addresses = [serve_stand_in()[1] for _ in range(PLACEMENT_SERVICES)]
+    for placement in [LEAST_LOADED, CONSISTENT_HASHING]:
+        timings = []
+        for i in range(PLACEMENTS):
+            started_at = clock()
+            with placed_client('session-{0}'.format(i), addresses, placement):
+                pass
+            timings.append(clock() - started_at)
+        results.add('placement', dict(placement=placement, services=PLACEMENT_SERVICES),
+                    _percentile(timings, 50) * 1000, 'ms')
+    for address in addresses:
+        close_connection_pool(address)
+
+
+def bench_decoding(results):
+    for shape, build in [('element_list', element_list_response), ('nested', nested_response)]:
+        for size in DECODED_SIZES:
+            value, contained_values = build(size)
+            results.add('decode', dict(shape=shape, values=size),
+                        best_time(lambda: unwrap_response_value(value, contained_values)) * 1000, 'ms')
+
+
+def bench_report(client, handler, results):
+    for size in REPORT_SIZES:
+        for mode, chunk_size in [('at_once', None), ('streamed', REPORT_CHUNK_SIZE)]:
+            gc.collect()
+            nodes_received = handler.nodes_received
+            started_at = clock()
+            build_report(TestReport('benchmark', client, chunk_size=chunk_size), size)
+            elapsed = clock() - started_at
+            assert handler.nodes_received > nodes_received, "the report did not reach the service"
+            results.add('report', dict(mode=mode, nodes=size), elapsed * 1000, 'ms')
+
+
+def bench_check_layout(client, results):
+    """
+    Time taken by Galen.check_layout(), reading specs from the service or uploading them along with their imports.
+    """
+    driver = _stand_in_driver(client)
+    spec_folder = tempfile.mkdtemp()
+    try:
+        for imports, checks in SPEC_IMPORTS:
+            spec = _write_spec(spec_folder, imports)
+            for upload_specs in [False, True]:
+                galen = Galen(client, upload_specs=upload_specs)
+                galen.check_layout(driver, spec, ['desktop'], None)
+                timings = []
+                for _ in range(checks):
+                    started_at = clock()
+                    galen.check_layout(driver, spec, ['desktop'], None)
+                    timings.append(clock() - started_at)
+                results.add('check_layout', dict(imports=imports, upload=upload_specs),
+                            _percentile(timings, 50) * 1000, 'ms')
+    finally:
+        shutil.rmtree(spec_folder)
+
+
+def bench_check_layout_matrix(client, results):
+    """
+    Time taken to check a page in the viewports of several devices, resizing the window and checking the layout for
+    each device from the client, or through a single Galen.check_layout_matrix() call.
+    """
+    driver = _stand_in_driver(client)
+    galen = Galen(client)
+    spec = 'specs/page.spec'
+
+    def one_by_one():
+        for _, (width, height), tags in DEVICES:
+            client.execute(SESSION_ID, 'setWindowSize', json.dumps({'width': width, 'height': height}))
+            galen.check_layout(driver, spec, tags, None)
+
+    checks = [('one_by_one', one_by_one), ('matrix', lambda: galen.check_layout_matrix(driver, None, spec, DEVICES))]
+    for mode, check in checks:
+        timings = []
+        for _ in range(MATRICES):
+            started_at = clock()
+            check()
+            timings.append(clock() - started_at)
+        results.add('check_layout_matrix', dict(devices=len(DEVICES), mode=mode), _percentile(timings, 50) * 1000, 'ms')
+
+
+def compare(results, baseline_path):
+    """
+    Prints how the results compare with the ones of a previous run and returns the number of regressions.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = dict((_key(measurement), measurement['value']) for measurement in baseline['measurements'])
+    regressions = 0
+    print("\nCompared with {commit}".format(commit=baseline.get('commit')))
+    for measurement in results.measurements:
+        before = previous.get(_key(measurement))
+        if not before or not measurement['value']:
+            continue
+        ratio = measurement['value'] / before
+        if measurement['higher_is_better']:
+            ratio = 1 / ratio
+        regressed = ratio > REGRESSION_THRESHOLD
+        regressions += regressed
+        print("{benchmark:<28}{params:<40}{ratio:>8.2f}x{flag}".format(
+            benchmark=measurement['benchmark'], params=_key(measurement)[1], ratio=ratio,
+            flag='  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks galenpy against a stand-in of the Galen API service.')
+    parser.add_argument('-o', '--output', help='file the results are saved to as JSON')
+    parser.add_argument('-b', '--baseline', help='results of a previous run to compare with')
+    options = parser.parse_args(args)
+
+    os.environ['SERVER_ALWAYS_ON'] = 'True'
+    handler, port = serve_stand_in()
+    results = Results()
+    bench_import_time(results)
+    bench_client_startup(port, results)
+    client = ThriftClient(port)
+    bench_execute_latency(client, results)
+    bench_execute_throughput(client, results)
+    bench_screenshot(client, handler, results)
+    bench_read_cache(client, results)
+    bench_placement(results)
+    bench_decoding(results)
+    bench_report(client, handler, results)
+    bench_check_layout(client, results)
+    bench_check_layout_matrix(client, results)
+    close_connection_pool(port)
+
+    if hasattr(socket, 'AF_UNIX'):
+        socket_folder = tempfile.mkdtemp()
+        try:
+            _, unix_socket = serve_stand_in(unix_socket=path.join(socket_folder, 'galen-api.sock'))
+            bench_execute_latency(ThriftClient(unix_socket), results, transport='unix')
+            close_connection_pool(unix_socket)
+        finally:
+            shutil.rmtree(socket_folder)
+
+    if options.output:
+        results.save(options.output)
+    if options.baseline and compare(results, options.baseline):
+        sys.exit(1)
+
+
+def _stand_in_driver(thrift_client):
+    """
+    Builds a GalenRemoteWebDriver bound to the given client without opening a session through its constructor, which
+    always connects to the service on the default port.
+    """
+    driver = GalenRemoteWebDriver.__new__(GalenRemoteWebDriver)
+    driver.thrift_client = thrift_client
+    driver.session_id = SESSION_ID
+    driver.command_executor = ThriftRemoteConnection('http://127.0.0.1:4444/wd/hub', thrift_client, read_cache=False)
+    driver.command_executor.set_session_id(SESSION_ID)
+    return driver
+
+
+def _write_spec(spec_folder, imports):
+    spec = path.join(spec_folder, 'page-{0}.spec'.format(imports))
+    with open(spec, 'w') as spec_file:
+        for i in range(imports):
+            part = 'part-{0}.spec'.format(i)
+            with open(path.join(spec_folder, part), 'w') as part_file:
+                part_file.write('header  id header\n= Header =\n    header:\n        height 50 to 100px\n')
+            spec_file.write('@@ import {0}\n'.format(part))
+        spec_file.write('\ncontent  id content\n= Content =\n    content:\n        below header 0px\n')
+    return spec
+
+
+def _percentile(timings, percentile):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100.0))]
+
+
+def _key(measurement):
+    return measurement['benchmark'], ', '.join('{0}={1}'.format(k, v) for k, v in sorted(measurement['params'].items()))
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    main()
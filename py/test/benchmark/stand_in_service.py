@@ -0,0 +1,175 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+In-process stand-in for the Galen API service, answering over a real framed Thrift socket with synthetic responses, so
+that the client can be benchmarked without Java, a browser or a network.
+"""
+
+import base64
+import json
+import os
+import socket
+import uuid
+from threading import Lock, Thread
+
+from thrift.protocol import TBinaryProtocol
+from thrift.server import TServer
+from thrift.transport import TSocket, TTransport
+
+from galenpy.pythrift import GalenApiRemoteService
+from galenpy.pythrift.ttypes import LayoutCheckReport, Response, ResponseFormat, ServerInfo, ViewportCheckReport
+from test.benchmark.bench_response_formats import graph_response
+
+
+SESSION_ID = 'stand-in-session'
+
+CAPABILITIES = {'browserName': 'chrome', 'version': '45.0', 'platform': 'LINUX', 'javascriptEnabled': True}
+
+
+class StandInService(GalenApiRemoteService.Iface):
+    """
+    Answers WebDriver commands with synthetic values and layout checks with empty reports, and sinks test reports
+    while counting their nodes. Commands given a 'size' parameter return a list of as many elements, shaped as the
+    result of find_elements, except for the screenshot command which returns as many bytes encoded in base64, as
+    WebDriver does. Screenshots taken through the binary channel are screenshot_size bytes long.
+    """
+    def __init__(self, screenshot_size=1024):
+        self.screenshot_size = screenshot_size
+        self.nodes_received = 0
+        self.leases = set()
+        self._lock = Lock()
+
+    def initialize(self, remote_server_addr):
+        pass
+
+    def execute(self, session_id, command, params, response_format):
+        if command == 'newSession':
+            value = CAPABILITIES
+        elif command == 'screenshot':
+            value = base64.b64encode(os.urandom(json.loads(params or '{}').get('size', 0))).decode('ascii')
+        else:
+            size = json.loads(params or '{}').get('size')
+            value = None if size is None else [{'ELEMENT': 'element-{0}'.format(i)} for i in range(size)]
+        if response_format == ResponseFormat.GRAPH:
+            response = graph_response(value)
+        else:
+            response = Response(json_value=json.dumps(value), status=0)
+        response.session_id = SESSION_ID
+        return response
+
+    def execute_batch(self, session_id, commands, response_format):
+        return [self.execute(session_id, command.command, command.params, response_format) for command in commands]
+
+    def take_screenshot(self, session_id):
+        return os.urandom(self.screenshot_size)
+
+    def save_screenshot(self, session_id):
+        return 'screenshots/stand-in.png'
+
+    def register_test(self, test_name):
+        pass
+
+    def append(self, test_name, report_tree):
+        self._count_nodes(report_tree)
+
+    def append_nodes(self, test_name, chunk):
+        self._count_nodes(chunk)
+
+    def check_layout(self, webdriver_session_id, specs, included_tags, excluded_tags, use_cache):
+        return LayoutCheckReport(unique_id=uuid.uuid4().hex, errors=0, warnings=0)
+
+    def check_layouts(self, webdriver_session_id, checks, use_cache):
+        return [LayoutCheckReport(unique_id=uuid.uuid4().hex, errors=0, warnings=0) for _ in checks]
+
+    def check_layout_viewports(self, webdriver_session_id, specs, viewports, use_cache):
+        reports = []
+        size = None
+        for viewport in viewports:
+            resized = (viewport.width, viewport.height) != size
+            size = (viewport.width, viewport.height)
+            reports.append(ViewportCheckReport(name=viewport.name, resized=resized, elapsed_millis=0,
+                                               report=LayoutCheckReport(unique_id=uuid.uuid4().hex, errors=0,
+                                                                        warnings=0)))
+        return reports
+
+    def upload_spec(self, spec_path, files):
+        return 'uploaded/' + spec_path
+
+    def generate_report(self, report_folder_path):
+        pass
+
+    def write_report_shard(self, shard_folder_path):
+        pass
+
+    def merge_report_shards(self, shard_folder_paths, report_folder_path):
+        pass
+
+    def server_info(self):
+        return ServerInfo(version='stand-in', uptime_millis=0, layout_cache_hits=0, layout_cache_misses=0)
+
+    def active_drivers(self):
+        return 0
+
+    def acquire_lease(self, ttl_millis):
+        lease_id = uuid.uuid4().hex
+        with self._lock:
+            self.leases.add(lease_id)
+        return lease_id
+
+    def renew_lease(self, lease_id):
+        return lease_id in self.leases
+
+    def release_lease(self, lease_id):
+        with self._lock:
+            self.leases.discard(lease_id)
+
+    def shut_service(self):
+        pass
+
+    def _count_nodes(self, report_tree):
+        with self._lock:
+            self.nodes_received += len(report_tree.nodes or [])
+
+
+def free_port():
+    probe = socket.socket()
+    probe.bind(('localhost', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def serve_stand_in(handler=None, port=None, unix_socket=None):
+    """
+    Serves a StandInService, or the given handler, from a daemon thread, one thread per connection, on the given Unix
+    domain socket or on a TCP port.
+    :return: the handler and the port, or socket path, it is served on.
+    """
+    handler = handler or StandInService()
+    if unix_socket:
+        port = unix_socket
+        server_socket = TSocket.TServerSocket(unix_socket=unix_socket)
+    else:
+        port = port or free_port()
+        server_socket = TSocket.TServerSocket(host='localhost', port=port)
+    server = TServer.TThreadedServer(GalenApiRemoteService.Processor(handler), server_socket,
+                                     TTransport.TFramedTransportFactory(), TBinaryProtocol.TBinaryProtocolFactory(),
+                                     daemon=True)
+    thread = Thread(target=server.serve, name='Stand-in Galen API service')
+    thread.setDaemon(True)
+    thread.start()
+    return handler, port
@@ -0,0 +1,46 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+"""
+Fixtures of the unit tests, which run against in-process stand-ins of the service rather than against Java, a browser
+or a network.
+
+Run from the py folder with: python -m pytest test
+"""
+
+import pytest
+
+from galenpy.thrift_client import close_connection_pool
+from test.benchmark.stand_in_service import serve_stand_in
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """
+    Serves stand-ins of the service, which clients find running rather than starting one, and closes the pools of
+    their clients afterwards.
+    :return: a function serving the given handler, by default a StandInService, and returning it along with its port.
+    """
+    monkeypatch.setenv('SERVER_ALWAYS_ON', 'True')
+    ports = []
+
+    def serve_handler(handler=None):
+        handler, port = serve_stand_in(handler)
+        ports.append(port)
+        return handler, port
+    yield serve_handler
+    for port in ports:
+        close_connection_pool(port)
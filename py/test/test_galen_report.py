@@ -0,0 +1,102 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+from galenpy import galen_report
+from galenpy.galen_report import error_node, info_node, warn_node
+from galenpy.pythrift.ttypes import LayoutCheckReport
+from galenpy.thrift_client import ThriftClient
+from test.benchmark.stand_in_service import StandInService
+
+
+class ReportSink(StandInService):
+    """
+    Stand-in of the service keeping the reports it receives, as the (method, test name, node names) of each call.
+    """
+    def __init__(self):
+        super(ReportSink, self).__init__()
+        self.registered = []
+        self.received = []
+
+    def register_test(self, test_name):
+        self.registered.append(test_name)
+
+    def append(self, test_name, report_tree):
+        self.received.append(('append', test_name, [node.name for node in report_tree.nodes]))
+
+    def append_nodes(self, test_name, chunk):
+        self.received.append(('append_nodes', test_name, [node.name for node in chunk.nodes]))
+
+
+def report_sink(serve):
+    sink, port = serve(ReportSink())
+    return sink, ThriftClient(port)
+
+
+def test_report_is_sent_at_once_when_finalized(serve):
+    sink, client = report_sink(serve)
+    report = galen_report.TestReport('test', client)
+    report.add_report_node(info_node('first').with_node(warn_node('child'))).add_report_node(error_node('second'))
+
+    assert sink.registered == ['test']
+    assert sink.received == []
+    report.finalize()
+    assert sink.received == [('append', 'test', ['first', 'child', 'second'])]
+
+
+def test_streamed_report_is_sent_in_chunks_as_nodes_are_added(serve):
+    sink, client = report_sink(serve)
+    report = galen_report.TestReport('streamed test', client, chunk_size=3)
+    for i in range(4):
+        report.add_report_node(info_node('node {0}'.format(i)).with_node(info_node('child {0}'.format(i))))
+
+    assert sink.received == [('append_nodes', 'streamed test', ['node 0', 'child 0', 'node 1']),
+                             ('append_nodes', 'streamed test', ['child 1', 'node 2', 'child 2'])]
+    report.finalize()
+    assert sink.received[2:] == [('append', 'streamed test', ['node 3', 'child 3'])]
+
+
+def test_chunks_keep_parents_before_their_children(serve):
+    _, client = report_sink(serve)
+    report = galen_report.TestReport('test', client, chunk_size=2)
+    sent = []
+    client.append_nodes = lambda test_name, chunk: sent.extend(chunk.nodes)
+    report.add_report_node(info_node('root').with_node(info_node('a').with_node(info_node('a1')))
+                           .with_node(info_node('b')))
+    sent.extend(report.report.nodes)
+
+    assert [node.name for node in sent] == ['root', 'a', 'a1', 'b']
+    nodes_by_id = dict((node.unique_id, node) for node in sent)
+    for index, node in enumerate(sent):
+        if node.parent_id != report.report.root_id:
+            assert sent.index(nodes_by_id[node.parent_id]) < index
+        assert [nodes_by_id[child_id].name for child_id in node.nodes_ids] == \
+            [child.name for child in sent if child.parent_id == node.unique_id]
+
+
+def test_layout_report_node_refers_to_the_layout_check(serve):
+    sink, client = report_sink(serve)
+    report = galen_report.TestReport('test', client, chunk_size=1)
+    report.add_layout_report_node('check home page', LayoutCheckReport(unique_id='layout-report', errors=0,
+                                                                       warnings=0))
+
+    assert sink.received == [('append_nodes', 'test', ['check home page'])]
+    assert len(report.report.nodes) == 0
+
+
+def test_node_ids_are_unique():
+    nodes = [info_node('node').build() for _ in range(1000)]
+
+    assert len(set(node.unique_id for node in nodes)) == 1000
@@ -0,0 +1,220 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+import json
+
+import pytest
+from selenium.common.exceptions import WebDriverException
+from thrift.TSerialization import deserialize, serialize
+
+from galenpy import galen_webdriver
+from galenpy.galen_webdriver import GalenRemoteWebDriver, ThriftRemoteConnection, to_response_dict, \
+    unwrap_response_value
+from galenpy.placement import placed_client
+from galenpy.pythrift.ttypes import Response, ResponseFormat
+from galenpy.thrift_client import ThriftClient
+from test.benchmark.bench_response_decoding import nested_response
+from test.benchmark.bench_response_formats import graph_response, json_response, payloads
+from test.benchmark.stand_in_service import CAPABILITIES, SESSION_ID, StandInService
+
+
+ELEMENT = {'id': 'element-0'}
+
+
+class RecordingClient(object):
+    """
+    Thrift client answering from a StandInService within the process, which records the commands it is sent.
+    """
+    def __init__(self):
+        self.service = StandInService()
+        self.sent = []
+
+    def execute(self, session_id, command, params, response_format):
+        self.sent.append(command)
+        return self.service.execute(session_id, command, params, response_format)
+
+    def execute_batch(self, session_id, commands, response_format):
+        self.sent.extend(command.command for command in commands)
+        return self.service.execute_batch(session_id, commands, response_format)
+
+
+class RecordingService(StandInService):
+    """
+    Stand-in of the service recording the commands it executes, a batch being recorded as the list of its commands.
+    """
+    def __init__(self):
+        super(RecordingService, self).__init__()
+        self.executed = []
+
+    def execute(self, session_id, command, params, response_format):
+        self.executed.append(command)
+        return super(RecordingService, self).execute(session_id, command, params, response_format)
+
+    def execute_batch(self, session_id, commands, response_format):
+        self.executed.append([command.command for command in commands])
+        return [super(RecordingService, self).execute(session_id, command.command, command.params, response_format)
+                for command in commands]
+
+
+@pytest.fixture
+def stand_in_driver(serve, monkeypatch):
+    """
+    :return: a GalenRemoteWebDriver whose session is opened on a RecordingService, along with the service.
+    """
+    service, port = serve(RecordingService())
+    monkeypatch.setattr(galen_webdriver, 'placed_client', lambda placement_key: placed_client(placement_key, [port]))
+    driver = GalenRemoteWebDriver(desired_capabilities=CAPABILITIES)
+    del service.executed[:]
+    return driver, service
+
+
+def cached_connection():
+    connection = ThriftRemoteConnection('http://localhost:4444/wd/hub', RecordingClient(), read_cache=True)
+    connection.set_session_id(SESSION_ID)
+    return connection
+
+
+def test_repeated_reads_are_answered_from_the_cache():
+    connection = cached_connection()
+    connection.execute('getElementRect', ELEMENT)
+    connection.execute('getElementRect', ELEMENT)
+    connection.execute('getWindowSize', {})
+
+    assert connection.thrift_client.sent == ['getElementRect', 'getWindowSize']
+    assert connection.read_cache.stats() == dict(hits=1, misses=2, epoch=0, size=2)
+
+
+def test_cached_responses_are_not_altered_by_the_caller():
+    connection = cached_connection()
+    connection.execute('getElementRect', dict(ELEMENT, size=1))['value'].append('altered')
+
+    assert connection.execute('getElementRect', dict(ELEMENT, size=1))['value'] == [{'ELEMENT': 'element-0'}]
+
+
+def test_read_is_invalidated_by_a_mutating_command():
+    connection = cached_connection()
+    connection.execute('getElementRect', ELEMENT)
+    connection.execute('clickElement', ELEMENT)
+    connection.execute('getElementRect', ELEMENT)
+
+    assert connection.thrift_client.sent == ['getElementRect', 'clickElement', 'getElementRect']
+    assert connection.read_cache.epoch == 1
+
+
+def test_read_is_invalidated_by_a_batch():
+    connection = cached_connection()
+    connection.execute('getElementRect', ELEMENT)
+    batch = connection.start_batch()
+    connection.execute('setWindowSize', {'width': 720, 'height': 1024})
+    connection.execute('getElementRect', ELEMENT)
+    connection.send_batch(batch)
+    connection.execute('getElementRect', ELEMENT)
+
+    assert connection.thrift_client.sent == ['getElementRect', 'setWindowSize', 'getElementRect', 'getElementRect']
+
+
+def test_title_url_and_window_handle_are_read_every_time_without_invalidating():
+    connection = cached_connection()
+    connection.execute('getElementRect', ELEMENT)
+    for command in ['getTitle', 'getCurrentUrl', 'getCurrentWindowHandle'] * 2:
+        connection.execute(command, {})
+    connection.execute('getElementRect', ELEMENT)
+
+    assert connection.thrift_client.sent == ['getElementRect'] + ['getTitle', 'getCurrentUrl',
+                                                                  'getCurrentWindowHandle'] * 2
+    assert connection.read_cache.epoch == 0
+
+
+def test_without_read_cache_every_read_is_sent():
+    connection = ThriftRemoteConnection('http://localhost:4444/wd/hub', RecordingClient(), read_cache=False)
+    connection.execute('getElementRect', ELEMENT)
+    connection.execute('getElementRect', ELEMENT)
+
+    assert connection.thrift_client.sent == ['getElementRect', 'getElementRect']
+    assert connection.read_cache is None
+
+
+def test_session_is_opened_on_the_service(stand_in_driver):
+    driver, _ = stand_in_driver
+
+    assert driver.session_id == SESSION_ID
+    assert driver.capabilities['browserName'] == 'chrome'
+
+
+def test_batch_sends_its_commands_in_a_single_call(stand_in_driver):
+    driver, service = stand_in_driver
+    with driver.batch() as batch:
+        driver.set_window_size(720, 1024)
+        driver.get('http://example.com')
+        assert service.executed == []
+
+    assert service.executed == [['setWindowSize', 'get']]
+    assert [response['status'] for response in batch.responses] == [0, 0]
+
+
+def test_nested_batch_joins_the_outer_one(stand_in_driver):
+    driver, service = stand_in_driver
+    with driver.batch():
+        driver.get('http://example.com')
+        with driver.batch() as nested_batch:
+            driver.get('http://example.com/nested')
+        assert nested_batch.responses == []
+
+    assert service.executed == [['get', 'get']]
+
+
+def test_batch_is_discarded_when_its_block_fails(stand_in_driver):
+    driver, service = stand_in_driver
+    with pytest.raises(ValueError):
+        with driver.batch():
+            driver.get('http://example.com')
+            raise ValueError()
+    driver.get('http://example.com/next')
+
+    assert service.executed == ['get']
+
+
+def test_screenshots_cannot_be_taken_within_a_batch(stand_in_driver):
+    driver, _ = stand_in_driver
+    with pytest.raises(WebDriverException):
+        with driver.batch():
+            driver.get_screenshot_as_png()
+
+
+def test_json_and_graph_responses_decode_to_the_same_value():
+    for name, value in payloads() + [('long', 2 ** 40), ('null', None), ('nested', [{'a': [1, {'b': False}]}])]:
+        for response in [json_response(value), graph_response(value)]:
+            received = deserialize(Response(), serialize(response))
+            assert to_response_dict(received)['value'] == value, name
+
+
+def test_deeply_nested_values_are_decoded():
+    depth = 10000
+    value = unwrap_response_value(*nested_response(depth))
+    for _ in range(depth):
+        value, = value
+
+    assert value == 0
+
+
+def test_responses_are_decoded_in_both_formats_over_the_wire(serve):
+    _, port = serve()
+    client = ThriftClient(port)
+    elements = [{'ELEMENT': 'element-{0}'.format(i)} for i in range(3)]
+
+    for response_format in [ResponseFormat.JSON, ResponseFormat.GRAPH]:
+        response = client.execute(SESSION_ID, 'findElements', json.dumps({'size': 3}), response_format)
+        assert to_response_dict(response) == dict(status=0, sessionId=SESSION_ID, state=None, value=elements)
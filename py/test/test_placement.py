@@ -0,0 +1,84 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+from collections import Counter
+
+from galenpy.placement import CONSISTENT_HASHING, LEAST_LOADED, HashRing, placed_client, ring_of
+from test.benchmark.stand_in_service import StandInService
+
+
+ADDRESSES = [9092, 9093, 9094, 9095]
+KEYS = ['session-{0}'.format(i) for i in range(2000)]
+
+
+class LoadedService(StandInService):
+    """
+    Stand-in of the service reporting a given number of active drivers.
+    """
+    def __init__(self, active_drivers):
+        super(LoadedService, self).__init__()
+        self._active_drivers = active_drivers
+
+    def active_drivers(self):
+        return self._active_drivers
+
+
+def test_key_always_hashes_to_the_same_address():
+    ring, other_ring = HashRing(ADDRESSES), HashRing(list(reversed(ADDRESSES)))
+
+    assert [ring.address_of(key) for key in KEYS] == [other_ring.address_of(key) for key in KEYS]
+
+
+def test_keys_are_spread_across_all_the_addresses():
+    ring = HashRing(ADDRESSES)
+    shares = Counter(ring.address_of(key) for key in KEYS)
+
+    assert set(shares) == set(ADDRESSES)
+    assert min(shares.values()) > len(KEYS) / len(ADDRESSES) / 2
+
+
+def test_adding_an_address_only_moves_keys_to_it():
+    ring, grown_ring = HashRing(ADDRESSES), HashRing(ADDRESSES + [9096])
+    moved = [key for key in KEYS if ring.address_of(key) != grown_ring.address_of(key)]
+
+    assert moved
+    assert set(grown_ring.address_of(key) for key in moved) == set([9096])
+    assert len(moved) < len(KEYS) / 2
+
+
+def test_consistent_hashing_places_a_key_on_its_ring_address(serve):
+    addresses = [serve()[1] for _ in range(3)]
+    for key in KEYS[:10]:
+        with placed_client(key, addresses, CONSISTENT_HASHING) as client:
+            assert client.pool.server_port == ring_of(addresses).address_of(key)
+
+
+def test_least_loaded_placement_picks_the_service_with_fewest_drivers(serve):
+    addresses = [serve(LoadedService(active_drivers))[1] for active_drivers in [1, 0, 9]]
+    with placed_client(None, addresses, LEAST_LOADED) as client:
+        assert client.pool.server_port == addresses[1]
+        # Sessions being created count as drivers of the service they were placed on.
+        with placed_client(None, addresses, LEAST_LOADED) as second_client:
+            with placed_client(None, addresses, LEAST_LOADED) as third_client:
+                assert set([second_client.pool.server_port, third_client.pool.server_port]) == set(addresses[:2])
+    with placed_client(None, addresses, LEAST_LOADED) as client:
+        assert client.pool.server_port == addresses[1]
+
+
+def test_single_service_is_always_picked(serve):
+    _, port = serve()
+    with placed_client('any key', [port], CONSISTENT_HASHING) as client:
+        assert client.pool.server_port == port
@@ -0,0 +1,79 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+import subprocess
+import sys
+from time import sleep
+
+import pytest
+
+from galenpy import remote_service_lifecycle
+from galenpy.exception import ServiceStartupError
+from galenpy.remote_service_lifecycle import read_pid, stop_server, wait_until_listening, write_pid
+from test.benchmark.stand_in_service import free_port
+from test.test_thrift_client import StoppableService
+
+
+@pytest.fixture
+def run_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(remote_service_lifecycle, 'RUN_DIR', str(tmpdir))
+    return tmpdir
+
+
+def idle_process():
+    return subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+
+
+def test_service_not_listening_in_time_is_terminated_and_forgotten(run_dir):
+    port = free_port()
+    server_process = idle_process()
+    write_pid(port, server_process.pid)
+
+    with pytest.raises(ServiceStartupError):
+        wait_until_listening(server_process, port, 0.2)
+    assert server_process.poll() is not None
+    assert read_pid(port) is None
+
+
+def test_stale_pid_file_naming_another_process_is_not_signalled(run_dir, serve, monkeypatch):
+    handler, port = serve(StoppableService())
+    unrelated_process = idle_process()
+    write_pid(port, unrelated_process.pid)
+    monkeypatch.setattr(remote_service_lifecycle, 'SHUTDOWN_GRACE_PERIOD', 0.1)
+    try:
+        stop_server(port)
+
+        assert unrelated_process.poll() is None
+        assert handler.shut == 1
+        assert read_pid(port) is None
+    finally:
+        unrelated_process.kill()
+        unrelated_process.wait()
+
+
+def test_service_named_by_the_pid_file_is_terminated(run_dir, serve, monkeypatch):
+    _, port = serve()
+    server_process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)',
+                                       remote_service_lifecycle.GALEN_REMOTE_API_SERVER_JAR, '-r', str(port)])
+    # The command line is the one of this process until the child has run exec.
+    while str(port) not in remote_service_lifecycle._command_line(server_process.pid):
+        sleep(0.01)
+    write_pid(port, server_process.pid)
+    monkeypatch.setattr(remote_service_lifecycle, 'SHUTDOWN_GRACE_PERIOD', 0.1)
+    stop_server(port)
+
+    assert server_process.wait() != 0
+    assert read_pid(port) is None
@@ -0,0 +1,165 @@
+############################################################################
+# Copyright 2015 Valerio Morsella                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#    http://www.apache.org/licenses/LICENSE-2.0                            #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+############################################################################
+
+from threading import Thread
+
+import pytest
+from thrift.transport.TTransport import TTransportException
+
+from galenpy import thrift_client
+from galenpy.thrift_client import ConnectionPool, ThriftClient, close_connection_pool, get_connection_pool, \
+    quit_services_if_inactive
+from test.benchmark.stand_in_service import SESSION_ID, StandInService
+
+
+class BreakingService(StandInService):
+    """
+    Drops the connection a call is made over, as a service restarting would, when asked to break.
+    """
+    def __init__(self):
+        super(BreakingService, self).__init__()
+        self.breaks = 0
+        self.calls = []
+
+    def server_info(self):
+        self._record('server_info')
+        return super(BreakingService, self).server_info()
+
+    def execute(self, session_id, command, params, response_format):
+        self._record('execute')
+        return super(BreakingService, self).execute(session_id, command, params, response_format)
+
+    def _record(self, method):
+        self.calls.append(method)
+        if self.breaks > 0:
+            self.breaks -= 1
+            raise TTransportException(TTransportException.END_OF_FILE, 'Connection dropped by the stand-in')
+
+
+class StoppableService(StandInService):
+    """
+    Counts the calls to shut_service.
+    """
+    def __init__(self):
+        super(StoppableService, self).__init__()
+        self.shut = 0
+
+    def shut_service(self):
+        self.shut += 1
+
+
+def test_client_takes_a_single_lease_for_the_process(serve):
+    handler, port = serve()
+    first_client, second_client = ThriftClient(port), ThriftClient(port)
+
+    assert first_client.pool is second_client.pool
+    assert len(handler.leases) == 1
+
+    close_connection_pool(port)
+    assert len(handler.leases) == 0
+
+
+def test_connections_are_reused(serve):
+    _, port = serve()
+    pool = get_connection_pool(port)
+    with pool.lease() as first_client:
+        pass
+    with pool.lease() as second_client:
+        with pool.lease() as nested_client:
+            pass
+
+    assert second_client is first_client
+    assert nested_client is second_client
+
+
+def test_pool_opens_at_most_max_size_connections(serve):
+    _, port = serve()
+    pool = ConnectionPool(port, max_size=2)
+    clients = []
+
+    def call():
+        with pool.lease() as client:
+            clients.append(client)
+            client.active_drivers()
+    threads = [Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(clients) == 8
+    assert len(set(clients)) <= 2
+    pool.close()
+
+
+def test_idempotent_call_is_retried_over_a_new_connection(serve):
+    handler, port = serve(BreakingService())
+    client = ThriftClient(port)
+    handler.breaks = 1
+    del handler.calls[:]
+
+    assert client.get_server_info().version == 'stand-in'
+    assert handler.calls == ['server_info', 'server_info']
+
+
+def test_other_calls_are_not_retried_and_the_broken_connection_is_dropped(serve):
+    handler, port = serve(BreakingService())
+    client = ThriftClient(port)
+    with client.pool.lease() as broken_client:
+        pass
+    handler.breaks = 1
+    del handler.calls[:]
+
+    with pytest.raises(TTransportException):
+        client.execute(SESSION_ID, 'getTitle', '{}')
+    assert handler.calls == ['execute']
+    with client.pool.lease() as new_client:
+        assert new_client is not broken_client
+    assert client.execute(SESSION_ID, 'getTitle', '{}').status == 0
+
+
+def test_shut_service_releases_the_lease_and_forgets_the_pool(serve):
+    handler, port = serve()
+    client = ThriftClient(port)
+    client.shut_service()
+
+    assert len(handler.leases) == 0
+    assert ThriftClient(port).pool is not client.pool
+    assert len(handler.leases) == 1
+
+
+def test_services_not_stopping_by_themselves_are_quit_after_a_single_wait(serve, monkeypatch):
+    handlers, ports = zip(*[serve(StoppableService()) for _ in range(3)])
+    clients = [ThriftClient(port) for port in ports]
+    sleeps = []
+    monkeypatch.setattr(thrift_client, 'IDLE_TIMEOUT', 0)
+    monkeypatch.setattr(thrift_client, 'sleep', sleeps.append)
+    quit_services_if_inactive(clients)
+
+    assert sleeps == [thrift_client.RESILIENCE_INTERVAL]
+    assert [handler.shut for handler in handlers] == [1, 1, 1]
+
+
+def test_services_stopping_by_themselves_are_left_straight_away(serve, monkeypatch):
+    handler, port = serve(StoppableService())
+    client = ThriftClient(port)
+    sleeps = []
+    monkeypatch.setattr(thrift_client, 'IDLE_TIMEOUT', 10)
+    monkeypatch.setattr(thrift_client, 'sleep', sleeps.append)
+    client.quit_service_if_inactive()
+
+    assert sleeps == []
+    assert handler.shut == 0
@@ -0,0 +1,82 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+package galen.api.server;
+
+import org.apache.thrift.TException;
+import org.apache.thrift.TProcessor;
+import org.apache.thrift.protocol.TMessage;
+import org.apache.thrift.protocol.TProtocol;
+import org.apache.thrift.protocol.TProtocolDecorator;
+
+import java.util.concurrent.Semaphore;
+
+/**
+ * Serves at most a given number of calls at the same time, whatever the number of connections they come from, as
+ * servers running a thread per connection would not bound it otherwise. A permit is only taken once the header of a
+ * call has been read, since the thread of an idle connection waits for the next call within process().
+ */
+public class BoundedProcessor implements TProcessor {
+    private final TProcessor processor;
+    private final Semaphore permits;
+
+    public BoundedProcessor(TProcessor processor, int maxConcurrentCalls) {
+        this.processor = processor;
+        this.permits = new Semaphore(maxConcurrentCalls, true);
+    }
+
+    @Override
+    public boolean process(TProtocol in, TProtocol out) throws TException {
+        PermitProtocol call = new PermitProtocol(in);
+        try {
+            return processor.process(call, out);
+        } finally {
+            call.releasePermit();
+        }
+    }
+
+    /**
+     * Input protocol taking a permit as soon as the header of a call is read, which is held until the call has been
+     * served.
+     */
+    private class PermitProtocol extends TProtocolDecorator {
+        private boolean holdsPermit;
+
+        PermitProtocol(TProtocol protocol) {
+            super(protocol);
+        }
+
+        @Override
+        public TMessage readMessageBegin() throws TException {
+            TMessage message = super.readMessageBegin();
+            try {
+                permits.acquire();
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+                throw new TException("Interrupted while waiting to serve a call", e);
+            }
+            holdsPermit = true;
+            return message;
+        }
+
+        void releasePermit() {
+            if (holdsPermit) {
+                holdsPermit = false;
+                permits.release();
+            }
+        }
+    }
+}
@@ -17,24 +17,34 @@
 package galen.api.server;
 
 import org.openqa.selenium.WebDriver;
-import org.openqa.selenium.remote.RemoteWebDriver;
+import org.openqa.selenium.WebDriverException;
 import org.openqa.selenium.remote.SessionNotFoundException;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
-import java.util.ArrayList;
-import java.util.List;
+import java.util.Iterator;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ConcurrentMap;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.ThreadFactory;
+import java.util.concurrent.TimeUnit;
 
 import static galen.api.server.utils.DriverUtils.getSessionId;
 import static java.lang.String.format;
 
 /**
- * Utility class to store and retrieve instances of RemoteWebdriver.
+ * Utility class to store and retrieve instances of RemoteWebdriver by session id. Sessions not used for longer than a
+ * given time, typically left behind by clients which crashed, can be reaped in the background so that they do not
+ * hold browsers on the grid nor keep the service alive.
  */
 public class DriversPool {
     private Logger log = LoggerFactory.getLogger(DriversPool.class);
     private static final DriversPool instance = new DriversPool();
-    private final List<WebDriver> driversPool = new ArrayList<WebDriver>();
+    private static final long MAX_REAP_INTERVAL_MILLIS = 60000;
+    private final ConcurrentMap<String, Session> sessions = new ConcurrentHashMap<String, Session>();
+    private ScheduledExecutorService reaper;
 
     private DriversPool() {
     }
@@ -44,29 +54,131 @@ public class DriversPool {
     }
 
     public void set(WebDriver driver) {
-        log.debug("Storing WebDriver instance with sessionId " + getSessionId(driver));
-        if (!driversPool.contains(driver)) {
-            driversPool.add(driver);
+        String sessionId = getSessionId(driver).toString();
+        log.debug("Storing WebDriver instance with sessionId " + sessionId);
+        sessions.put(sessionId, new Session(driver));
+    }
+
+    /**
+     * Returns the driver of the given session for a call made with it, which {@link #release} ends. The session is not
+     * reaped while calls are in flight, however long they take.
+     */
+    public WebDriver acquire(String sessionId) throws SessionNotFoundException {
+        Session session = sessions.get(sessionId);
+        if (session == null || !session.begin()) {
+            throw new SessionNotFoundException(format("Driver with session id %s does not exist", sessionId));
         }
+        return session.driver;
     }
 
-    public WebDriver getBySessionId(String sessionId) throws SessionNotFoundException {
-        for (WebDriver driver : driversPool) {
-            if (driver instanceof RemoteWebDriver) {
-                if (((RemoteWebDriver) driver).getSessionId().toString().equals(sessionId)) {
-                    return driver;
-                }
-            }
+    /**
+     * Ends a call made with the driver of the given session, which counts as its last use.
+     */
+    public void release(String sessionId) {
+        Session session = sessions.get(sessionId);
+        if (session != null) {
+            session.end();
         }
-        throw new SessionNotFoundException(format("Driver with session id %s has never been created", sessionId));
     }
 
+    /**
+     * Forgets the driver of the given session, if it was not already reaped.
+     */
     public void removeDriverBySessionId(String sessionId) {
-        log.debug("Removing WebDriver instance with sessionId " + sessionId);
-        driversPool.remove(this.getBySessionId(sessionId));
+        if (sessions.remove(sessionId) != null) {
+            log.debug("Removed WebDriver instance with sessionId " + sessionId);
+        }
     }
 
     public int activeDrivers() {
-        return driversPool.size();
+        return sessions.size();
+    }
+
+    /**
+     * Starts quitting, in the background, the sessions not used for longer than the given time.
+     */
+    public synchronized void startReaper(final long sessionTimeoutMillis) {
+        if (reaper != null) {
+            return;
+        }
+        reaper = Executors.newSingleThreadScheduledExecutor(new ThreadFactory() {
+            @Override
+            public Thread newThread(Runnable runnable) {
+                Thread thread = new Thread(runnable, "session reaper");
+                thread.setDaemon(true);
+                return thread;
+            }
+        });
+        long reapInterval = Math.max(1, Math.min(MAX_REAP_INTERVAL_MILLIS, sessionTimeoutMillis / 4));
+        reaper.scheduleWithFixedDelay(new Runnable() {
+            @Override
+            public void run() {
+                reapIdleSessions(sessionTimeoutMillis);
+            }
+        }, reapInterval, reapInterval, TimeUnit.MILLISECONDS);
+    }
+
+    /**
+     * Removes and quits the sessions not used for longer than the given time.
+     * @return the number of sessions reaped.
+     */
+    public int reapIdleSessions(long sessionTimeoutMillis) {
+        long threshold = System.currentTimeMillis() - sessionTimeoutMillis;
+        int reaped = 0;
+        Iterator<Map.Entry<String, Session>> entries = sessions.entrySet().iterator();
+        while (entries.hasNext()) {
+            Map.Entry<String, Session> entry = entries.next();
+            Session session = entry.getValue();
+            if (session.reapIfUnusedSince(threshold) && sessions.remove(entry.getKey(), session)) {
+                log.info(format("Quitting session %s, unused for %dms", entry.getKey(),
+                        System.currentTimeMillis() - session.lastUsed));
+                try {
+                    session.driver.quit();
+                } catch (WebDriverException e) {
+                    log.warn(format("Could not quit session %s: %s", entry.getKey(), e.getMessage()));
+                }
+                reaped++;
+            }
+        }
+        return reaped;
+    }
+
+    /**
+     * A session is either used or reaped, never both: once reaped, it cannot be used anymore, and it is not reaped
+     * while calls are in flight.
+     */
+    private static class Session {
+        private final WebDriver driver;
+        private volatile long lastUsed = System.currentTimeMillis();
+        private int callsInFlight;
+        private boolean reaped;
+
+        Session(WebDriver driver) {
+            this.driver = driver;
+        }
+
+        synchronized boolean begin() {
+            if (reaped) {
+                return false;
+            }
+            callsInFlight++;
+            lastUsed = System.currentTimeMillis();
+            return true;
+        }
+
+        synchronized void end() {
+            if (callsInFlight > 0) {
+                callsInFlight--;
+            }
+            lastUsed = System.currentTimeMillis();
+        }
+
+        synchronized boolean reapIfUnusedSince(long threshold) {
+            if (reaped || callsInFlight > 0 || lastUsed >= threshold) {
+                return false;
+            }
+            reaped = true;
+            return true;
+        }
     }
 }
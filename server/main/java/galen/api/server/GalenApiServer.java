@@ -18,13 +18,23 @@ package galen.api.server;
 
 import galen.api.server.thrift.GalenApiRemoteService;
 import org.apache.commons.cli.*;
+import org.apache.thrift.TProcessor;
+import org.apache.thrift.protocol.TBinaryProtocol;
 import org.apache.thrift.server.TServer;
+import org.apache.thrift.server.TThreadPoolServer;
 import org.apache.thrift.server.TThreadedSelectorServer;
+import org.apache.thrift.transport.TFramedTransport;
 import org.apache.thrift.transport.TNonblockingServerSocket;
 import org.apache.thrift.transport.TNonblockingServerTransport;
+import org.apache.thrift.transport.TServerSocket;
+import org.apache.thrift.transport.TServerTransport;
+import org.newsclub.net.unix.AFUNIXServerSocket;
+import org.newsclub.net.unix.AFUNIXSocketAddress;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
+import java.io.File;
+
 import static java.lang.Integer.valueOf;
 import static java.util.Arrays.asList;
 
@@ -32,9 +42,32 @@ public class GalenApiServer {
 
     private static Logger log = LoggerFactory.getLogger(GalenApiServer.class);
 
+    public static final String VERSION = "1.0-SNAPSHOT";
+
+    /**
+     * Layout checks and WebDriver commands mostly wait on the Selenium Grid, so that many more calls than cores can be
+     * served concurrently.
+     */
+    public static final int DEFAULT_WORKER_THREADS = 32;
+
+    /**
+     * WebDriver sessions not used for this long are quit, as their client most likely died without quitting them.
+     */
+    public static final int DEFAULT_SESSION_TIMEOUT_SECONDS = 1800;
+
+    /**
+     * Time given to the calls in progress to complete once a server serving connections on their own thread is
+     * stopped, as threads of idle connections only return when their client disconnects.
+     */
+    private static final int STOP_TIMEOUT_SECONDS = 5;
+
     public static GalenCommandExecutor handler;
     public static GalenApiRemoteService.Processor processor;
 
+    private static TServer server;
+
+    private static IdleMonitor idleMonitor;
+
     public static void main(String [] args) {
         CommandLineParser parser = new GnuParser();
         Options options = defineCommandOptions();
@@ -47,14 +80,34 @@ public class GalenApiServer {
                 System.exit(0);
             } else if (commandLine.hasOption("help")) {
                 formatter.printHelp("galen-api-server", options);
-            } else if (commandLine.hasOption("run")) {
-                String port = commandLine.getOptionValue("run");
-                int serverPort = valueOf(port);
-                handler = new GalenCommandExecutor();
+            } else if (commandLine.hasOption("run") || commandLine.hasOption("unix")) {
+                int workerThreads = valueOf(commandLine.getOptionValue("workers",
+                        String.valueOf(DEFAULT_WORKER_THREADS)));
+                File cacheDirectory = new File(commandLine.getOptionValue("cache",
+                        LayoutReportCache.DEFAULT_DIRECTORY.getPath()));
+                handler = new GalenCommandExecutor(new LayoutReportCache(cacheDirectory,
+                        LayoutReportCache.DEFAULT_MAX_SIZE_BYTES), new SpecStore(SpecStore.DEFAULT_DIRECTORY));
                 processor = new GalenApiRemoteService.Processor(handler);
-                log.info("Starting server on port " + serverPort);
-                runService(processor, serverPort);
-
+                int idleTimeout = valueOf(commandLine.getOptionValue("idle", "0"));
+                if (idleTimeout > 0) {
+                    idleMonitor = new IdleMonitor(idleTimeout * 1000L);
+                }
+                int sessionTimeout = valueOf(commandLine.getOptionValue("session-timeout",
+                        String.valueOf(DEFAULT_SESSION_TIMEOUT_SECONDS)));
+                if (sessionTimeout > 0) {
+                    DriversPool.get().startReaper(sessionTimeout * 1000L);
+                }
+                if (commandLine.hasOption("unix")) {
+                    File socketFile = new File(commandLine.getOptionValue("unix"));
+                    log.info("Starting server on socket " + socketFile + " serving " + workerThreads
+                            + " calls at once");
+                    runUnixService(processor, socketFile, workerThreads);
+                } else {
+                    int serverPort = valueOf(commandLine.getOptionValue("run"));
+                    log.info("Starting server on port " + serverPort + " with " + workerThreads + " worker threads");
+                    runService(processor, serverPort, workerThreads);
+                }
+                System.exit(0);
             }
         } catch (ParseException e) {
             System.out.print("Invalid usage: ");
@@ -70,20 +123,107 @@ public class GalenApiServer {
                 .withDescription("Runs the server on specified port")
                 .withLongOpt("r")
                 .create("run");
+        Option workersOption = OptionBuilder.hasArg()
+                .withArgName("threads")
+                .withDescription("Number of calls served concurrently")
+                .withLongOpt("w")
+                .create("workers");
+        Option cacheOption = OptionBuilder.hasArg()
+                .withArgName("directory")
+                .withDescription("Directory where cached layout reports are stored")
+                .withLongOpt("c")
+                .create("cache");
+        Option unixOption = OptionBuilder.hasArg()
+                .withArgName("path")
+                .withDescription("Runs the server on a Unix domain socket at the specified path instead of a port")
+                .withLongOpt("u")
+                .create("unix");
+        Option sessionTimeoutOption = OptionBuilder.hasArg()
+                .withArgName("seconds")
+                .withDescription("Quits WebDriver sessions unused for the given time, 0 to keep them")
+                .withLongOpt("s")
+                .create("session-timeout");
+        Option idleOption = OptionBuilder.hasArg()
+                .withArgName("seconds")
+                .withDescription("Stops the server once idle, without leases, drivers nor tests, for the given time")
+                .withLongOpt("i")
+                .create("idle");
 
         Options options = new Options();
-        options.addOption(helpOption).addOption(runOption);
+        options.addOption(helpOption).addOption(runOption).addOption(workersOption).addOption(cacheOption)
+                .addOption(unixOption).addOption(idleOption).addOption(sessionTimeoutOption);
         return options;
     }
 
-    public static void runService(GalenApiRemoteService.Processor processor, int serverPort) {
+    public static void runService(GalenApiRemoteService.Processor processor, int serverPort, int workerThreads) {
         try {
             TNonblockingServerTransport serverTransport = new TNonblockingServerSocket(serverPort);
-            TThreadedSelectorServer.Args args = new TThreadedSelectorServer.Args(serverTransport);
-            TServer server = new TThreadedSelectorServer(args.processor(processor));
-            server.serve();
+            TThreadedSelectorServer.Args args = new TThreadedSelectorServer.Args(serverTransport)
+                    .workerThreads(workerThreads);
+            serve(new TThreadedSelectorServer(args.processor(processor)));
+        } catch (Exception e) {
+            e.printStackTrace();
+        }
+    }
+
+    /**
+     * Serves calls coming through a Unix domain socket, which avoids the TCP stack and port collisions when clients
+     * run on the same host.
+     */
+    public static void runUnixService(GalenApiRemoteService.Processor processor, File socketFile, int workerThreads) {
+        try {
+            if (socketFile.exists() && !socketFile.delete()) {
+                throw new IllegalStateException("Could not remove stale socket " + socketFile);
+            }
+            AFUNIXServerSocket serverSocket = AFUNIXServerSocket.newInstance();
+            serverSocket.bind(new AFUNIXSocketAddress(socketFile));
+            try {
+                serve(threadPerConnectionServer(new TServerSocket(serverSocket), processor, workerThreads));
+            } finally {
+                socketFile.delete();
+            }
         } catch (Exception e) {
             e.printStackTrace();
         }
     }
+
+    /**
+     * Builds a server serving each connection by its own thread, blocked on reading the next call, while at most
+     * workerThreads calls are served at the same time whatever the number of connections open.
+     */
+    static TServer threadPerConnectionServer(TServerTransport serverTransport, TProcessor processor,
+                                             int workerThreads) {
+        TThreadPoolServer.Args args = new TThreadPoolServer.Args(serverTransport)
+                .processor(new BoundedProcessor(processor, workerThreads))
+                .transportFactory(new TFramedTransport.Factory())
+                .protocolFactory(new TBinaryProtocol.Factory())
+                .minWorkerThreads(workerThreads)
+                .maxWorkerThreads(Integer.MAX_VALUE)
+                .stopTimeoutVal(STOP_TIMEOUT_SECONDS);
+        return new TThreadPoolServer(args);
+    }
+
+    private static void serve(TServer server) {
+        GalenApiServer.server = server;
+        Runtime.getRuntime().addShutdownHook(new Thread("shutdown hook") {
+            @Override
+            public void run() {
+                stopService();
+            }
+        });
+        if (idleMonitor != null) {
+            idleMonitor.start();
+        }
+        server.serve();
+    }
+
+    /**
+     * Stops accepting calls and lets the ones in progress complete, so that {@link #runService} returns.
+     */
+    public static void stopService() {
+        if (server != null && server.isServing()) {
+            log.info("Stopping server");
+            server.stop();
+        }
+    }
 }
@@ -20,35 +20,63 @@ import galen.api.server.thrift.*;
 import galen.api.server.thrift.Response;
 import galen.api.server.utils.StringUtils;
 import net.mindengine.galen.api.Galen;
-import net.mindengine.galen.reports.GalenTestInfo;
-import net.mindengine.galen.reports.HtmlReportBuilder;
-import net.mindengine.galen.reports.TestReport;
+import net.mindengine.galen.browser.Browser;
+import net.mindengine.galen.browser.SeleniumBrowser;
 import net.mindengine.galen.reports.model.LayoutReport;
+import net.mindengine.galen.specs.reader.page.SectionFilter;
 import org.apache.thrift.TException;
+import org.openqa.selenium.Dimension;
+import org.openqa.selenium.OutputType;
+import org.openqa.selenium.TakesScreenshot;
 import org.openqa.selenium.WebDriver;
 import org.openqa.selenium.WebDriverException;
 import org.openqa.selenium.remote.*;
 import org.slf4j.Logger;
 import org.slf4j.LoggerFactory;
 
+import java.io.File;
 import java.io.FileNotFoundException;
 import java.io.IOException;
 import java.net.MalformedURLException;
 import java.net.URL;
+import java.nio.ByteBuffer;
 import java.util.*;
 
 import static com.google.common.collect.Maps.newHashMap;
 import static galen.api.server.GsonUtils.getGson;
-import static galen.api.server.utils.TestReportUtils.buildTestReportFromReportTree;
+import static galen.api.server.GsonUtils.toJson;
 import static java.lang.String.format;
+import static java.util.Arrays.asList;
 import static org.openqa.selenium.remote.ErrorCodes.SESSION_NOT_CREATED;
 import static org.openqa.selenium.remote.ErrorCodes.SUCCESS;
+import static org.openqa.selenium.remote.ErrorCodes.UNHANDLED_ERROR;
 
 public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
     private Logger log = LoggerFactory.getLogger(GalenApiServer.class);
 
     private String remoteServerAddress;
 
+    private final LayoutReportCache layoutReportCache;
+
+    private final SpecStore specStore;
+
+    private final ScreenshotStore screenshotStore = ScreenshotStore.inTemporaryDirectory();
+
+    private final LayoutSettler layoutSettler = new LayoutSettler(LayoutSettler.DEFAULT_POLL_INTERVAL_MILLIS,
+            LayoutSettler.DEFAULT_TIMEOUT_MILLIS);
+
+    private final long startedAt = System.currentTimeMillis();
+
+    public GalenCommandExecutor() {
+        this(new LayoutReportCache(LayoutReportCache.DEFAULT_DIRECTORY, LayoutReportCache.DEFAULT_MAX_SIZE_BYTES),
+                new SpecStore(SpecStore.DEFAULT_DIRECTORY));
+    }
+
+    public GalenCommandExecutor(LayoutReportCache layoutReportCache, SpecStore specStore) {
+        this.layoutReportCache = layoutReportCache;
+        this.specStore = specStore;
+    }
+
     @Override
     public void initialize(String remoteServerAddress) throws TException {
         this.remoteServerAddress = remoteServerAddress;
@@ -59,11 +87,13 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
      * @param sessionId WebDriver SessionId.
      * @param commandName Command name.
      * @param params Command params.
+     * @param responseFormat Encoding of the response value, the graph of {@link ResponseValue} if not given.
      * @return an instance of {@link org.openqa.selenium.remote.Response}
      * @throws TException
      */
     @Override
-    public Response execute(String sessionId, String commandName, String params) throws TException {
+    public Response execute(String sessionId, String commandName, String params, ResponseFormat responseFormat)
+            throws TException {
         Map<String, Object> paramsAsMap = fromJsonToStringObjectMap(params);
         if (commandName.equals(DriverCommand.NEW_SESSION)) {
             try {
@@ -71,14 +101,14 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
                 HashMap<String, Object> hashMap = extractDesiredCapabilities(paramsAsMap);
                 WebDriver driver = new RemoteWebDriver(new URL(remoteServerAddress), new DesiredCapabilities(hashMap));
                 DriversPool.get().set(driver);
-                return createSessionInitSuccessResponse(driver);
+                return createSessionInitSuccessResponse(driver, responseFormat);
             } catch (MalformedURLException e) {
                 log.error("Provided URL is malformed " + remoteServerAddress);
-                return createSessionInitFailureResponse("Provided URL is malformed " + remoteServerAddress);
+                return createFailureResponse(SESSION_NOT_CREATED, "Provided URL is malformed " + remoteServerAddress);
             } catch (UnreachableBrowserException e) {
                 log.error("Could not reach browser at URL " + remoteServerAddress + " check remote server is running.");
-                return createSessionInitFailureResponse("Could not reach browser at URL " + remoteServerAddress +
-                        " check remote server is running.");
+                return createFailureResponse(SESSION_NOT_CREATED,
+                        "Could not reach browser at URL " + remoteServerAddress + " check remote server is running.");
             } catch (WebDriverException e) {
                 throw new RemoteWebDriverException(e.getMessage());
             }
@@ -86,20 +116,26 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
         Command driverCommand = new Command(new SessionId(sessionId), handleCommandNameExceptions(commandName), paramsAsMap);
         try {
             log.info(format("Executing command %s for sessionId %s", commandName, sessionId));
-            WebDriver driver = DriversPool.get().getBySessionId(sessionId);
-            org.openqa.selenium.remote.Response response = null;
-            if (driver instanceof RemoteWebDriver) {
-                response = ((RemoteWebDriver) driver).getCommandExecutor().execute(driverCommand);
-            }
-            if (response == null) {
-                return null;
-            } else {
-                if (commandName.equals(DriverCommand.QUIT)) {
-                    DriversPool.get().removeDriverBySessionId(sessionId);
+            WebDriver driver = DriversPool.get().acquire(sessionId);
+            try {
+                org.openqa.selenium.remote.Response response = null;
+                if (driver instanceof RemoteWebDriver) {
+                    response = ((RemoteWebDriver) driver).getCommandExecutor().execute(driverCommand);
                 }
-                ThriftValueWrapper valueWrapper = new ThriftValueWrapper(response.getValue());
-                return new Response(valueWrapper.getValue(), valueWrapper.getContainedValues(), response.getSessionId(),
-                        response.getStatus(), response.getState());
+                if (response == null) {
+                    return null;
+                } else {
+                    if (commandName.equals(DriverCommand.QUIT)) {
+                        DriversPool.get().removeDriverBySessionId(sessionId);
+                    }
+                    Response thriftResponse = new Response();
+                    thriftResponse.setSession_id(response.getSessionId());
+                    thriftResponse.setStatus(response.getStatus());
+                    thriftResponse.setState(response.getState());
+                    return withValue(thriftResponse, response.getValue(), responseFormat);
+                }
+            } finally {
+                DriversPool.get().release(sessionId);
             }
         } catch (IOException ioe) {
             log.error(format("IOException while executing command %s: %s", commandName, ioe.toString()));
@@ -110,6 +146,82 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
         return null;
     }
 
+    /**
+     * Executes a sequence of commands in a single call. Commands are executed in order until one of them fails.
+     * @param sessionId WebDriver SessionId.
+     * @param commands Commands to be executed along with their params.
+     * @param responseFormat Encoding of the response values.
+     * @return one response per command executed, the last one describing the failure if any.
+     * @throws TException
+     */
+    @Override
+    public List<Response> execute_batch(String sessionId, List<BatchCommand> commands, ResponseFormat responseFormat)
+            throws TException {
+        List<Response> responses = new ArrayList<Response>();
+        for (BatchCommand command : commands) {
+            Response response;
+            try {
+                response = execute(sessionId, command.getCommand(), command.getParams(), responseFormat);
+            } catch (RemoteWebDriverException e) {
+                response = createFailureResponse(UNHANDLED_ERROR, e.getMessage());
+            }
+            if (response == null) {
+                response = createFailureResponse(UNHANDLED_ERROR, format("Command %s returned no response",
+                        command.getCommand()));
+            }
+            responses.add(response);
+            if (response.getStatus() != SUCCESS) {
+                log.info(format("Batch for sessionId %s stopped at failing command %s", sessionId,
+                        command.getCommand()));
+                break;
+            }
+        }
+        return responses;
+    }
+
+    /**
+     * Takes a screenshot of the page open in the given session.
+     * @return the PNG image, sent as binary rather than as the base64 text WebDriver encodes it to.
+     */
+    @Override
+    public ByteBuffer take_screenshot(String sessionId) throws TException {
+        return ByteBuffer.wrap(screenshotOf(sessionId));
+    }
+
+    /**
+     * Takes a screenshot of the page open in the given session and keeps it on the service, so that it can be attached
+     * to a report node without travelling to the client and back. The oldest saved screenshots are deleted once they
+     * grow beyond {@link ScreenshotStore#DEFAULT_MAX_SIZE_BYTES}.
+     * @return the path of the PNG image, to be used as a report node attachment.
+     */
+    @Override
+    public String save_screenshot(String sessionId) throws TException {
+        byte[] screenshot = screenshotOf(sessionId);
+        try {
+            return screenshotStore.save(screenshot).getAbsolutePath();
+        } catch (IOException e) {
+            log.error("Could not save screenshot", e);
+            throw new TException(e.getMessage(), e);
+        }
+    }
+
+    private byte[] screenshotOf(String sessionId) throws RemoteWebDriverException {
+        try {
+            WebDriver driver = DriversPool.get().acquire(sessionId);
+            try {
+                if (!(driver instanceof TakesScreenshot)) {
+                    driver = new Augmenter().augment(driver);
+                }
+                return ((TakesScreenshot) driver).getScreenshotAs(OutputType.BYTES);
+            } finally {
+                DriversPool.get().release(sessionId);
+            }
+        } catch (WebDriverException e) {
+            log.error(format("WebDriverException while taking screenshot: %s", e.toString()));
+            throw new RemoteWebDriverException(e.getMessage());
+        }
+    }
+
     /**
      * Register test by name,
      * @param testName A unique name for the test.
@@ -125,19 +237,144 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
      * @param specs .specs file containing the Galen specification of the page under test.
      * @param includedTags Tags to be included in the check.
      * @param excludedTags Tags to be excluded from the check.
+     * @param useCache Whether the report of an identical check run on the same page can be served instead.
      * @return A unique id of the layoutReport generated after the check.
      * @throws SpecNotFoundException
      */
     @Override
-    public LayoutCheckReport check_layout(String driverSessionId, String specs, List<String> includedTags, List<String> excludedTags)
-            throws SpecNotFoundException {
-        LayoutReport layoutReport = new LayoutReport();
+    public LayoutCheckReport check_layout(String driverSessionId, String specs, List<String> includedTags,
+                                          List<String> excludedTags, boolean useCache) throws SpecNotFoundException {
         log.info(format("Executing check_layout for spec " + specs + " with driver " + driverSessionId));
-        WebDriver driver = DriversPool.get().getBySessionId(driverSessionId);
+        WebDriver driver = DriversPool.get().acquire(driverSessionId);
+        try {
+            return checkLayout(new SeleniumBrowser(driver), pageStateOf(driver, useCache), specs, includedTags,
+                    excludedTags);
+        } finally {
+            DriversPool.get().release(driverSessionId);
+        }
+    }
+
+    /**
+     * Validates current page layout against several specs and tag sets at once. The page elements located and the
+     * screenshot taken are shared by all the checks, and a check repeated within the list is only run once.
+     * @param driverSessionId WebDriver SessionId to be used to scan the page under test.
+     * @param checks specs and tags of the checks to be run.
+     * @param useCache Whether the reports of identical checks run on the same page can be served instead.
+     * @return the reports of the checks, in the same order as the checks.
+     * @throws SpecNotFoundException
+     */
+    @Override
+    public List<LayoutCheckReport> check_layouts(String driverSessionId, List<LayoutCheck> checks, boolean useCache)
+            throws SpecNotFoundException {
+        log.info(format("Executing check_layouts for %d checks with driver %s", checks.size(), driverSessionId));
+        WebDriver driver = DriversPool.get().acquire(driverSessionId);
+        try {
+            Browser browser = new PageCachingBrowser(driver);
+            String pageState = pageStateOf(driver, useCache);
+            Map<LayoutCheck, LayoutCheckReport> reportsByCheck = new HashMap<LayoutCheck, LayoutCheckReport>();
+            List<LayoutCheckReport> reports = new ArrayList<LayoutCheckReport>();
+            for (LayoutCheck check : checks) {
+                LayoutCheckReport report = reportsByCheck.get(check);
+                if (report == null) {
+                    report = checkLayout(browser, pageState, check.getSpecs(), check.getIncluded_tags(),
+                            check.getExcluded_tags());
+                    reportsByCheck.put(check, report);
+                }
+                reports.add(report);
+            }
+            return reports;
+        } finally {
+            DriversPool.get().release(driverSessionId);
+        }
+    }
+
+    /**
+     * Validates the page open in a session against a spec in several viewports, resizing the window only when the
+     * next viewport has a different size and waiting for the layout to settle after each resize. Viewports of the same
+     * size share the page elements located and the screenshot taken.
+     * @param driverSessionId WebDriver SessionId to be used to scan the page under test.
+     * @param specs .specs file containing the Galen specification of the page under test.
+     * @param viewports sizes of the window and tags checked in each of them.
+     * @param useCache Whether the reports of identical checks run on the same page can be served instead.
+     * @return the reports of the viewports, in the same order as the viewports.
+     * @throws SpecNotFoundException
+     * @throws RemoteWebDriverException when the window cannot be resized.
+     */
+    @Override
+    public List<ViewportCheckReport> check_layout_viewports(String driverSessionId, String specs,
+                                                            List<Viewport> viewports, boolean useCache)
+            throws SpecNotFoundException, RemoteWebDriverException {
+        log.info(format("Executing check_layout_viewports for spec %s in %d viewports with driver %s", specs,
+                viewports.size(), driverSessionId));
+        WebDriver driver = DriversPool.get().acquire(driverSessionId);
+        List<ViewportCheckReport> reports = new ArrayList<ViewportCheckReport>();
+        try {
+            Dimension currentSize = driver.manage().window().getSize();
+            Browser browser = new PageCachingBrowser(driver);
+            String pageState = pageStateOf(driver, useCache);
+            for (Viewport viewport : viewports) {
+                long startedAt = System.currentTimeMillis();
+                Dimension size = new Dimension(viewport.getWidth(), viewport.getHeight());
+                boolean resized = !size.equals(currentSize);
+                if (resized) {
+                    driver.manage().window().setSize(size);
+                    layoutSettler.waitForLayout(driver);
+                    currentSize = size;
+                    browser = new PageCachingBrowser(driver);
+                    pageState = pageStateOf(driver, useCache);
+                }
+                LayoutCheckReport report = checkLayout(browser, pageState, specs, viewport.getIncluded_tags(),
+                        viewport.getExcluded_tags());
+                reports.add(new ViewportCheckReport(viewport.getName(), report, resized,
+                        System.currentTimeMillis() - startedAt));
+            }
+        } catch (WebDriverException e) {
+            log.error(format("WebDriverException while checking viewports: %s", e.toString()));
+            throw new RemoteWebDriverException(e.getMessage());
+        } finally {
+            DriversPool.get().release(driverSessionId);
+        }
+        return reports;
+    }
+
+    /**
+     * Stores a spec uploaded along with the files it imports, so that it can be checked by a service which does not
+     * share a file system with the client.
+     * @param specPath path of the spec, relative to the root of the uploaded files.
+     * @param files the spec and the files it imports.
+     * @return the path of the spec to be passed to check_layout.
+     * @throws SpecNotFoundException when the spec is not part of the files or a file lies outside of their root.
+     */
+    @Override
+    public String upload_spec(String specPath, List<SpecFile> files) throws SpecNotFoundException, TException {
+        log.info(format("Storing spec %s uploaded with %d files", specPath, files.size()));
+        try {
+            return specStore.store(specPath, files);
+        } catch (IllegalArgumentException e) {
+            throw new SpecNotFoundException(e.getMessage());
+        } catch (IOException e) {
+            throw new TException(e);
+        }
+    }
+
+    /**
+     * Runs a layout check, unless the page state is given and the cache holds the report of an identical check.
+     */
+    private LayoutCheckReport checkLayout(Browser browser, String pageState, String specs, List<String> includedTags,
+                                          List<String> excludedTags) throws SpecNotFoundException {
+        String cacheKey = cacheKeyOf(pageState, specs, includedTags, excludedTags);
+        LayoutReport layoutReport = cacheKey != null ? layoutReportCache.get(cacheKey) : null;
         String reportId = null;
         try {
-            layoutReport = Galen.checkLayout(driver, specs, includedTags, excludedTags, new Properties(),
-                    null);
+            if (layoutReport == null) {
+                layoutReport = Galen.checkLayout(browser, asList(specs), new SectionFilter(includedTags, excludedTags),
+                        new Properties(), null);
+                if (cacheKey != null) {
+                    layoutReportCache.put(cacheKey, layoutReport);
+                }
+            } else {
+                log.info("Serving cached layout report for spec " + specs);
+            }
             reportId = StringUtils.generateUniqueString();
             GalenReportsContainer.get().storeLayoutReport(reportId, layoutReport);
         } catch (FileNotFoundException e) {
@@ -145,10 +382,35 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
             throw new SpecNotFoundException(e.getMessage());
         } catch (IOException e) {
             e.printStackTrace();
+            layoutReport = new LayoutReport();
         }
         return new LayoutCheckReport(reportId, layoutReport.errors(), layoutReport.warnings());
     }
 
+    private String pageStateOf(WebDriver driver, boolean useCache) {
+        if (!useCache) {
+            return null;
+        }
+        try {
+            return layoutReportCache.pageStateOf(driver);
+        } catch (WebDriverException e) {
+            log.warn("Could not fingerprint the page, layout reports will not be cached: " + e.getMessage());
+            return null;
+        }
+    }
+
+    private String cacheKeyOf(String pageState, String specs, List<String> includedTags, List<String> excludedTags) {
+        if (pageState == null) {
+            return null;
+        }
+        try {
+            return layoutReportCache.keyOf(pageState, specs, includedTags, excludedTags);
+        } catch (IOException e) {
+            log.warn(format("Could not hash spec %s, its layout report will not be cached: %s", specs, e));
+            return null;
+        }
+    }
+
     /**
      * Appends the generated test report to the main report.
      * @param testName Name of the test to be run. This is the text that is displayed in the test report overview.
@@ -160,10 +422,19 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
     public void append(String testName, ReportTree reportTree) throws TException {
         GalenReportsContainer galenReportsContainer = GalenReportsContainer.get();
         galenReportsContainer.updateEndTime(testName);
+        galenReportsContainer.setReportTree(testName, reportTree);
+    }
 
-        TestReport testReport = new TestReport();
-        buildTestReportFromReportTree(testReport, reportTree, reportTree.getRoot_id());
-        galenReportsContainer.getTestWithName(testName).setReport(testReport);
+    /**
+     * Appends a chunk of nodes to the report of a test, so that large reports do not have to be sent at once. The last
+     * chunk is sent through append().
+     * @param testName Name of the test the report belongs to.
+     * @param chunk root of the report along with the next nodes.
+     * @throws TException
+     */
+    @Override
+    public void append_nodes(String testName, ReportTree chunk) throws TException {
+        GalenReportsContainer.get().appendReportChunk(testName, chunk);
     }
 
     /**
@@ -173,14 +444,75 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
      */
     @Override
     public void generate_report(String reportFolderPath) throws TException {
-        List<GalenTestInfo> tests = GalenReportsContainer.get().getAllTests();
+        GalenReportsContainer galenReportsContainer = GalenReportsContainer.get();
+        long version = galenReportsContainer.version();
+        renderReport(galenReportsContainer.getAllTests(), galenReportsContainer.getLayoutReports(), reportFolderPath);
+        galenReportsContainer.markRendered(version);
+    }
+
+    /**
+     * Writes the tests registered so far to a report shard, to be merged with the shards of other workers by
+     * merge_report_shards().
+     * @param shardFolderPath folder of the shard. Tests already in it are kept, unless they have the same name.
+     * @throws TException
+     */
+    @Override
+    public void write_report_shard(String shardFolderPath) throws TException {
+        GalenReportsContainer galenReportsContainer = GalenReportsContainer.get();
+        long version = galenReportsContainer.version();
+        try {
+            ReportShards.write(galenReportsContainer.getAllTests(), galenReportsContainer.getLayoutReports(),
+                    new File(shardFolderPath));
+            galenReportsContainer.markRendered(version);
+        } catch (IOException e) {
+            log.error("Could not write report shard " + shardFolderPath, e);
+            throw new TException(e);
+        }
+    }
+
+    /**
+     * Generates the Galen report of the tests of several report shards.
+     * @param shardFolderPaths folders of the shards.
+     * @param reportFolderPath target folder where to store the generated report.
+     * @throws TException
+     */
+    @Override
+    public void merge_report_shards(List<String> shardFolderPaths, String reportFolderPath) throws TException {
+        List<File> shardFolders = new ArrayList<File>();
+        for (String shardFolderPath : shardFolderPaths) {
+            shardFolders.add(new File(shardFolderPath));
+        }
+        Map<String, LayoutReport> layoutReports = new HashMap<String, LayoutReport>();
+        List<TestRecord> tests;
+        try {
+            tests = ReportShards.read(shardFolders, layoutReports);
+        } catch (IOException e) {
+            log.error("Could not read report shards " + shardFolderPaths, e);
+            throw new TException(e);
+        }
+        renderReport(tests, layoutReports, reportFolderPath);
+    }
+
+    private void renderReport(List<TestRecord> tests, Map<String, LayoutReport> layoutReports, String reportFolderPath)
+            throws TException {
         try {
-            new HtmlReportBuilder().build(tests, reportFolderPath);
+            new ReportRenderer().render(tests, layoutReports, new File(reportFolderPath));
         } catch (Exception e) {
-            e.printStackTrace();
+            log.error("Could not generate the report in " + reportFolderPath, e);
+            throw new TException(e);
         }
     }
 
+    /**
+     * Cheap health check used by clients to wait until the service is ready to accept calls.
+     * @return version of the service, the time elapsed since it was started and layout report cache statistics.
+     */
+    @Override
+    public ServerInfo server_info() throws TException {
+        return new ServerInfo(GalenApiServer.VERSION, System.currentTimeMillis() - startedAt, layoutReportCache.hits(),
+                layoutReportCache.misses());
+    }
+
     /**
      * Returns the number of active WebDriver sessions.
      */
@@ -189,13 +521,48 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
         return DriversPool.get().activeDrivers();
     }
 
+    /**
+     * Acquires a lease keeping the service alive until it is released or not renewed within the given time.
+     * @return the id of the lease.
+     */
+    @Override
+    public String acquire_lease(long ttlMillis) throws TException {
+        try {
+            return Leases.get().acquire(ttlMillis);
+        } catch (IllegalArgumentException e) {
+            throw new TException(e.getMessage(), e);
+        }
+    }
+
+    /**
+     * Renews the given lease.
+     * @return false if the lease already expired.
+     */
+    @Override
+    public boolean renew_lease(String leaseId) throws TException {
+        return Leases.get().renew(leaseId);
+    }
+
+    /**
+     * Releases the given lease, so that the service can stop once it is idle.
+     */
+    @Override
+    public void release_lease(String leaseId) throws TException {
+        Leases.get().release(leaseId);
+    }
+
     /**
      * Shuts down the service.
      */
     @Override
     public void shut_service() throws TException {
         log.info("Shutting down Galen API service.");
-        System.exit(1);
+        new Thread("shut service") {
+            @Override
+            public void run() {
+                GalenApiServer.stopService();
+            }
+        }.start();
     }
 
     /**
@@ -222,25 +589,37 @@ public class GalenCommandExecutor implements GalenApiRemoteService.Iface {
     /**
      * Packages a successful session setup response which can be sent across the Thrift interface.
      */
-    private Response createSessionInitSuccessResponse(WebDriver driver) {
+    private Response createSessionInitSuccessResponse(WebDriver driver, ResponseFormat responseFormat) {
         Response response = new Response();
         response.setStatus(SUCCESS);
         RemoteWebDriver remoteDriver = (RemoteWebDriver) driver;
-        ThriftValueWrapper wrappedValue = new ThriftValueWrapper(remoteDriver.getCapabilities().asMap());
-        response.setResponse_value(wrappedValue.getValue());
-        response.setContained_values(wrappedValue.getContainedValues());
         response.setSession_id(remoteDriver.getSessionId().toString());
         response.setState(new ErrorCodes().toState(SUCCESS));
+        return withValue(response, remoteDriver.getCapabilities().asMap(), responseFormat);
+    }
+
+    /**
+     * Sets the value of a response in the requested format: either a single JSON document, or the graph of
+     * {@link ResponseValue} understood by clients which do not ask for a format.
+     */
+    private static Response withValue(Response response, Object value, ResponseFormat responseFormat) {
+        if (responseFormat == ResponseFormat.JSON) {
+            response.setJson_value(toJson(value));
+        } else {
+            ThriftValueWrapper valueWrapper = new ThriftValueWrapper(value);
+            response.setResponse_value(valueWrapper.getValue());
+            response.setContained_values(valueWrapper.getContainedValues());
+        }
         return response;
     }
 
     /**
-     * Packages a failing session setup response which can be sent across the Thrift interface.
+     * Packages a failure response with the given status which can be sent across the Thrift interface.
      */
-    private Response createSessionInitFailureResponse(String reason) {
+    private Response createFailureResponse(int status, String reason) {
         Response response = new Response();
-        response.setStatus(SESSION_NOT_CREATED);
-        response.setState(new ErrorCodes().toState(SESSION_NOT_CREATED));
+        response.setStatus(status);
+        response.setState(new ErrorCodes().toState(status));
         ResponseValue value = new ResponseValue();
         Value valueType = new Value();
         valueType.setString_value(reason);
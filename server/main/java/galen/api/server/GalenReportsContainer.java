@@ -16,22 +16,26 @@
 
 package galen.api.server;
 
-import com.google.common.collect.Lists;
-import net.mindengine.galen.reports.GalenTestInfo;
+import galen.api.server.thrift.ReportNode;
+import galen.api.server.thrift.ReportTree;
+import galen.api.server.thrift.TestRecord;
 import net.mindengine.galen.reports.model.LayoutReport;
 
-import java.util.Date;
-import java.util.HashMap;
-import java.util.List;
-import java.util.Map;
-
-import static net.mindengine.galen.reports.GalenTestInfo.fromString;
+import java.util.*;
+import java.util.concurrent.ConcurrentHashMap;
 
+/**
+ * Holds the tests registered by clients along with their report trees and the layout reports they refer to. Galen
+ * reports are only built from them when the HTML report is generated.
+ */
 public class GalenReportsContainer {
 
     private static final GalenReportsContainer _instance = new GalenReportsContainer();
-    private final Map<String, GalenTestInfo> tests = new HashMap<String, GalenTestInfo>();
-    private final Map<String, LayoutReport> reports = new HashMap<String, LayoutReport>();
+    private final Map<String, TestRecord> tests = new LinkedHashMap<String, TestRecord>();
+    private final Set<String> streamedTests = new HashSet<String>();
+    private final Map<String, LayoutReport> reports = new ConcurrentHashMap<String, LayoutReport>();
+    private long version;
+    private long renderedVersion;
 
     private GalenReportsContainer() {
     }
@@ -40,24 +44,83 @@ public class GalenReportsContainer {
         return _instance;
     }
 
-    public GalenTestInfo registerTest(String testName) {
-        GalenTestInfo galenTestInfo = fromString(testName);
+    public synchronized TestRecord registerTest(String testName) {
+        TestRecord testRecord = new TestRecord().setTest_name(testName).setStarted_at(System.currentTimeMillis());
+        tests.put(testName, testRecord);
+        streamedTests.remove(testName);
+        version++;
+        return testRecord;
+    }
+
+    public synchronized void updateEndTime(String testName) {
+        tests.get(testName).setEnded_at(System.currentTimeMillis());
+    }
+
+    /**
+     * Sets the report tree of a test. When chunks of it were streamed before, the tree holds the last nodes which are
+     * appended to them instead.
+     */
+    public synchronized void setReportTree(String testName, ReportTree reportTree) {
+        if (streamedTests.remove(testName)) {
+            appendNodes(testName, reportTree);
+        } else {
+            tests.get(testName).setReport_tree(reportTree);
+        }
+        version++;
+    }
+
+    /**
+     * Appends a chunk of the report tree of a test, so that the nodes streamed so far are kept even if the client
+     * never sends the last ones.
+     */
+    public synchronized void appendReportChunk(String testName, ReportTree chunk) {
+        if (streamedTests.add(testName)) {
+            tests.get(testName).setReport_tree(new ReportTree(chunk.getRoot_id(), new ArrayList<ReportNode>()));
+        }
+        appendNodes(testName, chunk);
+        version++;
+    }
 
-        tests.put(testName, galenTestInfo);
-        return galenTestInfo;
+    /**
+     * @return a number bumped each time a test is registered or its report tree changes, which lets the idle stop tell
+     * whether tests would be lost.
+     */
+    public synchronized long version() {
+        return version;
     }
 
-    public GalenTestInfo getTestWithName(String name) {
-        return tests.get(name);
+    /**
+     * Records that the tests, as they were at the given version, made it to a report or a report shard.
+     */
+    public synchronized void markRendered(long renderedVersion) {
+        this.renderedVersion = Math.max(this.renderedVersion, renderedVersion);
     }
 
-    public void updateEndTime(String testName) {
-        GalenTestInfo testInfo = tests.get(testName);
-        testInfo.setEndedAt(new Date());
+    /**
+     * @return whether tests were registered or changed since they last made it to a report or a report shard.
+     */
+    public synchronized boolean hasUnrenderedTests() {
+        return version != renderedVersion;
     }
 
-    public List<GalenTestInfo> getAllTests() {
-        return Lists.newArrayList(tests.values());
+    /**
+     * @return a snapshot of the registered tests, which is not affected by nodes appended later.
+     */
+    public synchronized List<TestRecord> getAllTests() {
+        List<TestRecord> snapshot = new ArrayList<TestRecord>();
+        for (TestRecord test : tests.values()) {
+            TestRecord copy = new TestRecord().setTest_name(test.getTest_name()).setStarted_at(test.getStarted_at());
+            if (test.isSetEnded_at()) {
+                copy.setEnded_at(test.getEnded_at());
+            }
+            if (test.getReport_tree() != null) {
+                List<ReportNode> nodes = test.getReport_tree().getNodes();
+                copy.setReport_tree(new ReportTree(test.getReport_tree().getRoot_id(),
+                        nodes != null ? new ArrayList<ReportNode>(nodes) : new ArrayList<ReportNode>()));
+            }
+            snapshot.add(copy);
+        }
+        return snapshot;
     }
 
     public void storeLayoutReport(String reportId, LayoutReport layoutReport) {
@@ -67,4 +130,14 @@ public class GalenReportsContainer {
     public LayoutReport fetchLayoutReport(String reportId) {
         return reports.get(reportId);
     }
+
+    public Map<String, LayoutReport> getLayoutReports() {
+        return reports;
+    }
+
+    private void appendNodes(String testName, ReportTree chunk) {
+        if (chunk.getNodes() != null) {
+            tests.get(testName).getReport_tree().getNodes().addAll(chunk.getNodes());
+        }
+    }
 }
@@ -76,9 +76,18 @@ public class GsonUtils {
         }
     }
 
+    private static final Gson responseGson = new GsonBuilder().serializeNulls().disableHtmlEscaping().create();
+
     public static Gson getGson() {
         GsonBuilder gsonBuilder = new GsonBuilder();
         gsonBuilder.registerTypeAdapter(Object.class, new NaturalDeserializer());
         return gsonBuilder.create();
     }
+
+    /**
+     * Serializes a WebDriver response value, keeping null values of maps.
+     */
+    public static String toJson(Object value) {
+        return responseGson.toJson(value);
+    }
 }
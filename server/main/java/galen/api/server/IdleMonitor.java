@@ -0,0 +1,88 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server;
+
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.ThreadFactory;
+import java.util.concurrent.TimeUnit;
+
+/**
+ * Stops the service once it has been idle, i.e. without live leases, active drivers nor tests left out of a report,
+ * for a given amount of time.
+ */
+public class IdleMonitor implements Runnable {
+    private static Logger log = LoggerFactory.getLogger(IdleMonitor.class);
+
+    private static final long MAX_CHECK_INTERVAL_MILLIS = 1000;
+
+    private final long idleTimeoutMillis;
+    private final Runnable shutdown;
+    private final ScheduledExecutorService scheduler = Executors.newSingleThreadScheduledExecutor(new ThreadFactory() {
+        @Override
+        public Thread newThread(Runnable runnable) {
+            Thread thread = new Thread(runnable, "idle monitor");
+            thread.setDaemon(true);
+            return thread;
+        }
+    });
+    private long idleSince = System.currentTimeMillis();
+
+    public IdleMonitor(long idleTimeoutMillis) {
+        this(idleTimeoutMillis, new Runnable() {
+            @Override
+            public void run() {
+                GalenApiServer.stopService();
+            }
+        });
+    }
+
+    /**
+     * @param shutdown run once the service has been idle for the given time.
+     */
+    IdleMonitor(long idleTimeoutMillis, Runnable shutdown) {
+        this.idleTimeoutMillis = idleTimeoutMillis;
+        this.shutdown = shutdown;
+    }
+
+    public void start() {
+        long checkInterval = Math.max(1, Math.min(MAX_CHECK_INTERVAL_MILLIS, idleTimeoutMillis / 4));
+        log.info("Service stops after being idle for " + idleTimeoutMillis + "ms");
+        scheduler.scheduleWithFixedDelay(this, checkInterval, checkInterval, TimeUnit.MILLISECONDS);
+    }
+
+    public void stop() {
+        scheduler.shutdownNow();
+    }
+
+    @Override
+    public void run() {
+        long now = System.currentTimeMillis();
+        if (Leases.get().liveLeases() > 0 || DriversPool.get().activeDrivers() > 0
+                || GalenReportsContainer.get().hasUnrenderedTests()) {
+            idleSince = now;
+        } else if (now - idleSince >= idleTimeoutMillis) {
+            log.info("Idle for " + (now - idleSince) + "ms, shutting down Galen API service.");
+            stop();
+            shutdown.run();
+        }
+    }
+}
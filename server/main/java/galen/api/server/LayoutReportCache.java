@@ -0,0 +1,263 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+import com.google.gson.Gson;
+import com.google.gson.JsonParseException;
+import net.mindengine.galen.reports.model.LayoutReport;
+import org.openqa.selenium.Dimension;
+import org.openqa.selenium.JavascriptExecutor;
+import org.openqa.selenium.WebDriver;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.File;
+import java.io.IOException;
+import java.nio.charset.Charset;
+import java.security.MessageDigest;
+import java.util.*;
+import java.util.concurrent.atomic.AtomicLong;
+
+import static galen.api.server.utils.SpecUtils.referencedFiles;
+import static galen.api.server.utils.StringUtils.sha256;
+import static galen.api.server.utils.StringUtils.toHex;
+import static java.lang.String.format;
+
+/**
+ * On-disk cache of layout reports, keyed by the content of everything a layout check depends on: the spec file along
+ * with the files it imports, the tags, the viewport size and a fingerprint of the page. A check whose key is found is
+ * served the stored report instead of being run again. Least recently used entries are evicted once the cache grows
+ * beyond its maximum size.
+ */
+public class LayoutReportCache {
+    private static final Logger log = LoggerFactory.getLogger(LayoutReportCache.class);
+
+    public static final File DEFAULT_DIRECTORY =
+            new File(System.getProperty("java.io.tmpdir"), "galen-api-layout-cache");
+    public static final long DEFAULT_MAX_SIZE_BYTES = 512L * 1024 * 1024;
+
+    private static final Charset UTF_8 = Charset.forName("UTF-8");
+    private static final String REPORT_EXTENSION = ".json";
+    private static final String SCREENSHOT_EXTENSION = ".png";
+    private static final String TEMPORARY_EXTENSION = ".tmp";
+
+    /**
+     * Hashes the markup of the page along with the geometry of all its elements. It does not account for the content
+     * of images, so checks comparing images should not be cached.
+     */
+    private static final String FINGERPRINT_SCRIPT =
+            "var hash = 2166136261;" +
+            "function add(text) {" +
+            "  for (var i = 0; i < text.length; i++) {" +
+            "    hash ^= text.charCodeAt(i);" +
+            "    hash = Math.imul ? Math.imul(hash, 16777619) : (hash * 16777619) & 0xffffffff;" +
+            "  }" +
+            "}" +
+            "add(document.documentElement.outerHTML);" +
+            "var nodes = document.getElementsByTagName('*');" +
+            "for (var i = 0; i < nodes.length; i++) {" +
+            "  var r = nodes[i].getBoundingClientRect();" +
+            "  add(r.left + ',' + r.top + ',' + r.width + ',' + r.height + ';');" +
+            "}" +
+            "return (hash >>> 0).toString(16) + ':' + nodes.length + ':' + window.pageXOffset + ',' + " +
+            "window.pageYOffset;";
+
+    private final File directory;
+    private final long maxSizeBytes;
+    private final Gson gson = new Gson();
+    private final AtomicLong hits = new AtomicLong();
+    private final AtomicLong misses = new AtomicLong();
+    /**
+     * Running size of the cache in bytes, -1 until its directory is first listed.
+     */
+    private long sizeBytes = -1;
+
+    public LayoutReportCache(File directory, long maxSizeBytes) {
+        this.directory = directory;
+        this.maxSizeBytes = maxSizeBytes;
+    }
+
+    /**
+     * Describes the state of the page open in the driver through its viewport size and its fingerprint.
+     */
+    public String pageStateOf(WebDriver driver) {
+        Dimension viewport = driver.manage().window().getSize();
+        Object fingerprint = ((JavascriptExecutor) driver).executeScript(FINGERPRINT_SCRIPT);
+        return viewport.getWidth() + "x" + viewport.getHeight() + "|" + fingerprint;
+    }
+
+    /**
+     * Computes the key of a layout check run on a page in the given state.
+     * @return the key, or null when the spec file cannot be found on disk and the check cannot be cached.
+     */
+    public String keyOf(String pageState, String specs, List<String> includedTags, List<String> excludedTags)
+            throws IOException {
+        File specFile = new File(specs);
+        if (!specFile.isFile()) {
+            return null;
+        }
+        MessageDigest digest = sha256();
+        hashSpec(digest, specFile, new HashSet<File>());
+        update(digest, sortedTags(includedTags) + "|" + sortedTags(excludedTags));
+        update(digest, pageState);
+        return toHex(digest.digest());
+    }
+
+    /**
+     * @return the report stored under the given key, or null if there is none. Its screenshot is the cached one, which
+     * the entry, now the most recently used, keeps until it is evicted.
+     */
+    public LayoutReport get(String key) {
+        File reportFile = new File(directory, key + REPORT_EXTENSION);
+        if (reportFile.isFile()) {
+            try {
+                LayoutReport layoutReport = gson.fromJson(Files.toString(reportFile, UTF_8), LayoutReport.class);
+                File screenshot = new File(directory, key + SCREENSHOT_EXTENSION);
+                layoutReport.setScreenshot(screenshot.isFile() ? screenshot.getAbsolutePath() : null);
+                reportFile.setLastModified(System.currentTimeMillis());
+                hits.incrementAndGet();
+                return layoutReport;
+            } catch (IOException e) {
+                log.warn(format("Could not read cached layout report %s: %s", key, e));
+            } catch (JsonParseException e) {
+                log.warn(format("Discarding corrupted cached layout report %s: %s", key, e));
+                reportFile.delete();
+            }
+        }
+        misses.incrementAndGet();
+        return null;
+    }
+
+    /**
+     * Stores a report under the given key, along with a copy of its screenshot. The report itself is left untouched, as
+     * it still belongs to the check which produced it. Files are written under unique temporary names and then renamed,
+     * so that threads, or servers sharing the directory, storing the same key never see a partially written entry.
+     */
+    public void put(String key, LayoutReport layoutReport) {
+        long storedBytes = 0;
+        try {
+            directory.mkdirs();
+            if (layoutReport.getScreenshot() != null && new File(layoutReport.getScreenshot()).isFile()) {
+                File temporaryScreenshot = File.createTempFile(key, TEMPORARY_EXTENSION, directory);
+                Files.copy(new File(layoutReport.getScreenshot()), temporaryScreenshot);
+                storedBytes += temporaryScreenshot.length();
+                rename(temporaryScreenshot, new File(directory, key + SCREENSHOT_EXTENSION));
+            }
+            File temporaryReport = File.createTempFile(key, TEMPORARY_EXTENSION, directory);
+            Files.write(gson.toJson(layoutReport), temporaryReport, UTF_8);
+            storedBytes += temporaryReport.length();
+            rename(temporaryReport, new File(directory, key + REPORT_EXTENSION));
+        } catch (IOException e) {
+            log.warn(format("Could not cache layout report %s: %s", key, e));
+        }
+        evict(storedBytes);
+    }
+
+    public long hits() {
+        return hits.get();
+    }
+
+    public long misses() {
+        return misses.get();
+    }
+
+    /**
+     * Accounts for the given number of bytes stored and, once the cache may have outgrown its maximum size, deletes the
+     * least recently used entries until it fits in nine tenths of it. The directory is only listed when the running
+     * size exceeds the maximum, which also accounts for the entries stored by other servers sharing it, so that stores
+     * do not each cost a scan of the whole cache.
+     */
+    private synchronized void evict(long storedBytes) {
+        if (sizeBytes >= 0) {
+            sizeBytes += storedBytes;
+            if (sizeBytes <= maxSizeBytes) {
+                return;
+            }
+        }
+        File[] files = directory.listFiles();
+        if (files == null) {
+            return;
+        }
+        long size = 0;
+        List<File> reports = new ArrayList<File>();
+        for (File file : files) {
+            size += file.length();
+            if (file.getName().endsWith(REPORT_EXTENSION)) {
+                reports.add(file);
+            }
+        }
+        Collections.sort(reports, new Comparator<File>() {
+            @Override
+            public int compare(File first, File second) {
+                return Long.valueOf(first.lastModified()).compareTo(second.lastModified());
+            }
+        });
+        long targetSize = maxSizeBytes / 10 * 9;
+        for (File report : reports) {
+            if (size <= targetSize) {
+                break;
+            }
+            String key = report.getName().substring(0, report.getName().length() - REPORT_EXTENSION.length());
+            File screenshot = new File(directory, key + SCREENSHOT_EXTENSION);
+            size -= report.length() + screenshot.length();
+            report.delete();
+            screenshot.delete();
+        }
+        sizeBytes = size;
+    }
+
+    /**
+     * Moves a temporary file over the given one at once. Where the file cannot be replaced, the entry already stored
+     * under the same key, which describes the same check, is kept.
+     */
+    private static void rename(File temporaryFile, File file) {
+        if (!temporaryFile.renameTo(file)) {
+            temporaryFile.delete();
+        }
+    }
+
+    /**
+     * Hashes the spec file and, recursively, the files it imports or whose scripts it runs.
+     */
+    private static void hashSpec(MessageDigest digest, File specFile, Set<File> visited) throws IOException {
+        if (!visited.add(specFile.getCanonicalFile()) || !specFile.isFile()) {
+            return;
+        }
+        List<String> lines = Files.readLines(specFile, UTF_8);
+        for (String line : lines) {
+            update(digest, line);
+            for (String referencedFile : referencedFiles(line)) {
+                hashSpec(digest, new File(specFile.getParentFile(), referencedFile), visited);
+            }
+        }
+    }
+
+    private static String sortedTags(List<String> tags) {
+        if (tags == null) {
+            return "";
+        }
+        List<String> sorted = new ArrayList<String>(tags);
+        Collections.sort(sorted);
+        return sorted.toString();
+    }
+
+    private static void update(MessageDigest digest, String text) {
+        digest.update(text.getBytes(UTF_8));
+        digest.update((byte) 0);
+    }
+}
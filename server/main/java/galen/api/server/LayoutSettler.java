@@ -0,0 +1,74 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server;
+
+import org.openqa.selenium.JavascriptExecutor;
+import org.openqa.selenium.WebDriver;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+/**
+ * Waits for the layout of a page to settle after its window was resized. The viewport and document sizes are polled
+ * until two readings in a row agree, so that checks start as soon as the page stops reflowing rather than after a fixed
+ * delay.
+ */
+public class LayoutSettler {
+    private static Logger log = LoggerFactory.getLogger(LayoutSettler.class);
+
+    public static final long DEFAULT_POLL_INTERVAL_MILLIS = 50;
+    public static final long DEFAULT_TIMEOUT_MILLIS = 2000;
+
+    private static final String LAYOUT_SCRIPT = "if (document.readyState !== 'complete') { return null; }"
+            + " var root = document.documentElement;"
+            + " return [window.innerWidth, window.innerHeight, root.scrollWidth, root.scrollHeight].join('x');";
+
+    private final long pollIntervalMillis;
+    private final long timeoutMillis;
+
+    public LayoutSettler(long pollIntervalMillis, long timeoutMillis) {
+        this.pollIntervalMillis = pollIntervalMillis;
+        this.timeoutMillis = timeoutMillis;
+    }
+
+    /**
+     * @return whether the layout settled before the timeout elapsed.
+     */
+    public boolean waitForLayout(WebDriver driver) {
+        long deadline = System.currentTimeMillis() + timeoutMillis;
+        Object previous = layoutOf(driver);
+        while (System.currentTimeMillis() < deadline) {
+            try {
+                Thread.sleep(pollIntervalMillis);
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+                return false;
+            }
+            Object current = layoutOf(driver);
+            if (current != null && current.equals(previous)) {
+                return true;
+            }
+            previous = current;
+        }
+        log.warn("Layout did not settle within " + timeoutMillis + "ms, checking it anyway");
+        return false;
+    }
+
+    private Object layoutOf(WebDriver driver) {
+        return ((JavascriptExecutor) driver).executeScript(LAYOUT_SCRIPT);
+    }
+}
@@ -0,0 +1,107 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server;
+
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.util.Iterator;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+
+import static galen.api.server.utils.StringUtils.generateUniqueString;
+
+/**
+ * Registry of the leases held by clients on the service. A client holds a lease while it uses the service and renews
+ * it before it expires, so that leases of clients gone without releasing them expire on their own.
+ */
+public class Leases {
+    private Logger log = LoggerFactory.getLogger(Leases.class);
+    private static final Leases instance = new Leases();
+    private final Map<String, Lease> leases = new ConcurrentHashMap<String, Lease>();
+
+    private Leases() {
+    }
+
+    public static final Leases get() {
+        return instance;
+    }
+
+    public String acquire(long ttlMillis) {
+        if (ttlMillis <= 0) {
+            throw new IllegalArgumentException("Lease time to live must be positive: " + ttlMillis);
+        }
+        String leaseId = generateUniqueString();
+        leases.put(leaseId, new Lease(ttlMillis));
+        log.debug("Acquired lease " + leaseId + " for " + ttlMillis + "ms");
+        return leaseId;
+    }
+
+    /**
+     * Extends the given lease by its time to live.
+     * @return false if the lease is unknown or already expired, in which case the client has to acquire a new one.
+     */
+    public boolean renew(String leaseId) {
+        Lease lease = leases.get(leaseId);
+        if (lease == null || lease.isExpired(System.currentTimeMillis())) {
+            return false;
+        }
+        lease.renew();
+        return true;
+    }
+
+    public void release(String leaseId) {
+        if (leases.remove(leaseId) != null) {
+            log.debug("Released lease " + leaseId);
+        }
+    }
+
+    /**
+     * Drops the expired leases and returns the number of the ones left.
+     */
+    public int liveLeases() {
+        long now = System.currentTimeMillis();
+        Iterator<Map.Entry<String, Lease>> entries = leases.entrySet().iterator();
+        while (entries.hasNext()) {
+            Map.Entry<String, Lease> entry = entries.next();
+            if (entry.getValue().isExpired(now)) {
+                log.info("Lease " + entry.getKey() + " expired");
+                entries.remove();
+            }
+        }
+        return leases.size();
+    }
+
+    private static class Lease {
+        private final long ttlMillis;
+        private volatile long expiresAt;
+
+        Lease(long ttlMillis) {
+            this.ttlMillis = ttlMillis;
+            renew();
+        }
+
+        void renew() {
+            expiresAt = System.currentTimeMillis() + ttlMillis;
+        }
+
+        boolean isExpired(long now) {
+            return now >= expiresAt;
+        }
+    }
+}
@@ -0,0 +1,42 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+package galen.api.server;
+
+import net.mindengine.galen.browser.SeleniumBrowser;
+import net.mindengine.galen.page.Page;
+import org.openqa.selenium.WebDriver;
+
+/**
+ * Selenium browser handing out the same page to all the layout checks run through it, so that the elements located
+ * and the screenshot taken by a check are reused by the following ones. It must not outlive the state of the page it
+ * was created for.
+ */
+public class PageCachingBrowser extends SeleniumBrowser {
+    private Page page;
+
+    public PageCachingBrowser(WebDriver driver) {
+        super(driver);
+    }
+
+    @Override
+    public Page getPage() {
+        if (page == null) {
+            page = super.getPage();
+        }
+        return page;
+    }
+}
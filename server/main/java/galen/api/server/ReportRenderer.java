@@ -0,0 +1,93 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server;
+
+import galen.api.server.thrift.TestRecord;
+import net.mindengine.galen.reports.GalenTestInfo;
+import net.mindengine.galen.reports.HtmlReportBuilder;
+import net.mindengine.galen.reports.TestReport;
+import net.mindengine.galen.reports.model.LayoutReport;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.File;
+import java.util.*;
+import java.util.concurrent.*;
+
+import static galen.api.server.utils.TestReportUtils.buildTestReportFromReportTree;
+import static java.lang.String.format;
+
+/**
+ * Renders the HTML report of a list of tests. The Galen test infos of the tests, built from their report trees and the
+ * layout reports they refer to, are prepared in parallel, and the whole report is then built at once by Galen, as its
+ * overview and test pages can only be built together. Each call renders every test again.
+ */
+public class ReportRenderer {
+    private static final Logger log = LoggerFactory.getLogger(ReportRenderer.class);
+
+    private final int threads;
+
+    public ReportRenderer() {
+        this(Runtime.getRuntime().availableProcessors());
+    }
+
+    public ReportRenderer(int threads) {
+        this.threads = threads;
+    }
+
+    public void render(List<TestRecord> tests, final Map<String, LayoutReport> layoutReports, File reportFolder)
+            throws Exception {
+        ExecutorService executor = Executors.newFixedThreadPool(threads);
+        List<Future<GalenTestInfo>> preparations = new ArrayList<Future<GalenTestInfo>>();
+        List<GalenTestInfo> testInfos = new ArrayList<GalenTestInfo>();
+        try {
+            for (final TestRecord test : tests) {
+                preparations.add(executor.submit(new Callable<GalenTestInfo>() {
+                    @Override
+                    public GalenTestInfo call() throws Exception {
+                        return galenTestInfoOf(test, layoutReports);
+                    }
+                }));
+            }
+            for (Future<GalenTestInfo> preparation : preparations) {
+                testInfos.add(preparation.get());
+            }
+        } catch (ExecutionException e) {
+            throw e.getCause() instanceof Exception ? (Exception) e.getCause() : e;
+        } finally {
+            executor.shutdownNow();
+        }
+        new HtmlReportBuilder().build(testInfos, reportFolder.getPath());
+        log.info(format("Rendered the report of %d tests in %s", tests.size(), reportFolder));
+    }
+
+    private static GalenTestInfo galenTestInfoOf(TestRecord test, Map<String, LayoutReport> layoutReports) {
+        GalenTestInfo testInfo = GalenTestInfo.fromString(test.getTest_name());
+        TestReport testReport = new TestReport();
+        if (test.getReport_tree() != null) {
+            buildTestReportFromReportTree(testReport, test.getReport_tree(), test.getReport_tree().getRoot_id(),
+                    layoutReports);
+        }
+        testInfo.setReport(testReport);
+        testInfo.setStartedAt(new Date(test.getStarted_at()));
+        if (test.isSetEnded_at()) {
+            testInfo.setEndedAt(new Date(test.getEnded_at()));
+        }
+        return testInfo;
+    }
+}
@@ -0,0 +1,174 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+import com.google.gson.Gson;
+import galen.api.server.thrift.NodeType;
+import galen.api.server.thrift.ReportNode;
+import galen.api.server.thrift.TestRecord;
+import net.mindengine.galen.reports.model.LayoutReport;
+import org.apache.thrift.TDeserializer;
+import org.apache.thrift.TException;
+import org.apache.thrift.TSerializer;
+import org.apache.thrift.protocol.TJSONProtocol;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.File;
+import java.io.FileNotFoundException;
+import java.io.IOException;
+import java.nio.charset.Charset;
+import java.util.*;
+
+import static galen.api.server.utils.StringUtils.sha256;
+import static galen.api.server.utils.StringUtils.toHex;
+
+/**
+ * Writes and reads report shards, which let the tests reported by several workers or services be merged into a single
+ * HTML report. A shard is a folder holding a JSON file per test, with its report tree and the layout reports it refers
+ * to, along with copies of the screenshots and files attached, so that it does not depend on the host it was written
+ * on.
+ */
+public class ReportShards {
+    private static final Logger log = LoggerFactory.getLogger(ReportShards.class);
+
+    private static final String TESTS_FOLDER = "tests";
+    private static final String FILES_FOLDER = "files";
+    private static final Charset UTF_8 = Charset.forName("UTF-8");
+
+    private static final Gson gson = new Gson();
+
+    /**
+     * Writes the given tests to a shard, replacing the tests of the same name already in it.
+     */
+    public static void write(List<TestRecord> tests, Map<String, LayoutReport> layoutReports, File shardFolder)
+            throws IOException, TException {
+        File testsFolder = new File(shardFolder, TESTS_FOLDER);
+        File filesFolder = new File(shardFolder, FILES_FOLDER);
+        if (!testsFolder.isDirectory() && !testsFolder.mkdirs()
+                || !filesFolder.isDirectory() && !filesFolder.mkdirs()) {
+            throw new IOException("Could not create report shard " + shardFolder);
+        }
+        TSerializer serializer = new TSerializer(new TJSONProtocol.Factory());
+        for (TestRecord test : tests) {
+            TestRecord shardTest = test.deepCopy();
+            if (shardTest.getReport_tree() != null) {
+                for (ReportNode node : shardTest.getReport_tree().getNodes()) {
+                    LayoutReport layoutReport = layoutReports.get(node.getUnique_id());
+                    if (node.getNode_type() == NodeType.LAYOUT && layoutReport != null) {
+                        shardTest.putToLayout_reports(node.getUnique_id(),
+                                layoutReportJson(layoutReport, filesFolder, node.getUnique_id()));
+                    }
+                    if (node.getAttachment() != null) {
+                        List<String> attachments = new ArrayList<String>();
+                        for (String attachment : node.getAttachment()) {
+                            File file = new File(attachment);
+                            attachments.add(copyToShard(file, filesFolder,
+                                    node.getUnique_id() + "-" + attachments.size() + "-" + file.getName()));
+                        }
+                        node.setAttachment(attachments);
+                    }
+                }
+            }
+            Files.write(serializer.serialize(shardTest), new File(testsFolder, fileNameOf(test.getTest_name())));
+        }
+        log.info("Wrote " + tests.size() + " tests to report shard " + shardFolder);
+    }
+
+    /**
+     * Reads the tests of several shards. The layout reports they refer to are put in the given map.
+     */
+    public static List<TestRecord> read(List<File> shardFolders, Map<String, LayoutReport> layoutReports)
+            throws IOException, TException {
+        TDeserializer deserializer = new TDeserializer(new TJSONProtocol.Factory());
+        List<TestRecord> tests = new ArrayList<TestRecord>();
+        for (File shardFolder : shardFolders) {
+            File[] testFiles = new File(shardFolder, TESTS_FOLDER).listFiles();
+            if (testFiles == null) {
+                throw new FileNotFoundException("Not a report shard: " + shardFolder);
+            }
+            Arrays.sort(testFiles);
+            for (File testFile : testFiles) {
+                TestRecord test = new TestRecord();
+                deserializer.deserialize(test, Files.toByteArray(testFile));
+                if (test.getReport_tree() != null) {
+                    for (ReportNode node : test.getReport_tree().getNodes()) {
+                        if (node.getAttachment() != null) {
+                            List<String> attachments = new ArrayList<String>();
+                            for (String attachment : node.getAttachment()) {
+                                attachments.add(resolve(shardFolder, attachment));
+                            }
+                            node.setAttachment(attachments);
+                        }
+                    }
+                }
+                if (test.getLayout_reports() != null) {
+                    for (Map.Entry<String, String> entry : test.getLayout_reports().entrySet()) {
+                        LayoutReport layoutReport = gson.fromJson(entry.getValue(), LayoutReport.class);
+                        if (layoutReport.getScreenshot() != null) {
+                            layoutReport.setScreenshot(resolve(shardFolder, layoutReport.getScreenshot()));
+                        }
+                        layoutReports.put(entry.getKey(), layoutReport);
+                    }
+                    test.unsetLayout_reports();
+                }
+                tests.add(test);
+            }
+        }
+        return tests;
+    }
+
+    private static String layoutReportJson(LayoutReport layoutReport, File filesFolder, String reportId)
+            throws IOException {
+        LayoutReport shardReport = gson.fromJson(gson.toJson(layoutReport), LayoutReport.class);
+        if (shardReport.getScreenshot() != null) {
+            File screenshot = new File(shardReport.getScreenshot());
+            shardReport.setScreenshot(copyToShard(screenshot, filesFolder, reportId + ".png"));
+        }
+        return gson.toJson(shardReport);
+    }
+
+    /**
+     * Copies a file to the shard.
+     * @return the path of the copy relative to the shard, or the original path when the file does not exist.
+     */
+    private static String copyToShard(File file, File filesFolder, String name) throws IOException {
+        if (!file.isFile()) {
+            log.warn("File not found, it is not copied to the report shard: " + file);
+            return file.getPath();
+        }
+        File copy = new File(filesFolder, name);
+        if (!copy.isFile()) {
+            Files.copy(file, copy);
+        }
+        return FILES_FOLDER + "/" + name;
+    }
+
+    private static String resolve(File shardFolder, String path) {
+        return new File(path).isAbsolute() ? path : new File(shardFolder, path).getPath();
+    }
+
+    private static String fileNameOf(String testName) {
+        String readableName = testName.replaceAll("[^A-Za-z0-9._-]+", "_");
+        if (readableName.length() > 64) {
+            readableName = readableName.substring(0, 64);
+        }
+        return readableName + "-" + toHex(sha256().digest(testName.getBytes(UTF_8))).substring(0, 12) + ".json";
+    }
+}
@@ -0,0 +1,95 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+
+import java.io.File;
+import java.io.IOException;
+import java.util.LinkedList;
+
+import static galen.api.server.utils.FileUtils.deleteRecursively;
+import static galen.api.server.utils.StringUtils.generateUniqueString;
+
+/**
+ * Keeps the screenshots saved for report attachments, which are read when the report is built. Once they take more
+ * than the maximum size, the oldest are deleted, as the tests attaching them have most likely been reported already.
+ * Each server keeps them in a directory of its own, deleted when it exits.
+ */
+public class ScreenshotStore {
+
+    public static final long DEFAULT_MAX_SIZE_BYTES = 512L * 1024 * 1024;
+
+    private final File directory;
+    private final long maxSizeBytes;
+    private final LinkedList<File> screenshots = new LinkedList<File>();
+    private long sizeBytes;
+    private boolean created;
+
+    public ScreenshotStore(File directory, long maxSizeBytes) {
+        this.directory = directory;
+        this.maxSizeBytes = maxSizeBytes;
+    }
+
+    /**
+     * @return a store in a new directory of the system temp folder.
+     */
+    public static ScreenshotStore inTemporaryDirectory() {
+        return new ScreenshotStore(new File(System.getProperty("java.io.tmpdir"),
+                "galen-api-screenshots-" + generateUniqueString()), DEFAULT_MAX_SIZE_BYTES);
+    }
+
+    /**
+     * Saves a screenshot, deleting the oldest ones if the store grows beyond its maximum size.
+     * @return the PNG file.
+     */
+    public File save(byte[] screenshot) throws IOException {
+        createDirectory();
+        File file = File.createTempFile("screenshot-", ".png", directory);
+        Files.write(screenshot, file);
+        synchronized (this) {
+            screenshots.add(file);
+            sizeBytes += screenshot.length;
+            while (sizeBytes > maxSizeBytes && screenshots.size() > 1) {
+                File oldest = screenshots.removeFirst();
+                sizeBytes -= oldest.length();
+                oldest.delete();
+            }
+        }
+        return file;
+    }
+
+    /**
+     * Creates the directory the first time a screenshot is saved, along with a single hook deleting it on exit, rather
+     * than one delete on exit entry per file.
+     */
+    private synchronized void createDirectory() throws IOException {
+        if (created) {
+            return;
+        }
+        if (!directory.isDirectory() && !directory.mkdirs()) {
+            throw new IOException("Could not create " + directory);
+        }
+        Runtime.getRuntime().addShutdownHook(new Thread("screenshots cleanup") {
+            @Override
+            public void run() {
+                deleteRecursively(directory);
+            }
+        });
+        created = true;
+    }
+}
@@ -0,0 +1,129 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+import galen.api.server.thrift.SpecFile;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.File;
+import java.io.IOException;
+import java.nio.charset.Charset;
+import java.security.MessageDigest;
+import java.util.*;
+import java.util.concurrent.ConcurrentHashMap;
+
+import static galen.api.server.utils.FileUtils.deleteRecursively;
+import static galen.api.server.utils.StringUtils.generateUniqueString;
+import static galen.api.server.utils.StringUtils.sha256;
+import static galen.api.server.utils.StringUtils.toHex;
+import static java.lang.String.format;
+
+/**
+ * Stores the specs uploaded by clients which do not share a file system with the service. A spec is uploaded along
+ * with the files it imports as a bundle addressed by the hash of its content. A bundle is written to disk the first
+ * time it is received and is reused by later uploads of the same content, so that checks always read specs from a
+ * local path.
+ */
+public class SpecStore {
+    private static final Logger log = LoggerFactory.getLogger(SpecStore.class);
+
+    public static final File DEFAULT_DIRECTORY = new File(System.getProperty("java.io.tmpdir"), "galen-api-specs");
+
+    private static final Charset UTF_8 = Charset.forName("UTF-8");
+
+    private final File directory;
+    private final Map<String, File> bundles = new ConcurrentHashMap<String, File>();
+
+    public SpecStore(File directory) {
+        this.directory = directory;
+    }
+
+    /**
+     * Stores a bundle of spec files, unless a bundle with the same content is already stored.
+     * @param specPath path of the spec to be checked, relative to the root of the bundle.
+     * @param files the spec and the files it imports, with paths relative to the root of the bundle.
+     * @return the local path of the spec.
+     * @throws IllegalArgumentException when the spec is not part of the bundle or a file lies outside of it.
+     */
+    public String store(String specPath, List<SpecFile> files) throws IOException {
+        List<SpecFile> sortedFiles = new ArrayList<SpecFile>(files);
+        Collections.sort(sortedFiles, new Comparator<SpecFile>() {
+            @Override
+            public int compare(SpecFile first, SpecFile second) {
+                return first.getPath().compareTo(second.getPath());
+            }
+        });
+        MessageDigest digest = sha256();
+        for (SpecFile file : sortedFiles) {
+            digest.update(file.getPath().getBytes(UTF_8));
+            digest.update((byte) 0);
+            digest.update(file.getContent().getBytes(UTF_8));
+            digest.update((byte) 0);
+        }
+        String hash = toHex(digest.digest());
+        File bundle = bundles.get(hash);
+        if (bundle == null) {
+            bundle = write(hash, sortedFiles);
+            bundles.put(hash, bundle);
+        }
+        File spec = resolve(bundle, specPath);
+        if (!spec.isFile()) {
+            throw new IllegalArgumentException(format("Spec %s is not part of the uploaded files", specPath));
+        }
+        return spec.getPath();
+    }
+
+    /**
+     * Writes the files of a bundle to a temporary folder which is then renamed, so that a bundle folder found on disk,
+     * possibly by a later run of the service, is always complete.
+     */
+    private File write(String hash, List<SpecFile> files) throws IOException {
+        File bundle = new File(directory, hash);
+        if (bundle.isDirectory()) {
+            return bundle;
+        }
+        File temporaryBundle = new File(directory, hash + "." + generateUniqueString() + ".tmp");
+        if (!temporaryBundle.mkdirs()) {
+            throw new IOException("Could not create folder " + temporaryBundle);
+        }
+        try {
+            for (SpecFile file : files) {
+                File target = resolve(temporaryBundle, file.getPath());
+                Files.createParentDirs(target);
+                Files.write(file.getContent(), target, UTF_8);
+            }
+            if (!temporaryBundle.renameTo(bundle) && !bundle.isDirectory()) {
+                throw new IOException("Could not store specs in " + bundle);
+            }
+        } finally {
+            deleteRecursively(temporaryBundle);
+        }
+        log.info(format("Stored %d spec files in %s", files.size(), bundle));
+        return bundle;
+    }
+
+    private static File resolve(File bundle, String path) throws IOException {
+        File file = new File(bundle, path).getCanonicalFile();
+        if (new File(path).isAbsolute() || !file.getPath().startsWith(bundle.getCanonicalPath() + File.separator)) {
+            throw new IllegalArgumentException(format("Spec file %s lies outside of the uploaded files", path));
+        }
+        return file;
+    }
+}
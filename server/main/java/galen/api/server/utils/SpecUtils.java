@@ -0,0 +1,43 @@
+/****************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ****************************************************************************/
+
+
+package galen.api.server.utils;
+
+import java.util.ArrayList;
+import java.util.List;
+
+public class SpecUtils {
+
+    /**
+     * Returns the files referenced by a spec line importing other specs or running scripts, in both the
+     * "@@ import a.spec" and "@import a.spec" syntaxes. Paths are relative to the folder of the spec.
+     */
+    public static List<String> referencedFiles(String line) {
+        List<String> files = new ArrayList<String>();
+        String directive = line.trim();
+        if (directive.startsWith("@@")) {
+            directive = "@" + directive.substring(2).trim();
+        }
+        String[] tokens = directive.split("[\\s,]+");
+        if (tokens[0].equals("@import") || tokens[0].equals("@script")) {
+            for (int i = 1; i < tokens.length; i++) {
+                files.add(tokens[i]);
+            }
+        }
+        return files;
+    }
+}
@@ -15,12 +15,33 @@
  ****************************************************************************/
 
 package galen.api.server.utils;
+
+import java.security.MessageDigest;
+import java.security.NoSuchAlgorithmException;
 import java.util.UUID;
 
+import static java.lang.String.format;
+
 public class StringUtils {
 
     public static String generateUniqueString() {
         String uniqueKey = UUID.randomUUID().toString();
         return uniqueKey.replaceAll("-", "");
     }
+
+    public static MessageDigest sha256() {
+        try {
+            return MessageDigest.getInstance("SHA-256");
+        } catch (NoSuchAlgorithmException e) {
+            throw new IllegalStateException(e);
+        }
+    }
+
+    public static String toHex(byte[] bytes) {
+        StringBuilder hex = new StringBuilder();
+        for (byte b : bytes) {
+            hex.append(format("%02x", b));
+        }
+        return hex.toString();
+    }
 }
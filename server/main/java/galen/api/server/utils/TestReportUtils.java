@@ -16,61 +16,92 @@
 
 package galen.api.server.utils;
 
-import com.google.common.base.Predicate;
-import com.google.common.collect.Iterables;
+import com.google.common.base.Function;
+import com.google.common.collect.ListMultimap;
+import com.google.common.collect.Multimaps;
 import galen.api.server.GalenReportsContainer;
 import galen.api.server.thrift.ReportNode;
 import galen.api.server.thrift.ReportTree;
 import net.mindengine.galen.reports.TestReport;
+import net.mindengine.galen.reports.model.LayoutReport;
 import net.mindengine.galen.reports.nodes.TestReportNode;
 import net.mindengine.galen.reports.nodes.TextReportNode;
+import org.slf4j.Logger;
+import org.slf4j.LoggerFactory;
+
+import java.io.File;
+import java.util.List;
+import java.util.Map;
 
 import static galen.api.server.thrift.NodeType.LAYOUT;
 import static galen.api.server.thrift.NodeType.TEXT;
 
 
 public class TestReportUtils {
+    private static final Logger log = LoggerFactory.getLogger(TestReportUtils.class);
 
     public static void buildTestReportFromReportTree(TestReport testReport, ReportTree reportTree, final String parentNodeUniqueId) {
-        Iterable<ReportNode> childrenNodes = filterChildrenNodes(reportTree, parentNodeUniqueId);
+        buildTestReportFromReportTree(testReport, reportTree, parentNodeUniqueId,
+                GalenReportsContainer.get().getLayoutReports());
+    }
 
-        for (ReportNode node : childrenNodes) {
+    /**
+     * Builds the test report of a tree whose layout nodes refer to the given layout reports. Nodes may come in any
+     * order, children being kept in the order they appear in the tree.
+     */
+    public static void buildTestReportFromReportTree(TestReport testReport, ReportTree reportTree,
+                                                     String parentNodeUniqueId,
+                                                     Map<String, LayoutReport> layoutReports) {
+        if (reportTree.getNodes() != null) {
+            buildSection(testReport, indexByParent(reportTree), parentNodeUniqueId, layoutReports);
+        }
+    }
+
+    private static void buildSection(TestReport testReport, ListMultimap<String, ReportNode> nodesByParent,
+                                     String parentNodeUniqueId, Map<String, LayoutReport> layoutReports) {
+        for (ReportNode node : nodesByParent.get(parentNodeUniqueId)) {
             if (node.getNodes_ids().size() == 0) {
-                processLeaf(node, testReport);
+                processLeaf(node, testReport, layoutReports);
             } else {
-                processNode(node, testReport, reportTree);
+                testReport.sectionStart(node.getName());
+                buildSection(testReport, nodesByParent, node.getUnique_id(), layoutReports);
+                testReport.sectionEnd();
             }
         }
     }
 
-    private static Iterable<ReportNode> filterChildrenNodes(ReportTree reportTree, final String parentNodeUniqueId) {
-        return Iterables.filter(reportTree.getNodes(), new Predicate<ReportNode>() {
+    private static ListMultimap<String, ReportNode> indexByParent(ReportTree reportTree) {
+        return Multimaps.index(reportTree.getNodes(), new Function<ReportNode, String>() {
             @Override
-            public boolean apply(ReportNode node) {
-                return node.getParent_id().equals(parentNodeUniqueId);
+            public String apply(ReportNode node) {
+                return node.getParent_id();
             }
         });
     }
 
-    private static void processLeaf(ReportNode node, TestReport testReport) {
+    private static void processLeaf(ReportNode node, TestReport testReport, Map<String, LayoutReport> layoutReports) {
         switch (node.getNode_type()) {
             case LAYOUT:
-                testReport.layout(GalenReportsContainer.get().fetchLayoutReport(node.unique_id), node.getName());
+                testReport.layout(withExistingScreenshot(layoutReports.get(node.unique_id)), node.getName());
                 break;
             case TEXT:
                 break;
             case NODE:
                 if (node.getNode_type().equals(LAYOUT)) {
-                    testReport.layout(GalenReportsContainer.get().fetchLayoutReport(node.unique_id), node.getName());
+                    testReport.layout(layoutReports.get(node.unique_id), node.getName());
                 } else if (node.getNode_type().equals(TEXT)) {
                     testReport.addNode(new TextReportNode(testReport.getFileStorage(), node.name));
                 } else {
+                    TestReportNode reportNode = null;
                     if (node.getStatus().equals(TestReportNode.Status.INFO.toString())) {
-                        testReport.info(node.getName());
+                        reportNode = testReport.info(node.getName());
                     } else if (node.getStatus().equals(TestReportNode.Status.WARN.toString())) {
-                        testReport.warn(node.getName());
+                        reportNode = testReport.warn(node.getName());
                     } else if (node.getStatus().equals(TestReportNode.Status.ERROR.toString())) {
-                        testReport.error(node.getName());
+                        reportNode = testReport.error(node.getName());
+                    }
+                    if (reportNode != null) {
+                        attachFiles(reportNode, node.getAttachment());
                     }
                 }
                 break;
@@ -78,9 +109,33 @@ public class TestReportUtils {
         }
     }
 
-    private static void processNode(ReportNode node, TestReport testReport, ReportTree reportTree) {
-        testReport.sectionStart(node.getName());
-        buildTestReportFromReportTree(testReport, reportTree, node.getUnique_id());
-        testReport.sectionEnd();
+    /**
+     * Drops the screenshot of a layout report when it no longer exists, e.g. because the cache entry it came from was
+     * evicted, so that the report is rendered without it.
+     */
+    private static LayoutReport withExistingScreenshot(LayoutReport layoutReport) {
+        if (layoutReport != null && layoutReport.getScreenshot() != null
+                && !new File(layoutReport.getScreenshot()).isFile()) {
+            log.warn("Screenshot not found: " + layoutReport.getScreenshot());
+            layoutReport.setScreenshot(null);
+        }
+        return layoutReport;
+    }
+
+    /**
+     * Attaches the files referenced by a node. Attachments travel as paths rather than as their content.
+     */
+    private static void attachFiles(TestReportNode reportNode, List<String> attachments) {
+        if (attachments == null) {
+            return;
+        }
+        for (String attachment : attachments) {
+            File file = new File(attachment);
+            if (file.isFile()) {
+                reportNode.withAttachment(file.getName(), file);
+            } else {
+                log.warn("Attachment not found: " + attachment);
+            }
+        }
     }
 }
@@ -0,0 +1,91 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+import galen.api.server.thrift.GalenApiRemoteService;
+import org.apache.thrift.protocol.TBinaryProtocol;
+import org.apache.thrift.server.TServer;
+import org.apache.thrift.transport.TFramedTransport;
+import org.apache.thrift.transport.TServerSocket;
+import org.apache.thrift.transport.TSocket;
+import org.apache.thrift.transport.TTransport;
+import org.testng.annotations.AfterMethod;
+import org.testng.annotations.BeforeMethod;
+import org.testng.annotations.Test;
+
+import java.io.File;
+import java.util.ArrayList;
+import java.util.List;
+
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.is;
+
+public class BoundedProcessorTest {
+
+    private static final int WORKER_THREADS = 2;
+
+    private TServer server;
+    private int port;
+    private final List<TTransport> transports = new ArrayList<TTransport>();
+
+    @BeforeMethod
+    public void setUp() throws Exception {
+        File folder = Files.createTempDir();
+        GalenCommandExecutor handler = new GalenCommandExecutor(
+                new LayoutReportCache(new File(folder, "cache"), LayoutReportCache.DEFAULT_MAX_SIZE_BYTES),
+                new SpecStore(new File(folder, "specs")));
+        TServerSocket serverSocket = new TServerSocket(0);
+        port = serverSocket.getServerSocket().getLocalPort();
+        server = GalenApiServer.threadPerConnectionServer(serverSocket,
+                new GalenApiRemoteService.Processor<GalenCommandExecutor>(handler), WORKER_THREADS);
+        Thread serving = new Thread(new Runnable() {
+            @Override
+            public void run() {
+                server.serve();
+            }
+        });
+        serving.setDaemon(true);
+        serving.start();
+        while (!server.isServing()) {
+            Thread.sleep(10);
+        }
+    }
+
+    @AfterMethod
+    public void tearDown() {
+        for (TTransport transport : transports) {
+            transport.close();
+        }
+        server.stop();
+    }
+
+    @Test(timeOut = 20000)
+    public void callsAreServedWhileMoreConnectionsThanWorkersAreIdle() throws Exception {
+        for (int i = 0; i < WORKER_THREADS * 2; i++) {
+            assertThat("Idle connection " + i + " should be served", connect().active_drivers(), is(0));
+        }
+        assertThat("Call should be served", connect().active_drivers(), is(0));
+    }
+
+    private GalenApiRemoteService.Client connect() throws Exception {
+        TTransport transport = new TFramedTransport(new TSocket("localhost", port));
+        transport.open();
+        transports.add(transport);
+        return new GalenApiRemoteService.Client(new TBinaryProtocol(transport));
+    }
+}
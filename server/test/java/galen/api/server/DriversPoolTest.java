@@ -0,0 +1,133 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import org.openqa.selenium.WebDriver;
+import org.openqa.selenium.remote.Command;
+import org.openqa.selenium.remote.CommandExecutor;
+import org.openqa.selenium.remote.DesiredCapabilities;
+import org.openqa.selenium.remote.DriverCommand;
+import org.openqa.selenium.remote.RemoteWebDriver;
+import org.openqa.selenium.remote.Response;
+import org.openqa.selenium.remote.SessionId;
+import org.openqa.selenium.remote.SessionNotFoundException;
+import org.testng.annotations.AfterMethod;
+import org.testng.annotations.BeforeMethod;
+import org.testng.annotations.Test;
+
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.UUID;
+
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.contains;
+import static org.hamcrest.Matchers.is;
+import static org.hamcrest.Matchers.sameInstance;
+
+public class DriversPoolTest {
+
+    private static final long SESSION_TIMEOUT_MILLIS = 50;
+
+    private final DriversPool driversPool = DriversPool.get();
+    private RecordingExecutor executor;
+    private RemoteWebDriver driver;
+    private String sessionId;
+
+    @BeforeMethod
+    public void setUp() {
+        executor = new RecordingExecutor(UUID.randomUUID().toString());
+        driver = new RemoteWebDriver(executor, DesiredCapabilities.chrome());
+        sessionId = driver.getSessionId().toString();
+        driversPool.set(driver);
+    }
+
+    @AfterMethod
+    public void tearDown() {
+        driversPool.removeDriverBySessionId(sessionId);
+    }
+
+    @Test
+    public void reaperQuitsSessionsUnusedForLongerThanTheTimeout() throws Exception {
+        int activeDrivers = driversPool.activeDrivers();
+        Thread.sleep(SESSION_TIMEOUT_MILLIS * 2);
+
+        assertThat(driversPool.reapIdleSessions(SESSION_TIMEOUT_MILLIS), is(1));
+        assertThat(driversPool.activeDrivers(), is(activeDrivers - 1));
+        assertThat(executor.commands, contains(DriverCommand.NEW_SESSION, DriverCommand.QUIT));
+    }
+
+    @Test
+    public void reaperLeavesSessionsInUse() throws Exception {
+        Thread.sleep(SESSION_TIMEOUT_MILLIS * 2);
+        assertThat(driversPool.acquire(sessionId), is(sameInstance((WebDriver) driver)));
+        driversPool.release(sessionId);
+
+        assertThat(driversPool.reapIdleSessions(SESSION_TIMEOUT_MILLIS), is(0));
+        assertThat(executor.commands, contains(DriverCommand.NEW_SESSION));
+    }
+
+    @Test
+    public void reaperLeavesSessionsWithCallsInFlight() throws Exception {
+        driversPool.acquire(sessionId);
+        Thread.sleep(SESSION_TIMEOUT_MILLIS * 2);
+
+        assertThat(driversPool.reapIdleSessions(SESSION_TIMEOUT_MILLIS), is(0));
+        driversPool.release(sessionId);
+        Thread.sleep(SESSION_TIMEOUT_MILLIS * 2);
+        assertThat(driversPool.reapIdleSessions(SESSION_TIMEOUT_MILLIS), is(1));
+    }
+
+    @Test(expectedExceptions = SessionNotFoundException.class)
+    public void reapedSessionCannotBeUsed() throws Exception {
+        Thread.sleep(SESSION_TIMEOUT_MILLIS * 2);
+        driversPool.reapIdleSessions(SESSION_TIMEOUT_MILLIS);
+
+        driversPool.acquire(sessionId);
+    }
+
+    @Test
+    public void removingReapedSessionIsANoOp() throws Exception {
+        Thread.sleep(SESSION_TIMEOUT_MILLIS * 2);
+        driversPool.reapIdleSessions(SESSION_TIMEOUT_MILLIS);
+        int activeDrivers = driversPool.activeDrivers();
+
+        driversPool.removeDriverBySessionId(sessionId);
+        assertThat(driversPool.activeDrivers(), is(activeDrivers));
+    }
+
+    /**
+     * Stands in for a remote browser, answering every command successfully and recording its name.
+     */
+    private static class RecordingExecutor implements CommandExecutor {
+        private final String sessionId;
+        private final List<String> commands = new ArrayList<String>();
+
+        RecordingExecutor(String sessionId) {
+            this.sessionId = sessionId;
+        }
+
+        @Override
+        public Response execute(Command command) {
+            commands.add(command.getName());
+            Response response = new Response(new SessionId(sessionId));
+            response.setStatus(0);
+            response.setValue(new HashMap<String, Object>());
+            return response;
+        }
+    }
+}
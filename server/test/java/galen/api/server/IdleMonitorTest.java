@@ -0,0 +1,65 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import org.testng.annotations.AfterMethod;
+import org.testng.annotations.Test;
+
+import java.util.concurrent.CountDownLatch;
+import java.util.concurrent.TimeUnit;
+
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.is;
+
+public class IdleMonitorTest {
+
+    private static final long IDLE_TIMEOUT_MILLIS = 100;
+
+    private final CountDownLatch shutdown = new CountDownLatch(1);
+    private final IdleMonitor idleMonitor = new IdleMonitor(IDLE_TIMEOUT_MILLIS, new Runnable() {
+        @Override
+        public void run() {
+            shutdown.countDown();
+        }
+    });
+
+    @AfterMethod
+    public void tearDown() {
+        idleMonitor.stop();
+    }
+
+    @Test
+    public void stopsTheServiceOnceIdleForTheTimeout() throws Exception {
+        long startedAt = System.currentTimeMillis();
+        idleMonitor.start();
+
+        assertThat(shutdown.await(IDLE_TIMEOUT_MILLIS * 50, TimeUnit.MILLISECONDS), is(true));
+        assertThat(System.currentTimeMillis() - startedAt >= IDLE_TIMEOUT_MILLIS, is(true));
+    }
+
+    @Test
+    public void doesNotStopTheServiceWhileALeaseIsLive() throws Exception {
+        String leaseId = Leases.get().acquire(IDLE_TIMEOUT_MILLIS * 100);
+        try {
+            idleMonitor.start();
+            assertThat(shutdown.await(IDLE_TIMEOUT_MILLIS * 5, TimeUnit.MILLISECONDS), is(false));
+        } finally {
+            Leases.get().release(leaseId);
+        }
+        assertThat(shutdown.await(IDLE_TIMEOUT_MILLIS * 50, TimeUnit.MILLISECONDS), is(true));
+    }
+}
@@ -0,0 +1,168 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.collect.Lists;
+import com.google.common.io.Files;
+import galen.api.server.thrift.NodeType;
+import galen.api.server.thrift.ReportNode;
+import galen.api.server.thrift.ReportTree;
+import galen.api.server.thrift.TestRecord;
+import net.mindengine.galen.reports.model.LayoutReport;
+import org.testng.annotations.BeforeMethod;
+import org.testng.annotations.Test;
+
+import javax.imageio.ImageIO;
+import java.awt.image.BufferedImage;
+import java.io.File;
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.Date;
+import java.util.List;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+
+import static java.util.Arrays.asList;
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.arrayContainingInAnyOrder;
+import static org.hamcrest.Matchers.is;
+import static org.hamcrest.Matchers.lessThanOrEqualTo;
+import static org.hamcrest.Matchers.notNullValue;
+import static org.hamcrest.Matchers.nullValue;
+
+public class LayoutReportCacheTest {
+
+    private static final String KEY = "key";
+    private static final String ROOT_ID = "rootId";
+
+    private File folder;
+    private File cacheDirectory;
+    private File screenshot;
+
+    @BeforeMethod
+    public void setUp() throws Exception {
+        folder = Files.createTempDir();
+        cacheDirectory = new File(folder, "cache");
+        screenshot = new File(folder, "screenshot.png");
+        ImageIO.write(new BufferedImage(20, 10, BufferedImage.TYPE_INT_RGB), "png", screenshot);
+    }
+
+    @Test
+    public void putLeavesTheReportOfTheCheckUntouched() throws Exception {
+        LayoutReport layoutReport = checkResult();
+        new LayoutReportCache(cacheDirectory, LayoutReportCache.DEFAULT_MAX_SIZE_BYTES).put(KEY, layoutReport);
+
+        assertThat(layoutReport.getScreenshot(), is(screenshot.getAbsolutePath()));
+        assertThat(new File(cacheDirectory, KEY + ".png").isFile(), is(true));
+    }
+
+    @Test
+    public void cachedReportPointsAtTheCachedScreenshot() throws Exception {
+        LayoutReportCache cache = new LayoutReportCache(cacheDirectory, LayoutReportCache.DEFAULT_MAX_SIZE_BYTES);
+        LayoutReport layoutReport = checkResult();
+        cache.put(KEY, layoutReport);
+        LayoutReport cachedReport = cache.get(KEY);
+
+        assertThat(cache.hits(), is(1L));
+        assertThat(cachedReport.errors(), is(layoutReport.errors()));
+        assertThat(cachedReport.warnings(), is(layoutReport.warnings()));
+        assertThat(cachedReport.getScreenshot(), is(new File(cacheDirectory, KEY + ".png").getAbsolutePath()));
+        assertThat(Files.equal(new File(cachedReport.getScreenshot()), screenshot), is(true));
+    }
+
+    @Test
+    public void cachedReportIsRenderedOnceItsEntryIsEvicted() throws Exception {
+        LayoutReportCache cache = new LayoutReportCache(cacheDirectory, LayoutReportCache.DEFAULT_MAX_SIZE_BYTES);
+        cache.put(KEY, checkResult());
+        LayoutReport cachedReport = cache.get(KEY);
+        new LayoutReportCache(cacheDirectory, 0).put("otherKey", checkResult());
+
+        assertThat(new File(cacheDirectory, KEY + ".json").exists(), is(false));
+        assertThat(new File(cachedReport.getScreenshot()).exists(), is(false));
+
+        File reportFolder = new File(folder, "report");
+        new ReportRenderer(1).render(asList(testRecordWithLayoutNode(KEY)),
+                Collections.singletonMap(KEY, cachedReport), reportFolder);
+        assertThat(new File(reportFolder, "report.html").isFile(), is(true));
+        assertThat(cachedReport.getScreenshot(), is(nullValue()));
+    }
+
+    @Test
+    public void concurrentPutsOfTheSameKeyLeaveASingleCompleteEntry() throws Exception {
+        final LayoutReportCache cache = new LayoutReportCache(cacheDirectory,
+                LayoutReportCache.DEFAULT_MAX_SIZE_BYTES);
+        ExecutorService executor = Executors.newFixedThreadPool(8);
+        List<Future<?>> puts = new ArrayList<Future<?>>();
+        for (int i = 0; i < 32; i++) {
+            puts.add(executor.submit(new Runnable() {
+                @Override
+                public void run() {
+                    cache.put(KEY, checkResult());
+                }
+            }));
+        }
+        for (Future<?> put : puts) {
+            put.get();
+        }
+        executor.shutdown();
+
+        assertThat(cache.get(KEY), is(notNullValue()));
+        assertThat(cacheDirectory.list(), arrayContainingInAnyOrder(KEY + ".json", KEY + ".png"));
+    }
+
+    @Test
+    public void cacheIsKeptWithinItsMaximumSize() throws Exception {
+        new LayoutReportCache(cacheDirectory, LayoutReportCache.DEFAULT_MAX_SIZE_BYTES).put(KEY, checkResult());
+        long entrySize = sizeOf(cacheDirectory);
+        LayoutReportCache cache = new LayoutReportCache(cacheDirectory, entrySize * 3);
+        for (int i = 0; i < 10; i++) {
+            cache.put(KEY + i, checkResult());
+            assertThat(sizeOf(cacheDirectory), is(lessThanOrEqualTo(entrySize * 3)));
+        }
+    }
+
+    @Test
+    public void missingEntryIsAMiss() {
+        LayoutReportCache cache = new LayoutReportCache(cacheDirectory, LayoutReportCache.DEFAULT_MAX_SIZE_BYTES);
+
+        assertThat(cache.get(KEY), is(nullValue()));
+        assertThat(cache.misses(), is(1L));
+        assertThat(cache.hits(), is(0L));
+    }
+
+    private LayoutReport checkResult() {
+        LayoutReport layoutReport = new LayoutReport();
+        layoutReport.setScreenshot(screenshot.getAbsolutePath());
+        return layoutReport;
+    }
+
+    private static long sizeOf(File directory) {
+        long size = 0;
+        for (File file : directory.listFiles()) {
+            size += file.length();
+        }
+        return size;
+    }
+
+    private static TestRecord testRecordWithLayoutNode(String reportId) {
+        ReportNode layoutNode = new ReportNode(reportId, "Layout check", "info", ROOT_ID,
+                Lists.<String>newArrayList(), null, new Date().toString(), NodeType.LAYOUT);
+        long now = System.currentTimeMillis();
+        return new TestRecord("Cached layout check", now, now, new ReportTree(ROOT_ID, asList(layoutNode)), null);
+    }
+}
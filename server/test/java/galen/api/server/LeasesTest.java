@@ -0,0 +1,75 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import org.testng.annotations.Test;
+
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.is;
+
+public class LeasesTest {
+
+    private static final long TTL_MILLIS = 100;
+
+    private final Leases leases = Leases.get();
+
+    @Test
+    public void leaseLastsItsTimeToLive() {
+        int liveLeases = leases.liveLeases();
+        String leaseId = leases.acquire(TTL_MILLIS * 100);
+        try {
+            assertThat(leases.liveLeases(), is(liveLeases + 1));
+            assertThat(leases.renew(leaseId), is(true));
+        } finally {
+            leases.release(leaseId);
+        }
+        assertThat(leases.liveLeases(), is(liveLeases));
+    }
+
+    @Test
+    public void leaseExpiresOnceItsTimeToLiveElapsesWithoutRenewal() throws Exception {
+        int liveLeases = leases.liveLeases();
+        String leaseId = leases.acquire(TTL_MILLIS);
+        Thread.sleep(TTL_MILLIS * 2);
+
+        assertThat(leases.liveLeases(), is(liveLeases));
+        assertThat(leases.renew(leaseId), is(false));
+    }
+
+    @Test
+    public void renewalExtendsTheLease() throws Exception {
+        String leaseId = leases.acquire(TTL_MILLIS * 2);
+        try {
+            for (int i = 0; i < 4; i++) {
+                Thread.sleep(TTL_MILLIS);
+                assertThat("Renewal " + i, leases.renew(leaseId), is(true));
+            }
+        } finally {
+            leases.release(leaseId);
+        }
+    }
+
+    @Test
+    public void unknownLeaseIsNotRenewed() {
+        assertThat(leases.renew("unknown"), is(false));
+    }
+
+    @Test(expectedExceptions = IllegalArgumentException.class)
+    public void leaseMustHaveAPositiveTimeToLive() {
+        leases.acquire(0);
+    }
+}
@@ -0,0 +1,143 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.collect.Lists;
+import com.google.common.io.Files;
+import galen.api.server.thrift.NodeType;
+import galen.api.server.thrift.ReportNode;
+import galen.api.server.thrift.ReportTree;
+import galen.api.server.thrift.TestRecord;
+import net.mindengine.galen.reports.model.LayoutReport;
+import org.testng.annotations.BeforeMethod;
+import org.testng.annotations.Test;
+
+import javax.imageio.ImageIO;
+import java.awt.image.BufferedImage;
+import java.io.File;
+import java.io.FileNotFoundException;
+import java.nio.charset.Charset;
+import java.util.*;
+
+import static java.util.Arrays.asList;
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.contains;
+import static org.hamcrest.Matchers.is;
+import static org.hamcrest.Matchers.startsWith;
+
+public class ReportShardsTest {
+
+    private static final Charset UTF_8 = Charset.forName("UTF-8");
+    private static final String ROOT_ID = "rootId";
+    private static final String LAYOUT_NODE_ID = "layout";
+    private static final String ATTACHMENT_NODE_ID = "attachment";
+
+    private File folder;
+    private File screenshot;
+    private byte[] screenshotBytes;
+    private File attachment;
+    private Map<String, LayoutReport> layoutReports;
+
+    @BeforeMethod
+    public void setUp() throws Exception {
+        folder = Files.createTempDir();
+        screenshot = new File(folder, "screenshot.png");
+        ImageIO.write(new BufferedImage(20, 10, BufferedImage.TYPE_INT_RGB), "png", screenshot);
+        screenshotBytes = Files.toByteArray(screenshot);
+        attachment = new File(folder, "log.txt");
+        Files.write("attachment", attachment, UTF_8);
+        LayoutReport layoutReport = new LayoutReport();
+        layoutReport.setScreenshot(screenshot.getAbsolutePath());
+        layoutReports = new HashMap<String, LayoutReport>();
+        layoutReports.put(LAYOUT_NODE_ID, layoutReport);
+    }
+
+    @Test
+    public void testsOfSeveralShardsAreMerged() throws Exception {
+        File firstShard = new File(folder, "first");
+        File secondShard = new File(folder, "second");
+        TestRecord layoutTest = testRecord("Layout test", NodeType.LAYOUT, LAYOUT_NODE_ID, null);
+        TestRecord attachmentTest = testRecord("Attachment test", NodeType.NODE, ATTACHMENT_NODE_ID,
+                asList(attachment.getAbsolutePath()));
+        ReportShards.write(asList(layoutTest), layoutReports, firstShard);
+        ReportShards.write(asList(attachmentTest), layoutReports, secondShard);
+        deleteOriginalFiles();
+
+        Map<String, LayoutReport> mergedLayoutReports = new HashMap<String, LayoutReport>();
+        List<TestRecord> tests = ReportShards.read(asList(firstShard, secondShard), mergedLayoutReports);
+
+        assertThat(tests.size(), is(2));
+        assertThat(tests.get(0).getTest_name(), is("Layout test"));
+        assertThat(tests.get(0).isSetLayout_reports(), is(false));
+        File shardScreenshot = new File(mergedLayoutReports.get(LAYOUT_NODE_ID).getScreenshot());
+        assertThat(shardScreenshot.getPath(), startsWith(firstShard.getPath()));
+        assertThat(Arrays.equals(Files.toByteArray(shardScreenshot), screenshotBytes), is(true));
+
+        assertThat(tests.get(1).getTest_name(), is("Attachment test"));
+        File shardAttachment = new File(tests.get(1).getReport_tree().getNodes().get(0).getAttachment().get(0));
+        assertThat(shardAttachment.getPath(), startsWith(secondShard.getPath()));
+        assertThat(Files.toString(shardAttachment, UTF_8), is("attachment"));
+        assertThat(attachmentTest.getReport_tree().getNodes().get(0).getAttachment(),
+                contains(attachment.getAbsolutePath()));
+    }
+
+    @Test
+    public void testWrittenAgainReplacesTheOneInTheShard() throws Exception {
+        File shard = new File(folder, "shard");
+        ReportShards.write(asList(testRecord("Test", NodeType.NODE, "first", null)), layoutReports, shard);
+        ReportShards.write(asList(testRecord("Test", NodeType.NODE, "second", null)), layoutReports, shard);
+
+        List<TestRecord> tests = ReportShards.read(asList(shard), new HashMap<String, LayoutReport>());
+        assertThat(tests.size(), is(1));
+        assertThat(tests.get(0).getReport_tree().getNodes().get(0).getUnique_id(), is("second"));
+    }
+
+    @Test
+    public void mergedShardsAreRendered() throws Exception {
+        File shard = new File(folder, "shard");
+        ReportShards.write(asList(testRecord("Layout test", NodeType.LAYOUT, LAYOUT_NODE_ID, null),
+                testRecord("Attachment test", NodeType.NODE, ATTACHMENT_NODE_ID, asList(attachment.getAbsolutePath()))),
+                layoutReports, shard);
+        deleteOriginalFiles();
+
+        Map<String, LayoutReport> mergedLayoutReports = new HashMap<String, LayoutReport>();
+        List<TestRecord> tests = ReportShards.read(asList(shard), mergedLayoutReports);
+        File reportFolder = new File(folder, "report");
+        new ReportRenderer(2).render(tests, mergedLayoutReports, reportFolder);
+
+        assertThat(new File(reportFolder, "report.html").isFile(), is(true));
+    }
+
+    @Test(expectedExceptions = FileNotFoundException.class)
+    public void folderWhichIsNotAShardIsRejected() throws Exception {
+        ReportShards.read(asList(folder), new HashMap<String, LayoutReport>());
+    }
+
+    /**
+     * Shards must not depend on the files of the host they were written on.
+     */
+    private void deleteOriginalFiles() {
+        assertThat(screenshot.delete() && attachment.delete(), is(true));
+    }
+
+    private static TestRecord testRecord(String testName, NodeType nodeType, String nodeId, List<String> attachments) {
+        ReportNode node = new ReportNode(nodeId, testName + " node", "info", ROOT_ID, Lists.<String>newArrayList(),
+                attachments, new Date().toString(), nodeType);
+        long now = System.currentTimeMillis();
+        return new TestRecord(testName, now, now, new ReportTree(ROOT_ID, Lists.newArrayList(node)), null);
+    }
+}
@@ -0,0 +1,58 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+import org.testng.annotations.BeforeMethod;
+import org.testng.annotations.Test;
+
+import java.io.File;
+
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.is;
+
+public class ScreenshotStoreTest {
+
+    private static final byte[] SCREENSHOT = new byte[100];
+
+    private File directory;
+
+    @BeforeMethod
+    public void setUp() {
+        directory = new File(Files.createTempDir(), "screenshots");
+    }
+
+    @Test
+    public void savesScreenshots() throws Exception {
+        File screenshot = new ScreenshotStore(directory, ScreenshotStore.DEFAULT_MAX_SIZE_BYTES).save(SCREENSHOT);
+
+        assertThat(screenshot.getParentFile(), is(directory));
+        assertThat(Files.toByteArray(screenshot), is(SCREENSHOT));
+    }
+
+    @Test
+    public void deletesTheOldestScreenshotsBeyondTheMaximumSize() throws Exception {
+        ScreenshotStore store = new ScreenshotStore(directory, SCREENSHOT.length * 2);
+        File first = store.save(SCREENSHOT);
+        File second = store.save(SCREENSHOT);
+        File third = store.save(SCREENSHOT);
+
+        assertThat(first.exists(), is(false));
+        assertThat(second.isFile(), is(true));
+        assertThat(third.isFile(), is(true));
+    }
+}
@@ -0,0 +1,92 @@
+/***************************************************************************
+ * Copyright 2015 Valerio Morsella                                          *
+ *                                                                          *
+ * Licensed under the Apache License, Version 2.0 (the "License");          *
+ * you may not use this file except in compliance with the License.         *
+ * You may obtain a copy of the License at                                  *
+ *                                                                          *
+ *    http://www.apache.org/licenses/LICENSE-2.0                            *
+ *                                                                          *
+ * Unless required by applicable law or agreed to in writing, software      *
+ * distributed under the License is distributed on an "AS IS" BASIS,        *
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. *
+ * See the License for the specific language governing permissions and      *
+ * limitations under the License.                                           *
+ ***************************************************************************/
+
+package galen.api.server;
+
+import com.google.common.io.Files;
+import galen.api.server.thrift.SpecFile;
+import org.testng.annotations.BeforeMethod;
+import org.testng.annotations.Test;
+
+import java.io.File;
+import java.nio.charset.Charset;
+
+import static java.util.Arrays.asList;
+import static org.hamcrest.MatcherAssert.assertThat;
+import static org.hamcrest.Matchers.is;
+import static org.hamcrest.Matchers.startsWith;
+
+public class SpecStoreTest {
+
+    private static final Charset UTF_8 = Charset.forName("UTF-8");
+    private static final SpecFile SPEC = new SpecFile("specs/home.spec", "@import ../common/header.spec");
+    private static final SpecFile IMPORTED_SPEC = new SpecFile("common/header.spec", "header\n    height 60px");
+
+    private File folder;
+    private File directory;
+    private SpecStore specStore;
+
+    @BeforeMethod
+    public void setUp() {
+        folder = Files.createTempDir();
+        directory = new File(folder, "specs");
+        specStore = new SpecStore(directory);
+    }
+
+    @Test
+    public void storesTheSpecAlongWithTheFilesItImports() throws Exception {
+        File spec = new File(specStore.store(SPEC.getPath(), asList(SPEC, IMPORTED_SPEC)));
+
+        assertThat(spec.getPath(), startsWith(directory.getCanonicalPath()));
+        assertThat(Files.toString(spec, UTF_8), is(SPEC.getContent()));
+        assertThat(Files.toString(new File(spec.getParentFile(), "../common/header.spec"), UTF_8),
+                is(IMPORTED_SPEC.getContent()));
+    }
+
+    @Test
+    public void reusesTheBundleOfTheSameContent() throws Exception {
+        String specPath = specStore.store(SPEC.getPath(), asList(SPEC, IMPORTED_SPEC));
+
+        assertThat(specStore.store(SPEC.getPath(), asList(IMPORTED_SPEC, SPEC)), is(specPath));
+        assertThat(directory.listFiles().length, is(1));
+    }
+
+    @Test(expectedExceptions = IllegalArgumentException.class)
+    public void rejectsFilesOutsideOfTheBundle() throws Exception {
+        try {
+            specStore.store(SPEC.getPath(), asList(SPEC, new SpecFile("../../outside.spec", "outside")));
+        } finally {
+            assertThat(new File(folder, "outside.spec").exists(), is(false));
+            assertThat(directory.listFiles().length, is(0));
+        }
+    }
+
+    @Test(expectedExceptions = IllegalArgumentException.class)
+    public void rejectsAbsoluteFiles() throws Exception {
+        specStore.store(SPEC.getPath(), asList(SPEC, new SpecFile(new File(folder, "absolute.spec").getAbsolutePath(),
+                "absolute")));
+    }
+
+    @Test(expectedExceptions = IllegalArgumentException.class)
+    public void rejectsSpecOutsideOfTheBundle() throws Exception {
+        specStore.store("../specs/home.spec", asList(SPEC));
+    }
+
+    @Test(expectedExceptions = IllegalArgumentException.class)
+    public void rejectsSpecWhichIsNotUploaded() throws Exception {
+        specStore.store("specs/other.spec", asList(SPEC));
+    }
+}
@@ -24,5 +24,6 @@ setup(
     install_requires=get_requirements(),
     package_dir={'':'py'},
     packages=['galenpy', 'galenpy.utils', 'galenpy.pythrift'],
+    entry_points={'console_scripts': ['galenpy-merge-reports = galenpy.merge_reports:main']},
     license = 'Apache License 2.0'
 )
@@ -43,12 +43,23 @@ struct ResponseValue {
     3:Value value
 }
 
+enum ResponseFormat {
+    GRAPH = 1,
+    JSON = 2
+}
+
 struct Response {
 	1:ResponseValue response_value
 	2:list<ResponseValue> contained_values
 	3:string session_id
 	4:i32 status
 	5:string state
+	6:string json_value
+}
+
+struct BatchCommand {
+    1:string command
+    2:string params
 }
 
 enum NodeType {
@@ -68,30 +79,84 @@ struct ReportNode {
     9:NodeType node_type
 }
 
+struct LayoutCheck {
+    1:string specs
+    2:tags included_tags
+    3:tags excluded_tags
+}
+
 struct LayoutCheckReport {
     1:string unique_id
     4:i32 errors
     5:i32 warnings
 }
 
+struct Viewport {
+    1:string name
+    2:i32 width
+    3:i32 height
+    4:tags included_tags
+    5:tags excluded_tags
+}
+
+struct ViewportCheckReport {
+    1:string name
+    2:LayoutCheckReport report
+    3:bool resized
+    4:i64 elapsed_millis
+}
+
 struct ReportTree {
     1:string root_id,
     2:list<ReportNode> nodes
 }
 
+struct TestRecord {
+    1:string test_name
+    2:i64 started_at
+    3:i64 ended_at
+    4:ReportTree report_tree
+    5:map<string, string> layout_reports
+}
+
+struct SpecFile {
+    1:string path
+    2:string content
+}
+
+struct ServerInfo {
+    1:string version
+    2:i64 uptime_millis
+    3:i64 layout_cache_hits
+    4:i64 layout_cache_misses
+}
+
 
 service GalenApiRemoteService {
 	//WebDriver JsonWire over Thrift
     void initialize(1:string remote_server_addr),
-    Response execute(1:string session_id, 2:string command, 3:string params) throws (1:RemoteWebDriverException exc),
+    Response execute(1:string session_id, 2:string command, 3:string params, 4:ResponseFormat response_format) throws (1:RemoteWebDriverException exc),
+    list<Response> execute_batch(1:string session_id, 2:list<BatchCommand> commands, 3:ResponseFormat response_format) throws (1:RemoteWebDriverException exc),
+    binary take_screenshot(1:string session_id) throws (1:RemoteWebDriverException exc),
+    string save_screenshot(1:string session_id) throws (1:RemoteWebDriverException exc),
 
     //Galen check and report API
     void register_test(1:string test_name),
     void append(1:string test_name, 2:ReportTree report_tree),
-    LayoutCheckReport check_layout(1:string webdriver_session_id, 2:string specs, 3:tags included_tags, 4:tags excluded_tags) throws (1:SpecNotFoundException exc),
+    void append_nodes(1:string test_name, 2:ReportTree chunk),
+    LayoutCheckReport check_layout(1:string webdriver_session_id, 2:string specs, 3:tags included_tags, 4:tags excluded_tags, 5:bool use_cache) throws (1:SpecNotFoundException exc),
+    list<LayoutCheckReport> check_layouts(1:string webdriver_session_id, 2:list<LayoutCheck> checks, 3:bool use_cache) throws (1:SpecNotFoundException exc),
+    list<ViewportCheckReport> check_layout_viewports(1:string webdriver_session_id, 2:string specs, 3:list<Viewport> viewports, 4:bool use_cache) throws (1:SpecNotFoundException exc, 2:RemoteWebDriverException driver_exc),
+    string upload_spec(1:string spec_path, 2:list<SpecFile> files) throws (1:SpecNotFoundException exc),
     void generate_report(1:string report_folder_path),
+    void write_report_shard(1:string shard_folder_path),
+    void merge_report_shards(1:list<string> shard_folder_paths, 2:string report_folder_path),
 
     //Service lifecycle
+    ServerInfo server_info(),
     i32 active_drivers(),
+    string acquire_lease(1:i64 ttl_millis),
+    bool renew_lease(1:string lease_id),
+    void release_lease(1:string lease_id),
     void shut_service()
 }